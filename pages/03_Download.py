@@ -1,16 +1,9 @@
 # App/pages/03_Generate_&_Download.py
+import os
 import streamlit as st
 import time
-from utils.processor import (
-    generate_story_text,
-    generate_story_title,
-    extract_scenes_and_prompts,
-    normalize_prompt,
-    generate_audio_from_text_replicate,
-    upload_audio_to_r2,
-    generate_image_for_prompt_openai,
-    create_storybook_pdf_bytes,
-)
+import base64
+from utils.jobs import submit_job, get_job, get_job_events, find_book, retry_job, QUEUED, RUNNING, DONE, FAILED
 import json
 from utils.ui_storage import hydrate_intake_from_localstorage_via_queryparam
 import streamlit as st
@@ -20,6 +13,7 @@ import streamlit as st
 from utils.intake_codec import decode_intake
 from utils.language.loader import get_language
 from utils.ui import render_top_bar, get_app_title
+from worker import start_embedded_worker
 
 PAGE_ID = "download"
 
@@ -107,89 +101,121 @@ st.write(T["ui"]["download_intake_found"])
 st.write(T["ui"]["page_selected"].format(page_length=intake.get("page_length", "N/A")))
 st.info(T["ui"]["download_info"])
 
-# Avoid regen on refresh
-if "pdf_bytes" not in st.session_state:
-    st.session_state.pdf_bytes = None
-if "pdf_filename" not in st.session_state:
-    st.session_state.pdf_filename = None
-
-def do_generate():
-    child_name = intake["child_name"]
-    child_age = intake["child_age"]
-    child_interest = intake["child_interest"]
-    story_objective = intake["story_objective"]
-    your_name = intake["your_name"]
-    page_length = intake["page_length"]
-    lang = intake.get("language", "en")
-
-    # 1) Generate story + title
-    story_text = generate_story_text(
-        child_name, child_age, child_interest, story_objective, your_name,
-        page_length=intake.get("page_length", 4),
-    )
-    story_title = generate_story_title(text=story_text).strip()
-
-    # 2) Extract scenes/prompts
-    expected = intake.get("page_length", 4)
-    scenes, prompts = extract_scenes_and_prompts(story_text, expected_scenes=expected)
-
-    # (Optional) If you want page_length to affect content density, do it inside your processor functions.
-    # For now, we just store it in intake.
-
-    # 3) Audio
-    story_chunk = "\n\n".join(scenes)
-    story_audio = generate_audio_from_text_replicate(story_chunk=story_chunk, lang=lang)
-    story_audio_url = upload_audio_to_r2(
-        audio_bytes=story_audio,
-        filename=f"{story_title.replace(' ', '_')}_audio.mp3"
-    )
-
-    # 4) Cover
-    cover_prompt = (
-        f"Do not include any text in the image. "
-        f"Design a children's storybook cover illustration related to the topic of '{child_interest}'. "
-        f"Do not include any text or human-like characters in the image."
-    )
-    cover_b64 = generate_image_for_prompt_openai(cover_prompt)
-
-    # 5) Scene images
-    images_b64 = []
-    
-    for idx, p in enumerate(prompts):
-        safe_prompt = normalize_prompt(p)
-
-        try:
-            img_b64 = generate_image_for_prompt_openai(p)
-        except Exception:
-            img_b64 = generate_image_for_prompt_openai(safe_prompt)
-
-        images_b64.append(img_b64)
-
-    # 6) PDF bytes
-    pdf_bytes = create_storybook_pdf_bytes(
-        title=story_title,
-        author=your_name,
-        cover_image_b64=cover_b64,
-        scenes=scenes,
-        images_b64=images_b64,
-        story_audio_url=story_audio_url,
-    )
-
-    st.session_state.pdf_bytes = pdf_bytes
-    st.session_state.pdf_filename = f"{story_title.replace(' ', '_')}.pdf"
+# Avoid regen on refresh: the job id survives reruns and page refreshes via ?job=
+if "job_id" not in st.session_state:
+    st.session_state.job_id = st.query_params.get("job")
+
+# Same intake already generated (another session, device or an expired session)?
+if not st.session_state.job_id:
+    book = find_book(intake)
+    if book:
+        st.session_state.job_id = book["id"]
+
+JOB_POLL_SECONDS = 3
+JOB_UNCLAIMED_WARN_SECONDS = float(os.getenv("JOB_UNCLAIMED_WARN_SECONDS", "120"))   # queued this long: no worker is running
+
+# Deployments without worker.py processes run one worker inside this server (see worker.py)
+@st.cache_resource
+def _embedded_worker():
+    return start_embedded_worker()
+
+_embedded_worker()
+
+def submit_generation():
+    # Generation runs in worker.py processes; this page only submits and polls
+    job_id = submit_job(intake)
+    st.session_state.job_id = job_id
+    st.query_params["job"] = job_id
+
+def _job_progress(job: dict) -> dict:
+    """Fold new progress events into session state; only unseen events are fetched."""
+    job_id = job["id"]
+    progress = st.session_state.get("job_progress")
+    # A new attempt starts with a fresh event log
+    if not progress or progress["job_id"] != job_id or progress["attempt"] != job["attempts"]:
+        progress = {"job_id": job_id, "attempt": job["attempts"], "seq": 0, "stages": {}, "thumbnails": {}, "total_scenes": 0}
+
+    for event in get_job_events(job_id, after_seq=progress["seq"]):
+        progress["seq"] = event["seq"]
+        if event["type"] == "stage_started":
+            progress["stages"][event["stage"]] = "running"
+        elif event["type"] == "stage_finished":
+            progress["stages"][event["stage"]] = "done"
+        elif event["type"] == "scene_image":
+            # None when the preview could not be made; the scene still counts as done
+            progress["thumbnails"][event["index"]] = event.get("thumbnail")
+            progress["total_scenes"] = event["total"]
+
+    st.session_state.job_progress = progress
+    return progress
+
+# Polls the job without rerunning the whole page
+@st.fragment(run_every=JOB_POLL_SECONDS)
+def render_job_progress(job_id: str):
+    job = get_job(job_id)
+    if job is None or job["status"] in (DONE, FAILED):
+        # Leave the polling fragment and let the full page render the outcome
+        st.rerun()
+    if job["status"] == QUEUED:
+        st.info(T["ui"]["job_queued"])
+        if job["attempts"] == 0 and time.time() - job["created_at"] > JOB_UNCLAIMED_WARN_SECONDS:
+            st.warning(T["ui"]["job_no_worker"])
+        return
+
+    st.info(T["ui"]["spinner"])
+    progress = _job_progress(job)
+
+    labels = T["ui"]["stage_labels"]
+    finished = sum(1 for stage in labels if progress["stages"].get(stage) == "done")
+    st.progress(finished / len(labels))
+    for stage, label in labels.items():
+        state = progress["stages"].get(stage)
+        icon = "✅" if state == "done" else "⏳" if state == "running" else "▫️"
+        st.write(f"{icon} {label}")
+
+    # Scene illustrations appear as they arrive
+    if progress["total_scenes"]:
+        thumbnails = progress["thumbnails"]
+        st.caption(T["ui"]["scene_progress"].format(done=len(thumbnails), total=progress["total_scenes"]))
+        cols = st.columns(4)
+        previews = [idx for idx in sorted(thumbnails) if thumbnails[idx]]
+        for i, idx in enumerate(previews):
+            cols[i % 4].image(base64.b64decode(thumbnails[idx]), caption=str(idx + 1))
+
+job = get_job(st.session_state.job_id) if st.session_state.job_id else None
 
 # Generate button
-if st.session_state.pdf_bytes is None:
+if job is None:
     if st.button(T["ui"]["generate_button"]):
-        with st.spinner(T["ui"]["spinner"]):
-            do_generate()
-        st.success(T["ui"]["generation_complete"])
+        submit_generation()
+        st.rerun()
+
+elif job["status"] in (QUEUED, RUNNING):
+    render_job_progress(job["id"])
+
+elif job["status"] == FAILED:
+    st.error(T["ui"]["job_failed"])
+    if st.button(T["ui"]["retry_button"]):
+        retry_job(job["id"])
+        st.session_state.pop("job_progress", None)
+        st.rerun()
+
+# The finished PDF was removed from disk (cleanup, redeploy): same fallback as find_book()
+elif job["status"] == DONE and not os.path.exists((job["result"] or {}).get("pdf_path", "")):
+    st.warning(T["ui"]["job_pdf_missing"])
+    if st.button(T["ui"]["generate_button"]):
+        submit_generation()
+        st.session_state.pop("job_progress", None)
+        st.rerun()
 
 # Download button (enabled when ready)
-if st.session_state.pdf_bytes:
+elif job["status"] == DONE:
+    st.success(T["ui"]["generation_complete"])
+    with open(job["result"]["pdf_path"], "rb") as f:
+        pdf_bytes = f.read()
     st.download_button(
         label=T["ui"]["download_button"],
-        data=st.session_state.pdf_bytes,
-        file_name=st.session_state.pdf_filename or "storybook.pdf",
+        data=pdf_bytes,
+        file_name=job["result"]["pdf_filename"] or "storybook.pdf",
         mime="application/pdf",
-    )
\ No newline at end of file
+    )
@@ -0,0 +1,73 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+# Minimal configuration utils/processor.py reads at import time
+TEST_SECRETS = {
+    "OPENAI_API_KEY": "test",
+    "SENDGRID_API_KEY": "test",
+    "FROM_EMAIL": "test@example.com",
+    "OPENROUTER_API_KEY": "test",
+    "IMAGE_PROVIDER": "openai",
+    "REPLICATE_API_TOKEN": "test",
+    "REPLICATE_MODEL_ID": "test/image",
+    "REPLICATE_TEXT_MODEL_ID": "test/text",
+    "REPLICATE_AUDIO_MODEL_ID": "test/audio",
+    "r2": {
+        "account_id": "test",
+        "access_key_id": "test",
+        "secret_access_key": "test",
+        "bucket_name": "test",
+        "public_base_url": "https://cdn.example.com",
+    },
+}
+
+
+@pytest.fixture(scope="session")
+def processor():
+    """utils.processor, or a skip when its dependencies or assets/ fonts are not available."""
+    st = pytest.importorskip("streamlit")
+    if not os.path.exists(os.path.join(ROOT, "assets", "fonts", "NotoSansSC-Regular.ttf")):
+        pytest.skip("assets/fonts not available")
+
+    cwd = os.getcwd()
+    os.chdir(ROOT)  # fonts are registered by relative path
+    mp = pytest.MonkeyPatch()
+    try:
+        mp.setattr(st, "secrets", TEST_SECRETS)
+        try:
+            import utils.processor as processor
+        except ImportError as e:
+            pytest.skip(f"utils.processor dependencies missing: {e}")
+        yield processor
+    finally:
+        mp.undo()
+        os.chdir(cwd)
+
+
+class FakeClock:
+    """Deterministic stand-in for the `time` module: sleep() advances the clock."""
+
+    def __init__(self, start: float = 1000.0):
+        self.now = start
+        self.slept = []
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def time(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
@@ -0,0 +1,64 @@
+import os
+
+from utils import cache
+from utils.cache import DiskCache, cache_key
+
+
+def test_cache_key_is_stable_across_dict_order():
+    assert cache_key({"a": 1, "b": 2}, "x") == cache_key({"b": 2, "a": 1}, "x")
+    assert cache_key({"a": 1}) != cache_key({"a": 2})
+
+
+def test_get_put_round_trip(tmp_path):
+    c = DiskCache(str(tmp_path), max_bytes=10_000)
+    key = cache_key("prompt")
+    assert c.get(key, "missing") == "missing"
+    c.put(key, {"text": "hello"})
+    assert c.get(key) == {"text": "hello"}
+
+
+def test_entries_expire_after_ttl(tmp_path, clock, monkeypatch):
+    monkeypatch.setattr(cache, "time", clock)
+    c = DiskCache(str(tmp_path), max_bytes=10_000, ttl_seconds=60)
+    key = cache_key("prompt")
+    c.put(key, "value")
+    clock.now += 30
+    assert c.get(key) == "value"
+    clock.now += 31
+    assert c.get(key) is None
+    assert c.size_bytes() == 0
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    c = DiskCache(str(tmp_path), max_bytes=10_000)
+    keys = [cache_key(i) for i in range(3)]
+    for age, key in enumerate(keys):
+        c.put(key, "x" * 100)
+        # Oldest first; key 0 is then read, which makes it the most recent
+        os.utime(c._path(key), (1000 + age, 1000 + age))
+    c.get(keys[0])
+
+    # Room for exactly two entries: the least recently used one has to go
+    c.max_bytes = os.path.getsize(c._path(keys[0])) + os.path.getsize(c._path(keys[2]))
+    c.evict()
+    assert c.get(keys[1]) is None
+    assert c.get(keys[0]) == "x" * 100
+    assert c.get(keys[2]) == "x" * 100
+
+
+def test_put_scans_only_when_over_budget_or_periodically(tmp_path, monkeypatch):
+    c = DiskCache(str(tmp_path), max_bytes=10_000, evict_every=5)
+    scans = []
+    evict = c.evict
+    monkeypatch.setattr(c, "evict", lambda: scans.append(1) or evict())
+
+    for i in range(4):
+        c.put(cache_key(i), "x")
+    assert scans == []
+    c.put(cache_key(4), "x")
+    assert scans == [1]
+
+    c.max_bytes = 1  # every put is now over budget
+    c.put(cache_key(5), "x")
+    assert len(scans) == 2
+    assert c.size_bytes() == 0
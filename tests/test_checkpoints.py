@@ -0,0 +1,23 @@
+import os
+
+from utils.checkpoints import JobCheckpoint
+
+
+def test_put_get_round_trip_without_temp_files(tmp_path):
+    cp = JobCheckpoint(str(tmp_path / "checkpoints"))
+    assert not cp.has("story_text")
+    assert cp.get("story_text", "missing") == "missing"
+
+    cp.put("story_text", "Once upon a time")
+    cp.put("scenes", [["a", "b"], ["p1", "p2"]])
+    assert cp.get("story_text") == "Once upon a time"
+    assert cp.names() == ["scenes", "story_text"]
+    assert not [fn for fn in os.listdir(cp.directory) if fn.endswith(".tmp")]
+
+
+def test_clear_removes_every_checkpoint(tmp_path):
+    cp = JobCheckpoint(str(tmp_path / "checkpoints"))
+    cp.put("cover", "b64")
+    cp.clear()
+    assert not os.path.exists(cp.directory)
+    assert not cp.has("cover")
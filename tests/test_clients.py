@@ -0,0 +1,34 @@
+from utils import clients
+
+
+def test_reset_closes_the_client_and_rebuilds_it_on_next_use(monkeypatch):
+    monkeypatch.setattr(clients, "_factories", {})
+    monkeypatch.setattr(clients, "_clients", {})
+    built, closed = [], []
+
+    def factory():
+        built.append(object())
+        return built[-1]
+
+    clients.register_client("svc", factory, close=closed.append)
+    first = clients.get_client("svc")
+    assert clients.get_client("svc") is first
+
+    clients.reset_client("svc")
+    assert closed == [first]
+    assert clients.get_client("svc") is not first
+    clients.reset_client("unknown")  # never built: nothing to close
+
+
+def test_failed_health_check_resets_the_client(monkeypatch):
+    monkeypatch.setattr(clients, "_factories", {})
+    monkeypatch.setattr(clients, "_clients", {})
+    closed = []
+
+    def broken(client):
+        raise ConnectionError("down")
+
+    clients.register_client("svc", object, health_check=broken, close=closed.append)
+    clients.register_client("plain", object)
+    assert clients.check_clients() == {"svc": False, "plain": True}
+    assert len(closed) == 1
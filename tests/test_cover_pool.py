@@ -0,0 +1,39 @@
+import time
+
+import pytest
+
+from utils import cover_pool
+
+
+def _at_hour(hour: int) -> float:
+    return time.mktime((2026, 1, 15, hour, 30, 0, 0, 0, -1))
+
+
+@pytest.mark.parametrize("hours, inside, outside", [
+    ("1-6", [1, 3, 5], [0, 6, 12, 23]),
+    ("22-6", [22, 23, 0, 5], [6, 12, 21]),
+])
+def test_refill_window(monkeypatch, hours, inside, outside):
+    monkeypatch.setattr(cover_pool, "COVER_REFILL_HOURS", hours)
+    assert all(cover_pool.in_refill_window(_at_hour(h)) for h in inside)
+    assert not any(cover_pool.in_refill_window(_at_hour(h)) for h in outside)
+
+
+def test_invalid_refill_window_disables_refills(monkeypatch):
+    monkeypatch.setattr(cover_pool, "COVER_REFILL_HOURS", "night")
+    assert not cover_pool.in_refill_window(_at_hour(3))
+
+
+def test_pooled_cover_is_claimed_once(tmp_path, monkeypatch):
+    monkeypatch.setattr(cover_pool, "COVER_POOL_ENABLED", True)
+    monkeypatch.setattr(cover_pool, "COVER_POOL_DIR", str(tmp_path))
+    monkeypatch.setattr(cover_pool, "COVER_POOL_SIZE", 1)
+
+    rendered = []
+    added = cover_pool.refill_cover_pool(lambda category: rendered.append(category) or "b64", max_new=20)
+    assert added == len(cover_pool.COVER_CATEGORIES)
+    assert cover_pool.refill_cover_pool(lambda category: "b64") == 0
+
+    assert cover_pool.claim_cover("my dinosaurs") == "b64"
+    assert cover_pool.claim_cover("dinosaurs") is None
+    assert cover_pool.pool_status()["dinosaurs"] == 0
@@ -0,0 +1,131 @@
+import os
+
+import pytest
+
+from utils import jobs
+
+INTAKE = {
+    "child_name": "Mia",
+    "child_age": "5",
+    "child_interest": "dinosaurs",
+    "story_objective": "sharing",
+    "your_name": "Dad",
+    "language": "en",
+    "page_length": 4,
+}
+
+
+@pytest.fixture(autouse=True)
+def job_store(tmp_path, monkeypatch):
+    monkeypatch.setattr(jobs, "JOB_DB_PATH", str(tmp_path / "jobs.sqlite3"))
+    monkeypatch.setattr(jobs, "JOB_DATA_DIR", str(tmp_path / "jobs"))
+    monkeypatch.setattr(jobs, "JOB_MAX_ATTEMPTS", 2)
+
+
+def test_intake_key_ignores_email_and_defaults():
+    a = dict(INTAKE, recipient_email="a@example.com")
+    b = dict(INTAKE, language="", page_length="")
+    assert jobs.intake_key(a) == jobs.intake_key(INTAKE)
+    assert jobs.intake_key(b) == jobs.intake_key(dict(INTAKE, language="en", page_length="4"))
+
+
+def test_submit_deduplicates_in_flight_jobs():
+    first = jobs.submit_job(INTAKE)
+    assert jobs.submit_job(dict(INTAKE)) == first
+    assert jobs.get_job(first)["status"] == jobs.QUEUED
+
+
+def test_claim_leases_job_to_one_worker():
+    job_id = jobs.submit_job(INTAKE)
+    job = jobs.claim_job("w1", lease_seconds=60)
+    assert job["id"] == job_id
+    assert job["status"] == jobs.RUNNING
+    assert job["attempts"] == 1
+    assert job["lease_owner"] == "w1"
+    assert jobs.claim_job("w2", lease_seconds=60) is None
+    assert jobs.renew_lease(job_id, "w1", lease_seconds=60)
+    assert not jobs.renew_lease(job_id, "w2", lease_seconds=60)
+
+
+def test_expired_lease_is_reclaimed_then_given_up():
+    job_id = jobs.submit_job(INTAKE)
+    jobs.claim_job("w1", lease_seconds=-1)
+
+    job = jobs.claim_job("w2", lease_seconds=-1)
+    assert job["id"] == job_id
+    assert job["attempts"] == 2
+    assert not jobs.renew_lease(job_id, "w1")
+
+    # JOB_MAX_ATTEMPTS reached: the next claim gives up on it
+    assert jobs.claim_job("w3", lease_seconds=60) is None
+    job = jobs.get_job(job_id)
+    assert job["status"] == jobs.FAILED
+    assert job["error"] == "lease expired too many times"
+
+
+def test_fail_requeues_until_attempts_run_out():
+    job_id = jobs.submit_job(INTAKE)
+    jobs.claim_job("w1", lease_seconds=60)
+    jobs.fail_job(job_id, "w1", "boom")
+    assert jobs.get_job(job_id)["status"] == jobs.QUEUED
+
+    jobs.claim_job("w1", lease_seconds=60)
+    jobs.fail_job(job_id, "w1", "boom again")
+    job = jobs.get_job(job_id)
+    assert job["status"] == jobs.FAILED
+    assert job["error"] == "boom again"
+
+    jobs.retry_job(job_id)
+    job = jobs.get_job(job_id)
+    assert job["status"] == jobs.QUEUED
+    assert job["attempts"] == 0
+
+
+def test_fail_and_complete_ignore_a_worker_without_the_lease():
+    job_id = jobs.submit_job(INTAKE)
+    jobs.claim_job("w1", lease_seconds=60)
+    jobs.fail_job(job_id, "w2", "not mine")
+    jobs.complete_job(job_id, "w2", {"pdf_path": "x"})
+    job = jobs.get_job(job_id)
+    assert job["status"] == jobs.RUNNING
+    assert job["result"] is None
+
+
+def test_complete_indexes_the_book_while_its_pdf_exists():
+    job_id = jobs.submit_job(INTAKE)
+    jobs.claim_job("w1", lease_seconds=60)
+    pdf_path = os.path.join(jobs.job_dir(job_id), "book.pdf")
+    with open(pdf_path, "wb") as f:
+        f.write(b"%PDF")
+    jobs.complete_job(job_id, "w1", {"pdf_path": pdf_path})
+
+    assert jobs.get_job(job_id)["status"] == jobs.DONE
+    assert jobs.find_book(INTAKE)["id"] == job_id
+    assert jobs.submit_job(INTAKE) == job_id
+
+    os.remove(pdf_path)
+    assert jobs.find_book(INTAKE) is None
+    assert jobs.submit_job(INTAKE) != job_id
+
+
+def test_events_belong_to_the_current_attempt():
+    job_id = jobs.submit_job(INTAKE)
+    jobs.claim_job("w1", lease_seconds=60)
+    jobs.add_job_event(job_id, {"type": "stage_started", "stage": "story_text"})
+    jobs.add_job_event(job_id, {"type": "stage_finished", "stage": "story_text"})
+    events = jobs.get_job_events(job_id)
+    assert [e["type"] for e in events] == ["stage_started", "stage_finished"]
+    assert jobs.get_job_events(job_id, after_seq=events[0]["seq"]) == events[1:]
+
+    jobs.fail_job(job_id, "w1", "boom")
+    jobs.claim_job("w1", lease_seconds=60)
+    assert jobs.get_job_events(job_id) == []
+
+
+def test_count_jobs_by_status():
+    assert jobs.count_jobs(jobs.QUEUED) == 0
+    jobs.submit_job(INTAKE)
+    jobs.submit_job(dict(INTAKE, child_name="Leo"))
+    jobs.claim_job("w1", lease_seconds=60)
+    assert jobs.count_jobs(jobs.QUEUED) == 1
+    assert jobs.count_jobs(jobs.RUNNING) == 1
@@ -0,0 +1,49 @@
+import pytest
+
+from utils.limiter import AdaptiveLimiter, DECREASE_ON_OVERLOAD, DECREASE_ON_SPIKE
+
+
+def test_limit_is_clamped_to_bounds():
+    lim = AdaptiveLimiter("test", initial=50, min_limit=1, max_limit=8)
+    assert lim.limit == 8
+    assert AdaptiveLimiter("test", initial=0, min_limit=2, max_limit=8).limit == 2
+
+
+def test_additive_increase_on_steady_latency():
+    lim = AdaptiveLimiter("test", initial=2, min_limit=1, max_limit=8)
+    for _ in range(2):
+        lim.acquire()
+        lim.release(latency=1.0)
+    # ~+1 per limit's worth of successful calls
+    assert lim.limit == pytest.approx(2 + 1 / 2 + 1 / 2.5)
+
+
+def test_multiplicative_decrease_on_429_and_spike():
+    lim = AdaptiveLimiter("test", initial=8, min_limit=1, max_limit=16)
+    lim.acquire()
+    lim.release(overloaded=True)
+    assert lim.limit == pytest.approx(8 * DECREASE_ON_OVERLOAD)
+
+    lim.acquire()
+    lim.release(latency=1.0)  # sets the baseline
+    before = lim.limit
+    lim.acquire()
+    lim.release(latency=10.0)
+    assert lim.limit == pytest.approx(before * DECREASE_ON_SPIKE)
+
+
+def test_limit_never_drops_below_minimum():
+    lim = AdaptiveLimiter("test", initial=2, min_limit=2, max_limit=8)
+    for _ in range(5):
+        lim.acquire()
+        lim.release(overloaded=True)
+    assert lim.limit == 2
+
+
+def test_failure_frees_the_slot_without_adapting():
+    lim = AdaptiveLimiter("test", initial=1, min_limit=1, max_limit=4)
+    lim.acquire()
+    lim.release()
+    assert lim.in_flight == 0
+    assert lim.limit == 1
+    assert lim.snapshot() == {"limit": 1, "in_flight": 0, "latency_baseline": None}
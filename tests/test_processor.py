@@ -0,0 +1,125 @@
+import threading
+
+import pytest
+
+
+OK_TEXT = " ".join(["Mia"] + ["word"] * 24) + "."   # 25 words: inside the age-5 band
+OK_PROMPT = "A child in a soft watercolor meadow"
+
+
+# ------------------ run_stage_graph ------------------
+def test_stage_graph_passes_inputs_by_stage_name(processor):
+    stages = {
+        "a": (lambda: 1, []),
+        "b": (lambda a: a + 1, ["a"]),
+        "c": (lambda a: a * 10, ["a"]),
+        "d": (lambda b, c: (b, c), ["b", "c"]),
+    }
+    results, report = processor.run_stage_graph(stages)
+    assert results == {"a": 1, "b": 2, "c": 10, "d": (2, 10)}
+    assert report["critical_path"][0] == "a"
+    assert report["critical_path"][-1] == "d"
+
+
+def test_stage_graph_runs_independent_stages_concurrently(processor):
+    both_started = threading.Barrier(2, timeout=5)
+    stages = {
+        "left": (lambda: (both_started.wait(), "l")[1], []),
+        "right": (lambda: (both_started.wait(), "r")[1], []),
+    }
+    results, _ = processor.run_stage_graph(stages)
+    assert results == {"left": "l", "right": "r"}
+
+
+def test_stage_failure_propagates_and_skips_dependents(processor):
+    ran = []
+
+    def broken():
+        raise RuntimeError("stage blew up")
+
+    stages = {
+        "ok": (lambda: ran.append("ok"), []),
+        "broken": (broken, []),
+        "after": (lambda broken: ran.append("after"), ["broken"]),
+    }
+    events = []
+    with pytest.raises(RuntimeError, match="stage blew up"):
+        processor.run_stage_graph(stages, on_event=events.append)
+    assert "after" not in ran
+    assert {"type": "stage_started", "stage": "after"} not in events
+
+
+def test_stage_graph_rejects_unknown_inputs_and_cycles(processor):
+    with pytest.raises(ValueError, match="unknown stage"):
+        processor.run_stage_graph({"a": (lambda missing: 1, ["missing"])})
+    with pytest.raises(ValueError, match="cycle"):
+        processor.run_stage_graph({
+            "a": (lambda b: 1, ["b"]),
+            "b": (lambda a: 1, ["a"]),
+        })
+
+
+# ------------------ split_tts_chunks ------------------
+def test_short_scenes_are_one_chunk_each(processor):
+    assert processor.split_tts_chunks(["One. Two.", "", "Three."], max_chars=100) == [
+        (0, "One. Two."),
+        (2, "Three."),
+    ]
+
+
+def test_long_scene_splits_at_sentence_boundaries(processor):
+    scene = "First sentence here. Second sentence here. Third sentence here."
+    chunks = processor.split_tts_chunks([scene], max_chars=45)
+    assert chunks == [
+        (0, "First sentence here. Second sentence here."),
+        (0, "Third sentence here."),
+    ]
+    assert all(len(text) <= 45 for _, text in chunks)
+
+
+def test_overlong_sentence_is_kept_whole(processor):
+    sentence = "A very long sentence that will not fit in the limit."
+    assert processor.split_tts_chunks([sentence], max_chars=10) == [(0, sentence)]
+
+
+def test_cjk_sentences_join_without_spaces(processor):
+    chunks = processor.split_tts_chunks(["小兔子跳。它很开心！我们回家。"], max_chars=12)
+    assert chunks == [(0, "小兔子跳。它很开心！"), (0, "我们回家。")]
+
+
+# ------------------ gate_story_scenes ------------------
+def test_gate_accepts_good_scenes_without_regeneration(processor, monkeypatch):
+    monkeypatch.setattr(processor, "repair_story_scenes", pytest.fail)
+    texts, prompts = processor.gate_story_scenes([OK_TEXT] * 2, [OK_PROMPT] * 2, "Mia", 5, 2)
+    assert texts == [OK_TEXT] * 2
+    assert prompts == [OK_PROMPT] * 2
+
+
+def test_gate_regenerates_only_failing_scenes(processor, monkeypatch):
+    calls = []
+
+    def repair(story, invalid, child_name, child_age):
+        calls.append(invalid)
+        return [{"text": OK_TEXT, "illustration_prompt": OK_PROMPT} for _ in invalid]
+
+    monkeypatch.setattr(processor, "repair_story_scenes", repair)
+    texts, prompts = processor.gate_story_scenes(
+        [OK_TEXT, "Too short.", OK_TEXT],
+        [OK_PROMPT, OK_PROMPT, "Mia plays in the garden"],   # name leak in scene 2
+        "Mia", 5, 3,
+    )
+    assert calls == [[1, 2]]
+    assert texts == [OK_TEXT] * 3
+    assert prompts == [OK_PROMPT] * 3
+
+
+def test_gate_accepts_remaining_issues_but_fails_empty_scenes(processor, monkeypatch):
+    monkeypatch.setattr(
+        processor, "repair_story_scenes",
+        lambda story, invalid, *a: [{"text": "", "illustration_prompt": ""} for _ in invalid],
+    )
+    texts, _ = processor.gate_story_scenes([OK_TEXT, "Too short."], [OK_PROMPT] * 2, "Mia", 5, 2)
+    assert texts == [OK_TEXT, "Too short."]
+
+    with pytest.raises(ValueError, match="empty"):
+        processor.gate_story_scenes([OK_TEXT], [OK_PROMPT], "Mia", 5, 2)
@@ -0,0 +1,110 @@
+import pytest
+
+from utils import clients, quota
+
+
+class Status429(Exception):
+    def __init__(self, retry_after=None):
+        super().__init__("rate limited")
+        self.status_code = 429
+        self.response = type("Response", (), {"headers": {"retry-after": retry_after} if retry_after else {}})()
+
+
+@pytest.fixture(autouse=True)
+def fake_time(clock, monkeypatch):
+    monkeypatch.setattr(quota, "time", clock)
+    monkeypatch.setattr(quota, "_buckets", {})
+    return clock
+
+
+def test_bucket_serves_burst_then_waits_for_refill(clock):
+    bucket = quota.TokenBucket(rate_per_minute=60, burst=3)
+    assert [bucket.acquire() for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert bucket.acquire() == pytest.approx(1.0)
+
+    clock.now += 10  # refill is capped at the burst size
+    assert [bucket.acquire() for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert bucket.acquire() == pytest.approx(1.0)
+
+
+def test_block_for_pauses_every_caller_and_drops_the_burst(clock):
+    bucket = quota.TokenBucket(rate_per_minute=60, burst=5)
+    bucket.block_for(30)
+    assert bucket.tokens <= 1.0
+    assert bucket.acquire() == pytest.approx(30.0)
+
+    bucket.block_for(10)
+    bucket.block_for(2)  # a shorter pause never cuts a longer one short
+    assert bucket.acquire() == pytest.approx(10.0)
+
+
+def test_rate_limit_delay_parses_retry_after():
+    assert quota.rate_limit_delay(Status429("7")) == 7.0
+    assert quota.rate_limit_delay(Status429()) == 0.0
+    assert quota.rate_limit_delay(ValueError("not a 429")) is None
+
+
+def test_call_with_quota_backs_off_and_retries_429(clock):
+    calls = []
+
+    def flaky():
+        calls.append(clock.now)
+        if len(calls) < 3:
+            raise Status429("5" if len(calls) == 1 else None)
+        return "ok"
+
+    assert quota.call_with_quota("test", flaky, retries=3) == "ok"
+    # Retry-After first, then exponential backoff (2 ** attempt)
+    assert calls[1] - calls[0] == pytest.approx(5.0)
+    assert calls[2] - calls[1] == pytest.approx(2.0)
+
+
+def test_call_with_quota_gives_up_after_retries():
+    def always_429():
+        raise Status429("1")
+
+    with pytest.raises(Status429):
+        quota.call_with_quota("test", always_429, retries=2)
+
+
+def test_other_errors_propagate_without_retry():
+    calls = []
+
+    def broken():
+        calls.append(1)
+        raise ValueError("bad request")
+
+    with pytest.raises(ValueError):
+        quota.call_with_quota("test", broken)
+    assert len(calls) == 1
+
+
+def test_transport_error_resets_the_named_client(monkeypatch):
+    reset = []
+    monkeypatch.setattr(quota, "reset_client", reset.append)
+
+    def offline():
+        raise ConnectionError("connection refused")
+
+    with pytest.raises(ConnectionError):
+        quota.call_with_quota("test", offline, client="openai")
+    assert reset == ["openai"]
+
+    with pytest.raises(ValueError):
+        quota.call_with_quota("test", lambda: (_ for _ in ()).throw(ValueError("bad")), client="openai")
+    assert reset == ["openai"]
+
+
+def test_auth_errors_do_not_reset_the_client(monkeypatch):
+    reset = []
+    monkeypatch.setattr(quota, "reset_client", reset.append)
+
+    class AuthenticationError(Exception):
+        status_code = 401
+
+    def unauthorized():
+        raise AuthenticationError("invalid api key")
+
+    with pytest.raises(AuthenticationError):
+        quota.call_with_quota("test", unauthorized, client="openai")
+    assert reset == []
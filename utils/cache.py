@@ -0,0 +1,165 @@
+"""
+Content-addressed on-disk caches for provider responses.
+
+A DiskCache stores JSON values under a hash of the request that produced them
+(see cache_key). Entries expire after a TTL, and the least recently used ones
+are evicted once the directory grows past its byte budget. Files are written
+with write-then-rename, so several worker processes can share one directory.
+"""
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from typing import Any, Optional
+
+# Cached LLM responses (utils/processor.py: chat_completion_text, replicate_text). Off by default.
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "0") == "1"
+LLM_CACHE_DIR = os.getenv("LLM_CACHE_DIR", "data/cache/llm")
+LLM_CACHE_TTL_SECONDS = float(os.getenv("LLM_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+LLM_CACHE_MAX_BYTES = int(os.getenv("LLM_CACHE_MAX_BYTES", str(200 * 1024 * 1024)))
+
+# Rendered illustrations (utils/processor.py: generate_image_for_prompt_openai)
+IMAGE_CACHE_ENABLED = os.getenv("IMAGE_CACHE_ENABLED", "1") == "1"
+IMAGE_CACHE_DIR = os.getenv("IMAGE_CACHE_DIR", "data/cache/images")
+IMAGE_CACHE_TTL_SECONDS = float(os.getenv("IMAGE_CACHE_TTL_SECONDS", str(30 * 24 * 3600)))
+IMAGE_CACHE_MAX_BYTES = int(os.getenv("IMAGE_CACHE_MAX_BYTES", str(1024 * 1024 * 1024)))
+
+# Narration audio: R2 object keys by (text, lang, model, speaker) (utils/processor.py: narrate_story_to_r2)
+AUDIO_CACHE_ENABLED = os.getenv("AUDIO_CACHE_ENABLED", "1") == "1"
+AUDIO_CACHE_DIR = os.getenv("AUDIO_CACHE_DIR", "data/cache/audio")
+AUDIO_CACHE_TTL_SECONDS = float(os.getenv("AUDIO_CACHE_TTL_SECONDS", str(30 * 24 * 3600)))
+AUDIO_CACHE_MAX_BYTES = int(os.getenv("AUDIO_CACHE_MAX_BYTES", str(20 * 1024 * 1024)))
+
+# Full eviction scans (expired entries, other processes' writes) at most every N puts
+CACHE_EVICT_EVERY = int(os.getenv("CACHE_EVICT_EVERY", "200"))
+
+
+def cache_key(*parts: Any) -> str:
+    """Stable sha256 of JSON-serializable request parts (dict key order does not matter)."""
+    payload = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class DiskCache:
+    """
+    JSON-file cache with a TTL and LRU eviction by total bytes.
+
+    A put only triggers a directory scan when the running byte total passes
+    max_bytes, or every CACHE_EVICT_EVERY puts; the total starts from one scan
+    and is re-synced by each eviction.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        max_bytes: int,
+        ttl_seconds: Optional[float] = None,
+        evict_every: int = CACHE_EVICT_EVERY,
+    ):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.evict_every = max(1, evict_every)
+        self._lock = threading.Lock()
+        self._total_bytes: Optional[int] = None
+        self._puts = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], f"{key}.json")
+
+    def get(self, key: str, default: Any = None) -> Any:
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return default
+
+        if self.ttl_seconds is not None and time.time() - entry.get("created", 0) > self.ttl_seconds:
+            self._remove(path)
+            return default
+
+        # mtime is the LRU clock
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        return entry.get("value", default)
+
+    def put(self, key: str, value: Any) -> None:
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"created": time.time(), "value": value}, f, ensure_ascii=False)
+            size = f.tell()
+        os.replace(tmp, path)
+
+        with self._lock:
+            if self._total_bytes is None:
+                self._total_bytes = sum(s for _, s, _ in self._entries())
+            else:
+                self._total_bytes += size
+            self._puts += 1
+            due = self._total_bytes > self.max_bytes or self._puts % self.evict_every == 0
+        if due:
+            self.evict()
+
+    def _remove(self, path: str) -> None:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def _entries(self) -> list:
+        """(mtime, size, path) of every entry."""
+        entries = []
+        for root, _, files in os.walk(self.directory):
+            for fn in files:
+                if not fn.endswith(".json"):
+                    continue
+                path = os.path.join(root, fn)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+        return entries
+
+    def evict(self) -> int:
+        """Drop expired entries, then least recently used ones until under max_bytes. Returns bytes freed."""
+        with self._lock:
+            entries = sorted(self._entries())
+            now = time.time()
+            total = sum(size for _, size, _ in entries)
+            freed = 0
+            for mtime, size, path in entries:
+                expired = self.ttl_seconds is not None and now - mtime > self.ttl_seconds
+                if not expired and total <= self.max_bytes:
+                    continue
+                self._remove(path)
+                total -= size
+                freed += size
+            self._total_bytes = total
+            if freed:
+                logging.info(f"Cache {self.directory}: evicted {freed} bytes.")
+            return freed
+
+    def size_bytes(self) -> int:
+        return sum(size for _, size, _ in self._entries())
+
+
+_caches: dict = {}
+_caches_lock = threading.Lock()
+
+
+def get_cache(directory: str, max_bytes: int, ttl_seconds: Optional[float] = None) -> DiskCache:
+    """Process-wide DiskCache per directory."""
+    with _caches_lock:
+        cache = _caches.get(directory)
+        if cache is None:
+            cache = _caches[directory] = DiskCache(directory, max_bytes, ttl_seconds)
+        return cache
@@ -0,0 +1,57 @@
+"""
+Per-job stage checkpoints.
+
+Each finished stage output (story text, title, scenes/prompts, audio URL,
+cover, every scene image) is written as a small JSON file under the job's
+directory. A retried job loads what is already there and only runs the
+stages that are still missing. Once the job's PDF is written, the
+checkpoints are deleted (clear).
+"""
+import os
+import json
+import shutil
+import threading
+from typing import Any
+
+
+class JobCheckpoint:
+    """JSON-file store for the stage outputs of one job."""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, f"{name}.json")
+
+    def has(self, name: str) -> bool:
+        return os.path.exists(self._path(name))
+
+    def get(self, name: str, default: Any = None) -> Any:
+        try:
+            with open(self._path(name), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return default
+
+    def put(self, name: str, value: Any) -> None:
+        # Write-then-rename so a crash never leaves a half-written checkpoint
+        path = self._path(name)
+        # A lease takeover can put another worker process on the same job directory
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with self._lock:
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(value, f, ensure_ascii=False)
+            os.replace(tmp, path)
+
+    def names(self) -> list:
+        return sorted(
+            fn[:-len(".json")] for fn in os.listdir(self.directory) if fn.endswith(".json")
+        )
+
+
+    def clear(self) -> None:
+        """Delete every checkpoint of the job (after it has succeeded)."""
+        with self._lock:
+            shutil.rmtree(self.directory, ignore_errors=True)
@@ -0,0 +1,83 @@
+"""
+Process-wide registry of long-lived provider clients.
+
+Clients (OpenAI, R2, Replicate, SendGrid) are registered once with a factory
+and an optional health check, built lazily on first use, and shared by every
+Streamlit session and job in the process. A client whose health check fails,
+or that a caller reports as broken, is rebuilt on its next use.
+"""
+import logging
+import threading
+from typing import Any, Callable, Optional
+
+_factories: dict = {}
+_clients: dict = {}
+_lock = threading.Lock()
+
+
+def register_client(
+    name: str,
+    factory: Callable[[], Any],
+    health_check: Optional[Callable[[Any], Any]] = None,
+    close: Optional[Callable[[Any], Any]] = None,
+) -> None:
+    """
+    Declare how to build (and optionally probe and close) a client. Does not build it.
+    close releases the client's connection pool when the client is reset.
+    """
+    with _lock:
+        _factories[name] = (factory, health_check, close)
+
+
+def get_client(name: str) -> Any:
+    """Return the shared client, building it on first use."""
+    client = _clients.get(name)
+    if client is not None:
+        return client
+
+    with _lock:
+        client = _clients.get(name)
+        if client is None:
+            if name not in _factories:
+                raise KeyError(f"No client registered under '{name}'")
+            factory, _, _ = _factories[name]
+            client = factory()
+            _clients[name] = client
+            logging.info(f"Client '{name}' created.")
+        return client
+
+
+def reset_client(name: str) -> None:
+    """Drop and close a broken client; the next get_client() builds a fresh one."""
+    with _lock:
+        client = _clients.pop(name, None)
+        if client is None:
+            return
+        _, _, close = _factories[name]
+    logging.warning(f"Client '{name}' reset; it will be rebuilt on next use.")
+    if close is not None:
+        try:
+            close(client)
+        except Exception as e:
+            logging.warning(f"Closing client '{name}' failed: {e}")
+
+
+def check_client(name: str) -> bool:
+    """Run the client's health check; reset it when the check fails."""
+    _, health_check, _ = _factories[name]
+    if health_check is None:
+        return True
+    try:
+        health_check(get_client(name))
+        return True
+    except Exception as e:
+        logging.warning(f"Health check for client '{name}' failed: {e}")
+        reset_client(name)
+        return False
+
+
+def check_clients() -> dict:
+    """Health-check every registered client. Returns {name: healthy}."""
+    with _lock:
+        names = list(_factories)
+    return {name: check_client(name) for name in names}
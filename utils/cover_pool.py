@@ -0,0 +1,181 @@
+"""
+Pool of ready-made cover illustrations per interest category.
+
+The cover prompt only depends on the child's interest, and a handful of
+interests cover most orders. One designated worker pre-renders a few covers
+per category (refill_cover_pool) in a background thread, during the off-peak
+hours in COVER_REFILL_HOURS; a job whose interest maps to a category takes
+one with claim_cover() instead of waiting on the image API. Off by default
+(COVER_POOL_ENABLED=1 turns it on): every pooled cover is an image API call.
+
+Each pooled cover is a JSON file under COVER_POOL_DIR/<category>/. A cover is
+claimed by renaming its file, which only one process can win, so every cover
+is used exactly once. Covers older than COVER_POOL_MAX_AGE_SECONDS are dropped.
+"""
+import os
+import re
+import json
+import time
+import uuid
+import logging
+from typing import Callable, Optional
+
+import jieba
+
+COVER_POOL_ENABLED = os.getenv("COVER_POOL_ENABLED", "0") == "1"
+COVER_POOL_DIR = os.getenv("COVER_POOL_DIR", "data/cover_pool")
+COVER_POOL_SIZE = int(os.getenv("COVER_POOL_SIZE", "3"))   # ready covers kept per category
+COVER_POOL_MAX_AGE_SECONDS = float(os.getenv("COVER_POOL_MAX_AGE_SECONDS", str(14 * 24 * 3600)))
+COVER_REFILL_HOURS = os.getenv("COVER_REFILL_HOURS", "1-6")   # local "start-end" hours for refills; may wrap, e.g. "22-6"
+
+# category -> keywords that map a free-text interest onto it
+# (CJK keywords are matched against jieba words, so list the common word forms)
+COVER_CATEGORIES = {
+    "dinosaurs": ["dinosaur", "dino", "t-rex", "trex", "恐龙"],
+    "space": ["space", "rocket", "planet", "astronaut", "star", "moon", "太空", "火箭", "星星", "星球", "宇航员", "月亮"],
+    "unicorns": ["unicorn", "独角兽"],
+    "trucks": ["truck", "car", "train", "digger", "excavator", "vehicle", "卡车", "汽车", "火车", "挖掘机"],
+    "ocean": ["ocean", "sea", "fish", "whale", "shark", "mermaid", "海洋", "大海", "鱼", "小鱼", "鲸鱼", "鲨鱼", "美人鱼"],
+    "animals": ["animal", "cat", "dog", "puppy", "kitten", "bunny", "horse", "动物", "猫", "小猫", "狗", "小狗", "兔子", "马"],
+    "princesses": ["princess", "castle", "fairy", "公主", "城堡", "仙女"],
+    "music": ["music", "sing", "piano", "guitar", "dance", "音乐", "唱歌", "钢琴", "跳舞"],
+}
+
+
+def _cjk_words(text: str) -> set:
+    return {w for w in jieba.lcut(text) if w.strip() and not w.isascii()}
+
+
+def normalize_interest(interest: str) -> Optional[str]:
+    """
+    Map a free-text interest onto a pooled category. Returns None when nothing
+    matches, or when several categories do ("dinosaurs in space" gets its own cover).
+    """
+    text = (interest or "").lower()
+    cjk_words = _cjk_words(text) if not text.isascii() else set()
+
+    matched = set()
+    for category, keywords in COVER_CATEGORIES.items():
+        for kw in keywords:
+            if kw.isascii():
+                # Whole words, plural ok
+                found = re.search(rf"\b{re.escape(kw)}s?\b", text) is not None
+            else:
+                # Whole jieba words, so "星" in "明星" or "马" in "马路" do not count
+                found = kw in cjk_words
+            if found:
+                matched.add(category)
+                break
+    return matched.pop() if len(matched) == 1 else None
+
+
+def _category_dir(category: str) -> str:
+    return os.path.join(COVER_POOL_DIR, category)
+
+
+def _ready_covers(category: str) -> list:
+    """Paths of unexpired covers, oldest first; expired ones are deleted on the way."""
+    directory = _category_dir(category)
+    if not os.path.isdir(directory):
+        return []
+
+    ready = []
+    now = time.time()
+    for fn in os.listdir(directory):
+        if not fn.endswith(".json"):
+            continue
+        path = os.path.join(directory, fn)
+        try:
+            mtime = os.path.getmtime(path)
+        except FileNotFoundError:
+            continue
+        if now - mtime > COVER_POOL_MAX_AGE_SECONDS:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            continue
+        ready.append((mtime, path))
+    return [path for _, path in sorted(ready)]
+
+
+def claim_cover(interest: str) -> Optional[str]:
+    """Take one pooled cover (base64 PNG) for this interest, or None if there is none."""
+    if not COVER_POOL_ENABLED:
+        return None
+    category = normalize_interest(interest)
+    if category is None:
+        return None
+
+    for path in _ready_covers(category):
+        claimed = f"{path}.claimed.{os.getpid()}.{uuid.uuid4().hex[:8]}"
+        try:
+            # Atomic: exactly one claimant gets each cover
+            os.rename(path, claimed)
+        except FileNotFoundError:
+            continue
+        try:
+            with open(claimed, "r", encoding="utf-8") as f:
+                cover = json.load(f)["image_b64"]
+        except (OSError, ValueError, KeyError) as e:
+            logging.warning(f"Discarding unreadable pooled cover {path}: {e}")
+            cover = None
+        finally:
+            try:
+                os.remove(claimed)
+            except FileNotFoundError:
+                pass
+        if cover:
+            logging.info(f"Cover taken from the '{category}' pool.")
+            return cover
+    return None
+
+
+def pool_status() -> dict:
+    """Ready covers per category."""
+    return {category: len(_ready_covers(category)) for category in COVER_CATEGORIES}
+
+
+def in_refill_window(now: Optional[float] = None) -> bool:
+    """True when the local hour is in COVER_REFILL_HOURS (start inclusive, end exclusive)."""
+    try:
+        start, end = (int(h) % 24 for h in COVER_REFILL_HOURS.split("-"))
+    except ValueError:
+        logging.warning(f"Invalid COVER_REFILL_HOURS '{COVER_REFILL_HOURS}'; cover pool refills are off.")
+        return False
+    hour = time.localtime(now).tm_hour
+    if start <= end:
+        return start <= hour < end
+    # Window wraps past midnight
+    return hour >= start or hour < end
+
+
+def refill_cover_pool(render: Callable[[str], str], max_new: int = 1) -> int:
+    """
+    Render up to max_new covers for the categories furthest below COVER_POOL_SIZE.
+    render(category) returns a base64 PNG. Callers check in_refill_window(); returns covers added.
+    """
+    if not COVER_POOL_ENABLED:
+        return 0
+
+    added = 0
+    while added < max_new:
+        status = pool_status()
+        category = min(status, key=status.get)
+        if status[category] >= COVER_POOL_SIZE:
+            break
+
+        image_b64 = render(category)
+        if not image_b64:
+            break
+
+        directory = _category_dir(category)
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"{uuid.uuid4().hex}.json")
+        tmp = f"{path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"category": category, "created": time.time(), "image_b64": image_b64}, f)
+        os.replace(tmp, path)
+        added += 1
+        logging.info(f"Cover pool: added a '{category}' cover ({status[category] + 1}/{COVER_POOL_SIZE}).")
+    return added
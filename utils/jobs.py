@@ -0,0 +1,328 @@
+"""
+SQLite-backed job queue for storybook generation.
+
+The Streamlit pages only submit jobs and poll them by id; one or more
+`python worker.py` processes claim queued jobs under a time-limited lease
+and run the pipeline from utils/processor.py. A job whose worker dies or
+hangs is picked up again once its lease expires.
+
+Finished books are also indexed by a canonical hash of the intake, so the
+same `?intake=` token never pays for a second generation.
+"""
+import os
+import json
+import hashlib
+import time
+import uuid
+import sqlite3
+from typing import Optional
+
+JOB_DB_PATH = os.getenv("JOB_DB_PATH", "data/jobs.sqlite3")
+JOB_DATA_DIR = os.getenv("JOB_DATA_DIR", "data/jobs")
+JOB_LEASE_SECONDS = int(os.getenv("JOB_LEASE_SECONDS", "120"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+
+# Job statuses
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id            TEXT PRIMARY KEY,
+    intake        TEXT NOT NULL,
+    intake_key    TEXT,
+    status        TEXT NOT NULL,
+    attempts      INTEGER NOT NULL DEFAULT 0,
+    lease_owner   TEXT,
+    lease_expires REAL,
+    result        TEXT,
+    error         TEXT,
+    created_at    REAL NOT NULL,
+    updated_at    REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_status_created ON jobs (status, created_at);
+
+CREATE TABLE IF NOT EXISTS job_events (
+    seq        INTEGER PRIMARY KEY AUTOINCREMENT,
+    job_id     TEXT NOT NULL,
+    payload    TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS job_events_job ON job_events (job_id, seq);
+
+CREATE TABLE IF NOT EXISTS results (
+    intake_key TEXT PRIMARY KEY,
+    job_id     TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+"""
+
+# Intake fields that change the generated book (recipient email does not)
+_BOOK_FIELDS = (
+    "child_name",
+    "child_age",
+    "child_interest",
+    "story_objective",
+    "your_name",
+    "language",
+    "page_length",
+)
+
+
+def intake_key(intake: dict) -> str:
+    """Canonical hash of the book-defining intake fields."""
+    canonical = {k: str(intake.get(k) or "").strip() for k in _BOOK_FIELDS}
+    canonical["language"] = canonical["language"] or "en"
+    canonical["page_length"] = canonical["page_length"] or "4"
+    raw = json.dumps(canonical, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _connect() -> sqlite3.Connection:
+    """Open a connection in autocommit mode; transactions are explicit (BEGIN IMMEDIATE)."""
+    db_dir = os.path.dirname(JOB_DB_PATH)
+    if db_dir:
+        os.makedirs(db_dir, exist_ok=True)
+
+    conn = sqlite3.connect(JOB_DB_PATH, timeout=30, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    # WAL lets pages poll while workers write
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA busy_timeout=30000")
+    conn.executescript(_SCHEMA)
+
+    # Databases created before intake_key existed
+    columns = {r["name"] for r in conn.execute("PRAGMA table_info(jobs)")}
+    if "intake_key" not in columns:
+        conn.execute("ALTER TABLE jobs ADD COLUMN intake_key TEXT")
+    conn.execute("CREATE INDEX IF NOT EXISTS jobs_intake_key ON jobs (intake_key, status)")
+    return conn
+
+
+def _row_to_job(row: Optional[sqlite3.Row]) -> Optional[dict]:
+    if row is None:
+        return None
+    job = dict(row)
+    job["intake"] = json.loads(job["intake"])
+    job["result"] = json.loads(job["result"]) if job["result"] else None
+    return job
+
+
+def job_dir(job_id: str) -> str:
+    """Directory holding the artifacts (PDF etc.) of one job."""
+    path = os.path.join(JOB_DATA_DIR, job_id)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def find_book(intake: dict) -> Optional[dict]:
+    """Return the finished job for this intake if its PDF is still on disk."""
+    conn = _connect()
+    try:
+        row = conn.execute(
+            "SELECT jobs.* FROM results JOIN jobs ON jobs.id = results.job_id "
+            "WHERE results.intake_key = ?",
+            (intake_key(intake),),
+        ).fetchone()
+    finally:
+        conn.close()
+
+    job = _row_to_job(row)
+    if job and job["result"] and os.path.exists(job["result"].get("pdf_path", "")):
+        return job
+    return None
+
+
+def submit_job(intake: dict) -> str:
+    """
+    Queue a generation job for this intake and return its id.
+    An already finished or in-flight job for the same intake is returned instead.
+    """
+    book = find_book(intake)
+    if book:
+        return book["id"]
+
+    key = intake_key(intake)
+    now = time.time()
+    conn = _connect()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        row = conn.execute(
+            "SELECT id FROM jobs WHERE intake_key = ? AND status IN (?, ?) "
+            "ORDER BY created_at LIMIT 1",
+            (key, QUEUED, RUNNING),
+        ).fetchone()
+        if row:
+            job_id = row["id"]
+        else:
+            job_id = uuid.uuid4().hex
+            conn.execute(
+                "INSERT INTO jobs (id, intake, intake_key, status, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (job_id, json.dumps(intake, ensure_ascii=False), key, QUEUED, now, now),
+            )
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+    return job_id
+
+
+def get_job(job_id: str) -> Optional[dict]:
+    conn = _connect()
+    try:
+        row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+    finally:
+        conn.close()
+    return _row_to_job(row)
+
+
+def count_jobs(status: str) -> int:
+    conn = _connect()
+    try:
+        row = conn.execute("SELECT COUNT(*) FROM jobs WHERE status = ?", (status,)).fetchone()
+    finally:
+        conn.close()
+    return row[0]
+
+
+def claim_job(worker_id: str, lease_seconds: int = JOB_LEASE_SECONDS) -> Optional[dict]:
+    """
+    Atomically take the oldest queued job (or one whose lease has expired)
+    and lease it to worker_id. Returns None when there is nothing to do.
+    """
+    now = time.time()
+    conn = _connect()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+
+        # Jobs abandoned by a dead worker too many times are given up on
+        conn.execute(
+            "UPDATE jobs SET status = ?, error = ?, lease_owner = NULL, updated_at = ? "
+            "WHERE status = ? AND lease_expires < ? AND attempts >= ?",
+            (FAILED, "lease expired too many times", now, RUNNING, now, JOB_MAX_ATTEMPTS),
+        )
+
+        row = conn.execute(
+            "SELECT * FROM jobs WHERE status = ? OR (status = ? AND lease_expires < ?) "
+            "ORDER BY created_at LIMIT 1",
+            (QUEUED, RUNNING, now),
+        ).fetchone()
+
+        if row is None:
+            conn.execute("COMMIT")
+            return None
+
+        conn.execute(
+            "UPDATE jobs SET status = ?, attempts = attempts + 1, lease_owner = ?, "
+            "lease_expires = ?, updated_at = ? WHERE id = ?",
+            (RUNNING, worker_id, now + lease_seconds, now, row["id"]),
+        )
+        # Progress of an earlier attempt no longer describes this run
+        conn.execute("DELETE FROM job_events WHERE job_id = ?", (row["id"],))
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+
+    return get_job(row["id"])
+
+
+def renew_lease(job_id: str, worker_id: str, lease_seconds: int = JOB_LEASE_SECONDS) -> bool:
+    """Extend the lease; returns False if the job is no longer owned by this worker."""
+    now = time.time()
+    conn = _connect()
+    try:
+        cur = conn.execute(
+            "UPDATE jobs SET lease_expires = ?, updated_at = ? "
+            "WHERE id = ? AND lease_owner = ? AND status = ?",
+            (now + lease_seconds, now, job_id, worker_id, RUNNING),
+        )
+    finally:
+        conn.close()
+    return cur.rowcount == 1
+
+
+def complete_job(job_id: str, worker_id: str, result: dict) -> None:
+    """Mark the job done and index its artifacts under the intake key."""
+    now = time.time()
+    conn = _connect()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        cur = conn.execute(
+            "UPDATE jobs SET status = ?, result = ?, error = NULL, lease_owner = NULL, "
+            "lease_expires = NULL, updated_at = ? WHERE id = ? AND lease_owner = ?",
+            (DONE, json.dumps(result, ensure_ascii=False), now, job_id, worker_id),
+        )
+        if cur.rowcount == 1:
+            conn.execute(
+                "INSERT OR REPLACE INTO results (intake_key, job_id, created_at) "
+                "SELECT intake_key, id, ? FROM jobs WHERE id = ? AND intake_key IS NOT NULL",
+                (now, job_id),
+            )
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+
+
+def fail_job(job_id: str, worker_id: str, error: str) -> None:
+    """Record a failure; the job is re-queued until it runs out of attempts."""
+    now = time.time()
+    conn = _connect()
+    try:
+        conn.execute(
+            "UPDATE jobs SET status = CASE WHEN attempts < ? THEN ? ELSE ? END, "
+            "error = ?, lease_owner = NULL, lease_expires = NULL, updated_at = ? "
+            "WHERE id = ? AND lease_owner = ?",
+            (JOB_MAX_ATTEMPTS, QUEUED, FAILED, error, now, job_id, worker_id),
+        )
+    finally:
+        conn.close()
+
+
+def add_job_event(job_id: str, event: dict) -> None:
+    """Append a progress event (stage started/finished, scene N of M) to the job."""
+    conn = _connect()
+    try:
+        conn.execute(
+            "INSERT INTO job_events (job_id, payload, created_at) VALUES (?, ?, ?)",
+            (job_id, json.dumps(event, ensure_ascii=False), time.time()),
+        )
+    finally:
+        conn.close()
+
+
+def get_job_events(job_id: str, after_seq: int = 0) -> list:
+    """Progress events of the job's current attempt in emission order, each with its `seq` added."""
+    conn = _connect()
+    try:
+        rows = conn.execute(
+            "SELECT seq, payload FROM job_events WHERE job_id = ? AND seq > ? ORDER BY seq",
+            (job_id, after_seq),
+        ).fetchall()
+    finally:
+        conn.close()
+    return [dict(json.loads(r["payload"]), seq=r["seq"]) for r in rows]
+
+
+def retry_job(job_id: str) -> None:
+    """Put a failed job back in the queue with a fresh attempt budget."""
+    conn = _connect()
+    try:
+        conn.execute(
+            "UPDATE jobs SET status = ?, attempts = 0, error = NULL, updated_at = ? "
+            "WHERE id = ? AND status = ?",
+            (QUEUED, time.time(), job_id, FAILED),
+        )
+        conn.execute("DELETE FROM job_events WHERE job_id = ?", (job_id,))
+    finally:
+        conn.close()
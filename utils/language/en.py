@@ -63,11 +63,26 @@ LANG = {
         "go_home": "Go to Home",
         "download_intake_found": "✅ Intake found.",
         "page_selected": "Selected pages: **{page_length}**",
-        "download_info": "Click below to generate your storybook PDF. Please do not close this tab while generating.",
+        "download_info": "Click below to generate your storybook PDF. Generation continues even if you close this tab.",
         "generate_button": "Generate Storybook",
-        "spinner": "Generating your storybook... please keep this tab open",
+        "spinner": "Generating your storybook... You can safely refresh or come back to this page later.",
         "generation_complete": "Storybook generation complete! Please download below.",
-        "download_button": "Download storybook PDF"
+        "download_button": "Download storybook PDF",
+        "job_queued": "Your storybook is in the queue and will start shortly. You can safely refresh or come back to this page later.",
+        "job_failed": "Sorry, we could not generate your storybook. Please try again.",
+        "job_pdf_missing": "The file for this storybook is no longer available. Please generate it again.",
+        "job_no_worker": "Your storybook has not started yet. Our generators seem to be busy or offline; please check back in a few minutes.",
+        "retry_button": "Try again",
+        "scene_progress": "Illustrations ready: {done} of {total}",
+        "stage_labels": {
+            "story_text": "Writing the story",
+            "story_title": "Choosing a title",
+            "scenes": "Planning the pages",
+            "cover": "Painting the cover",
+            "scene_images": "Painting the illustrations",
+            "audio_url": "Recording the audiobook",
+            "pdf": "Binding the book"
+        }
     },
 
     "prompts": {
@@ -62,11 +62,26 @@ LANG = {
         "go_home": "返回首页",
         "download_intake_found": "✅ 找到输入信息。",
         "page_selected": "选择的页数：**{page_length}**",
-        "download_info": "点击下面生成您的故事书PDF。在生成过程中请不要关闭此标签页。",
+        "download_info": "点击下面生成您的故事书PDF。关闭此标签页后生成仍会继续。",
         "generate_button": "生成故事书",
-        "spinner": "正在生成您的故事书...请保持此标签页打开",
+        "spinner": "正在生成您的故事书...您可以放心刷新或稍后再回到此页面。",
         "generation_complete": "故事书生成完成！请在下面下载。",
-        "download_button": "下载故事书PDF"
+        "download_button": "下载故事书PDF",
+        "job_queued": "您的故事书正在排队，即将开始生成。您可以放心刷新或稍后再回到此页面。",
+        "job_failed": "抱歉，故事书生成失败。请重试。",
+        "job_pdf_missing": "这本故事书的文件已不存在。请重新生成。",
+        "job_no_worker": "您的故事书尚未开始生成。生成服务可能繁忙或暂时离线，请几分钟后再来查看。",
+        "retry_button": "重试",
+        "scene_progress": "已完成插图：{done} / {total}",
+        "stage_labels": {
+            "story_text": "正在创作故事",
+            "story_title": "正在拟定书名",
+            "scenes": "正在规划页面",
+            "cover": "正在绘制封面",
+            "scene_images": "正在绘制插图",
+            "audio_url": "正在录制有声书",
+            "pdf": "正在装订成书"
+        }
     },
 
     "prompts": {
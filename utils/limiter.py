@@ -0,0 +1,109 @@
+"""
+Adaptive (AIMD) concurrency limits for slow provider calls.
+
+A fixed number of in-flight image/TTS calls is either too timid or too
+aggressive depending on the provider's mood. Each AdaptiveLimiter grows its
+limit additively while latency stays near its running baseline, and cuts it
+multiplicatively on a 429 or a latency spike. Limiters are process-wide, so
+all sessions and jobs share them; limiter_snapshot() exposes the current state.
+"""
+import os
+import threading
+from typing import Optional
+
+# name -> (initial, min, max) in-flight calls
+LIMITER_BOUNDS = {
+    "openai_images": (
+        int(os.getenv("OPENAI_IMAGE_LIMIT_INITIAL", "4")),
+        int(os.getenv("OPENAI_IMAGE_LIMIT_MIN", "1")),
+        int(os.getenv("OPENAI_IMAGE_LIMIT_MAX", "16")),
+    ),
+    "replicate_images": (
+        int(os.getenv("REPLICATE_IMAGE_LIMIT_INITIAL", "2")),
+        int(os.getenv("REPLICATE_IMAGE_LIMIT_MIN", "1")),
+        int(os.getenv("REPLICATE_IMAGE_LIMIT_MAX", "8")),
+    ),
+    "replicate_tts": (
+        int(os.getenv("REPLICATE_TTS_LIMIT_INITIAL", "2")),
+        int(os.getenv("REPLICATE_TTS_LIMIT_MIN", "1")),
+        int(os.getenv("REPLICATE_TTS_LIMIT_MAX", "8")),
+    ),
+}
+DEFAULT_BOUNDS = (2, 1, 8)
+
+# A call slower than baseline * LATENCY_SPIKE_FACTOR counts as a spike
+LATENCY_SPIKE_FACTOR = float(os.getenv("LATENCY_SPIKE_FACTOR", "2.0"))
+DECREASE_ON_SPIKE = 0.9
+DECREASE_ON_OVERLOAD = 0.5
+BASELINE_SMOOTHING = 0.1
+
+
+class AdaptiveLimiter:
+    """Blocking in-flight limit that adapts with additive-increase / multiplicative-decrease."""
+
+    def __init__(self, name: str, initial: int, min_limit: int, max_limit: int):
+        self.name = name
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit)
+        self.limit = float(min(max(initial, self.min_limit), self.max_limit))
+        self.in_flight = 0
+        self.baseline: Optional[float] = None
+        self._cond = threading.Condition()
+
+    def acquire(self) -> None:
+        with self._cond:
+            while self.in_flight >= int(self.limit):
+                self._cond.wait()
+            self.in_flight += 1
+
+    def release(self, latency: Optional[float] = None, overloaded: bool = False) -> None:
+        """
+        Free a slot and adapt the limit:
+        - overloaded (429): halve the limit
+        - latency spike vs. baseline: shrink slightly
+        - otherwise: grow by ~1 per limit's worth of successful calls
+        latency=None (a non-rate-limit failure) frees the slot without adapting.
+        """
+        with self._cond:
+            self.in_flight -= 1
+
+            if overloaded:
+                self.limit = max(self.min_limit, self.limit * DECREASE_ON_OVERLOAD)
+            elif latency is not None:
+                if self.baseline is None:
+                    self.baseline = latency
+                if latency > self.baseline * LATENCY_SPIKE_FACTOR:
+                    self.limit = max(self.min_limit, self.limit * DECREASE_ON_SPIKE)
+                else:
+                    self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+                self.baseline += BASELINE_SMOOTHING * (latency - self.baseline)
+
+            self._cond.notify_all()
+
+    def snapshot(self) -> dict:
+        with self._cond:
+            return {
+                "limit": int(self.limit),
+                "in_flight": self.in_flight,
+                "latency_baseline": self.baseline,
+            }
+
+
+_limiters: dict = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(name: str) -> AdaptiveLimiter:
+    with _limiters_lock:
+        limiter = _limiters.get(name)
+        if limiter is None:
+            initial, lo, hi = LIMITER_BOUNDS.get(name, DEFAULT_BOUNDS)
+            limiter = _limiters[name] = AdaptiveLimiter(name, initial, lo, hi)
+        return limiter
+
+
+def limiter_snapshot() -> dict:
+    """Current limit / in-flight / latency baseline of every limiter, for monitoring."""
+    with _limiters_lock:
+        limiters = list(_limiters.values())
+    return {lim.name: lim.snapshot() for lim in limiters}
@@ -0,0 +1,206 @@
+"""
+Supervised pool of long-lived local SDXL-Turbo worker processes.
+
+Each worker loads the diffusers pipeline once at start-up, reports "ready",
+and then serves prompt batches from its own request queue, so model loading
+is no longer part of any book's latency. The pool gives a request to an idle
+ready worker and waits at most the per-request timeout for its answer. A
+worker that misses the deadline, or dies, is killed and replaced; the other
+workers, and their warm models, are left alone.
+
+Workers are spawned, not forked: the parent may hold threads, locks and
+open connections (Streamlit, HTTP pools) that must not be copied into them.
+The pool is started explicitly (worker.py), never as an import side effect.
+
+Prompts arrive already strengthened; workers only run the pipeline.
+"""
+import os
+import time
+import queue
+import atexit
+import logging
+import threading
+import multiprocessing as mp
+from typing import List, Optional
+
+LOCAL_WORKERS = int(os.getenv("LOCAL_WORKERS", "1"))   # one per GPU is usually right
+LOCAL_LOAD_TIMEOUT_SECONDS = float(os.getenv("LOCAL_LOAD_TIMEOUT_SECONDS", "600"))   # model load, not counted per request
+LOCAL_POLL_SECONDS = 1.0   # how often a waiting caller checks that its worker is still alive
+
+
+def _load_pipe(model_id: str):
+    from diffusers import AutoPipelineForText2Image
+    import torch
+
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    dtype = torch.float16 if device == "cuda" else torch.float32
+
+    logging.info(f"Loading SDXL-Turbo locally ({model_id})…")
+    pipe = AutoPipelineForText2Image.from_pretrained(
+        model_id,
+        use_safetensors=True,
+    )
+
+    try:
+        pipe = pipe.to(device, dtype=dtype)
+    except:
+        pipe = pipe.to(device)
+    return pipe
+
+
+def _worker_loop(model_id: str, requests, results) -> None:
+    """Worker process: load once, then serve (prompts, width, height, steps) batches forever."""
+    try:
+        pipe = _load_pipe(model_id)
+    except Exception as e:
+        results.put(("load_failed", e))
+        return
+    results.put(("ready", None))
+
+    while True:
+        req = requests.get()
+        if req is None:
+            return
+        prompts, width, height, steps = req
+        try:
+            try:
+                imgs = pipe(
+                    prompts,
+                    width=width,
+                    height=height,
+                    num_inference_steps=steps,
+                    guidance_scale=0.0,
+                ).images
+            except TypeError:
+                # fallback sequential
+                imgs = [
+                    pipe(p, width=width, height=height, num_inference_steps=steps, guidance_scale=0.0).images[0]
+                    for p in prompts
+                ]
+            results.put(("ok", imgs))
+        except Exception as e:
+            results.put(("error", e))
+
+
+class _Worker:
+    def __init__(self, ctx, model_id: str):
+        self.requests = ctx.Queue()
+        self.results = ctx.Queue()
+        self.process = ctx.Process(
+            target=_worker_loop, args=(model_id, self.requests, self.results), daemon=True,
+        )
+        self.process.start()
+        self.ready = False
+
+    def get_result(self, timeout: float) -> Optional[tuple]:
+        """Next (status, payload) from the worker, or None on timeout or when the process died."""
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                return self.results.get(timeout=max(0.0, min(LOCAL_POLL_SECONDS, deadline - time.monotonic())))
+            except queue.Empty:
+                pass
+            if not self.process.is_alive():
+                logging.error(f"Local SDXL worker died (exit code {self.process.exitcode}).")
+                return None
+            if time.monotonic() >= deadline:
+                return None
+
+    def wait_ready(self, timeout: float) -> bool:
+        if self.ready:
+            return True
+        result = self.get_result(timeout)
+        if result is None:
+            return False
+        status, err = result
+        if status != "ready":
+            logging.error(f"Local SDXL worker failed to load the model: {err}")
+            return False
+        self.ready = True
+        return True
+
+    def kill(self) -> None:
+        if self.process.is_alive():
+            self.process.terminate()
+        self.process.join(5)
+
+
+class LocalImagePool:
+    """Fixed-size pool of warm SDXL workers with per-request deadlines and restarts."""
+
+    def __init__(self, model_id: str, size: int = LOCAL_WORKERS):
+        self.model_id = model_id
+        # Workers import torch themselves; spawn keeps the parent's threads and sockets out of them
+        self._ctx = mp.get_context("spawn")
+        self._idle: "queue.Queue[_Worker]" = queue.Queue()
+        self._lock = threading.Lock()
+        self._workers: List[_Worker] = []
+        for _ in range(max(1, size)):
+            self._start_worker()
+
+    def _start_worker(self) -> _Worker:
+        worker = _Worker(self._ctx, self.model_id)
+        with self._lock:
+            self._workers.append(worker)
+        self._idle.put(worker)
+        return worker
+
+    def _replace(self, worker: _Worker) -> None:
+        worker.kill()
+        with self._lock:
+            if worker in self._workers:
+                self._workers.remove(worker)
+        self._start_worker()
+
+    def generate(self, prompts: List[str], width: int, height: int, steps: int, timeout: float) -> Optional[list]:
+        """
+        Run one batch on an idle worker. Returns the PIL images, or None when no worker
+        became free within the timeout, or the worker missed the deadline or died
+        (it is killed and replaced). Pipeline errors are re-raised.
+        """
+        try:
+            worker = self._idle.get(timeout=timeout)
+        except queue.Empty:
+            logging.error("No local SDXL worker became free in time.")
+            return None
+        if not worker.wait_ready(LOCAL_LOAD_TIMEOUT_SECONDS) or not worker.process.is_alive():
+            self._replace(worker)
+            return None
+
+        worker.requests.put((prompts, width, height, steps))
+        result = worker.get_result(timeout)
+        if result is None:
+            logging.error("Local SDXL worker stuck or dead → FORCE TERMINATING and restarting it.")
+            self._replace(worker)
+            return None
+
+        status, payload = result
+        self._idle.put(worker)
+        if status == "error":
+            raise payload
+        return payload
+
+    def shutdown(self) -> None:
+        with self._lock:
+            workers = list(self._workers)
+            self._workers.clear()
+        for worker in workers:
+            try:
+                worker.requests.put(None)
+            except Exception:
+                pass
+            worker.kill()
+
+
+_pool: Optional[LocalImagePool] = None
+_pool_lock = threading.Lock()
+
+
+def get_local_pool(model_id: str) -> LocalImagePool:
+    """Process-wide pool, started on first use."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = LocalImagePool(model_id)
+            atexit.register(_pool.shutdown)
+        return _pool
@@ -19,7 +19,9 @@ from __future__ import annotations
 import os
 import base64
 import io
-from typing import List, Tuple, Optional
+import shutil
+import textwrap
+from typing import List, Tuple, Optional, Callable, Iterator, Iterable
 from dotenv import find_dotenv, load_dotenv
 import streamlit as st
 from streamlit_extras.switch_page_button import switch_page
@@ -45,18 +47,35 @@ from io import BytesIO
 from reportlab.pdfgen.canvas import Canvas
 import qrcode 
 from PIL import Image as PILImage
+from pydub import AudioSegment
 from reportlab.pdfgen import canvas as canvas_module
 import boto3
 import uuid
 import time
 import logging
-from multiprocessing import Process, Queue
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait as wait_futures
 import replicate
-import requests
+import httpx
 from utils.language import get_language
+from utils.quota import call_with_quota
+from utils.limiter import limiter_snapshot
+from utils.transport import get_http_session, new_httpx_client, new_httpx_transport, http_timeout, download_bytes, iter_download, prewarm_connections
+from utils.transport import HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT, OPENAI_READ_TIMEOUT, HTTP_POOL_SIZE
+from utils.clients import register_client, get_client
+from utils.cover_pool import claim_cover
+from utils.local_images import get_local_pool
+from utils.cache import get_cache, cache_key, LLM_CACHE_ENABLED, LLM_CACHE_DIR, LLM_CACHE_MAX_BYTES, LLM_CACHE_TTL_SECONDS
+from utils.cache import IMAGE_CACHE_ENABLED, IMAGE_CACHE_DIR, IMAGE_CACHE_MAX_BYTES, IMAGE_CACHE_TTL_SECONDS
+from utils.cache import AUDIO_CACHE_ENABLED, AUDIO_CACHE_DIR, AUDIO_CACHE_MAX_BYTES, AUDIO_CACHE_TTL_SECONDS
+from botocore.config import Config as BotoConfig
+from botocore.exceptions import ClientError
 from reportlab.pdfbase import pdfmetrics
 from reportlab.pdfbase.ttfonts import TTFont
 import re
+import hashlib
+import json
+import math
 
 
 
@@ -120,6 +139,49 @@ REPLICATE_AUDIO_MODEL_ID = (
 
 LOCAL_MAX_SECONDS = float(os.getenv("LOCAL_MAX_SECONDS", "25.0"))
 HARD_TIMEOUT_SECONDS = int(os.getenv("HARD_TIMEOUT_SECONDS", "300"))   # hard kill: 5 minutes
+R2_PART_BYTES = int(os.getenv("R2_PART_BYTES", str(8 * 1024 * 1024)))   # multipart chunk; R2 minimum is 5 MiB
+R2_AUDIO_CACHE_CONTROL = os.getenv("R2_AUDIO_CACHE_CONTROL", "public, max-age=86400")
+TTS_PER_SCENE = os.getenv("TTS_PER_SCENE", "0") == "1"   # synthesize scenes in parallel and stitch them locally
+TTS_MAX_CHARS = int(os.getenv("TTS_MAX_CHARS", "1000"))   # per-prediction input limit; longer scenes split at sentences
+TTS_CONCURRENCY = int(os.getenv("TTS_CONCURRENCY", "8"))   # per-book ceiling; utils/limiter.py adapts the real in-flight limit
+TTS_SEGMENT_RETRIES = int(os.getenv("TTS_SEGMENT_RETRIES", "2"))
+TTS_SCENE_PAUSE_MS = int(os.getenv("TTS_SCENE_PAUSE_MS", "700"))   # silence between scenes in the stitched narration
+TTS_TARGET_DBFS = float(os.getenv("TTS_TARGET_DBFS", "-20.0"))   # every segment is gain-matched to this loudness
+AUDIO_SEGMENTED = os.getenv("AUDIO_SEGMENTED", "0") == "1"   # per-page segments + manifest/playlist instead of one file
+AUDIO_PROFILE = os.getenv("AUDIO_PROFILE", "")   # "" = upload provider audio as is; else a key of AUDIO_PROFILES
+
+# Speech-optimized encodings for narration (transcode_narration)
+AUDIO_PROFILES = {
+    "mp3": {"format": "mp3", "codec": None, "bitrate": "128k", "channels": 2, "frame_rate": 44100,
+            "ext": "mp3", "content_type": "audio/mpeg"},
+    "speech_mp3": {"format": "mp3", "codec": None, "bitrate": "48k", "channels": 1, "frame_rate": 24000,
+                   "ext": "mp3", "content_type": "audio/mpeg"},
+    "speech_opus": {"format": "ogg", "codec": "libopus", "bitrate": "24k", "channels": 1, "frame_rate": 48000,
+                    "ext": "ogg", "content_type": "audio/ogg"},
+}
+
+if AUDIO_PROFILE and AUDIO_PROFILE not in AUDIO_PROFILES:
+    raise ValueError(f"AUDIO_PROFILE={AUDIO_PROFILE!r} is not one of {sorted(AUDIO_PROFILES)} (or empty)")
+
+# HLS segments (AUDIO_SEGMENTED) have to be MP3; an Ogg/Opus profile falls back to speech_mp3 for them
+SEGMENT_AUDIO_PROFILE = (
+    AUDIO_PROFILE if not AUDIO_PROFILE or AUDIO_PROFILES[AUDIO_PROFILE]["format"] == "mp3" else "speech_mp3"
+)
+if AUDIO_SEGMENTED and SEGMENT_AUDIO_PROFILE != AUDIO_PROFILE:
+    logging.warning(f"AUDIO_PROFILE={AUDIO_PROFILE!r} cannot be used for HLS segments; using {SEGMENT_AUDIO_PROFILE!r}.")
+
+# pydub decodes and encodes through ffmpeg (packages.txt installs it on Streamlit Cloud)
+if TTS_PER_SCENE and shutil.which("ffmpeg") is None:
+    logging.error("TTS_PER_SCENE=1 but ffmpeg is not on PATH; narrating each story as one prediction instead.")
+    TTS_PER_SCENE = False
+STORY_STREAMING = os.getenv("STORY_STREAMING", "0") == "1"   # stream the story and start illustrations per scene
+STORY_OUTLINE_MODE = os.getenv("STORY_OUTLINE_MODE", "0") == "1"   # outline call + parallel per-scene expansion
+STORY_OUTLINE_MIN_PAGES = int(os.getenv("STORY_OUTLINE_MIN_PAGES", "8"))   # only for books at least this long
+STORY_STRUCTURED_OUTPUT = os.getenv("STORY_STRUCTURED_OUTPUT", "0") == "1"   # JSON-schema story output, invalid scenes repaired
+STORY_REPAIR_ATTEMPTS = int(os.getenv("STORY_REPAIR_ATTEMPTS", "2"))   # re-requests of invalid scenes before giving up
+STORY_GATE_ATTEMPTS = int(os.getenv("STORY_GATE_ATTEMPTS", "2"))   # quality-gate regeneration rounds before images/audio
+STORY_GATE_WORD_TOLERANCE = float(os.getenv("STORY_GATE_WORD_TOLERANCE", "0.5"))   # slack around per-scene word targets
+IMAGE_CONCURRENCY = int(os.getenv("IMAGE_CONCURRENCY", "12"))   # per-book ceiling; utils/limiter.py adapts the real in-flight limit
 
 DEFAULT_SIZE = (768, 768)
 FALLBACK_SIZE = (512, 512)
@@ -133,11 +195,94 @@ _BLANK_PNG_B64 = (
     "AqF5/AAAAABJRU5ErkJggg=="
 )
 
-_local_pipe = None
-_replicate_client = None
 
-# Initialize OpenAI client
-openai_client = OpenAI(api_key=OPENAI_API_KEY)
+# ------------------ Shared provider clients ------------------
+# Built lazily once per process and shared by all sessions (utils/clients.py)
+def _build_openai_client():
+    # OpenAI client on its own pooled HTTP transport. Story completions and
+    # image renders can run for minutes, so reads get a longer timeout than other calls.
+    # SDK retries are off: every 429 has to reach call_with_quota (utils/quota.py).
+    http_client = new_httpx_client(OPENAI_READ_TIMEOUT)
+    prewarm_connections(["https://api.openai.com/v1/"], httpx_client=http_client)
+    return OpenAI(
+        api_key=OPENAI_API_KEY,
+        http_client=http_client,
+        timeout=httpx.Timeout(OPENAI_READ_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT),
+        max_retries=0,
+    )
+
+
+def _build_r2_client():
+    """Create boto3 client for Cloudflare R2 using Streamlit secrets."""
+    account_id = st.secrets["r2"]["account_id"]
+    access_key = st.secrets["r2"]["access_key"]
+    secret_key = st.secrets["r2"]["secret_key"]
+
+    session = boto3.session.Session()
+    return session.client(
+        "s3",
+        endpoint_url=f"https://{account_id}.r2.cloudflarestorage.com",
+        aws_access_key_id=access_key,
+        aws_secret_access_key=secret_key,
+        config=BotoConfig(
+            max_pool_connections=HTTP_POOL_SIZE,
+            connect_timeout=HTTP_CONNECT_TIMEOUT,
+            read_timeout=HTTP_READ_TIMEOUT,
+            retries={"max_attempts": 3, "mode": "standard"},
+        ),
+    )
+
+
+def _build_replicate_client():
+    if not REPLICATE_API_TOKEN:
+        raise RuntimeError("REPLICATE_API_TOKEN missing")
+    # Replicate builds its own httpx.Client around the pooled transport we pass in
+    client = replicate.Client(
+        api_token=REPLICATE_API_TOKEN,
+        timeout=httpx.Timeout(HTTP_READ_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT),
+        transport=new_httpx_transport(),
+    )
+    # The SDK wraps that transport in a RetryTransport that also retries 429s on GETs
+    # (prediction polling). Keep its 5xx retries, but leave 429s to call_with_quota.
+    retry_transport = client._client._transport
+    retry_transport.retry_status_codes = retry_transport.retry_status_codes - {429}
+    prewarm_connections(["https://api.replicate.com/v1/"], httpx_client=client._client)
+    return client
+
+
+def _build_sendgrid_client():
+    return SendGridAPIClient(SENDGRID_API_KEY)
+
+
+def _prewarm_sdk_clients():
+    # Building a client opens its own connection pool (see the builders above)
+    for name in ("openai", "replicate"):
+        try:
+            get_client(name)
+        except Exception as e:
+            logging.info(f"Client '{name}' not pre-built: {e}")
+
+
+# A reset client closes its connection pool, so the next build gets fresh connections
+register_client(
+    "openai", _build_openai_client,
+    health_check=lambda c: c.models.list(),
+    close=lambda c: c.close(),
+)
+register_client(
+    "r2", _build_r2_client,
+    health_check=lambda c: c.head_bucket(Bucket=st.secrets["r2"]["bucket_name"]),
+)
+register_client(
+    "replicate", _build_replicate_client,
+    health_check=lambda c: c.accounts.current(),
+    close=lambda c: c._client.close(),
+)
+register_client("sendgrid", _build_sendgrid_client)
+
+# Open provider connections in the background once per process
+prewarm_connections()
+threading.Thread(target=_prewarm_sdk_clients, daemon=True).start()
 
 # ------------------ Configuration & Helpers ------------------
 # Import fonts
@@ -204,29 +349,14 @@ AUDIO_LINK_STYLE = getSampleStyleSheet()["Normal"]
 
 
 # ------------------ OpenAI prompts & generation ------------------
-def build_story_prompt(
-    child_name: str,
-    child_age: str,
-    child_interest: str,
-    story_objective: str,
-    your_name: str,
-    page_length: int,
-) -> str:
-    """
-    page_length: expected 4, 8, or 12 (number of scenes/pages)
-    """
-
-    # Defensive normalization
+def _scene_word_targets(child_age) -> Tuple[int, int, int, str]:
+    """Return (per_scene_min, per_scene_max, per_scene_target, sentence_guidance) for the child's age."""
     try:
         age_num = float(str(child_age).strip())
     except Exception:
         age_num = None
 
-    if page_length not in (4, 8, 12):
-        # fall back safely
-        page_length = 4
-
-    # Word targets: use age to set density, then scale by page_length
+    # Word targets: use age to set density
     # (Keep these conservative to reduce rambling.)
     if age_num is None:
         per_scene_target = 28
@@ -244,33 +374,46 @@ def build_story_prompt(
         per_scene_target = 32
         sentence_guidance = "3–5 sentences"
 
-    total_target = per_scene_target * page_length
     # Give the model a tight band (±10–15%) to help it comply
     per_scene_min = max(12, int(per_scene_target * 0.85))
     per_scene_max = int(per_scene_target * 1.15)
+    return per_scene_min, per_scene_max, per_scene_target, sentence_guidance
 
-    prompt = f"""
-        You are a children's storybook generator. Create a personalized, age-appropriate, multi-scene illustrated storybook.
 
-        INPUTS
-        - Child name (for story text only): {child_name}
-        - Child age: {child_age}
-        - Child interests: {child_interest}
-        - Story objective: {story_objective}
-        - Author name: {your_name}
-        - Required page/scenes count: {page_length} scenes (exactly {page_length})
-
-        HARD OUTPUT FORMAT (MUST FOLLOW EXACTLY)
-        - Output ONLY the scenes. No title. No intro. No outro. No commentary.
-        - Produce exactly {page_length} scenes.
-        - For each scene, output:
-        1) Scene narrative text (no label like "Scene 1")
-        2) On the next line: ONE illustration prompt in parentheses
-        3) Then a line containing exactly: ---
-        - The last scene must also end with '---'.
+def _story_prompt_prefix(page_length: int, child_age, structured: bool = False) -> str:
+    """
+    Static instruction block of build_story_prompt().
+    It depends only on (page_length, age band, output mode), so it is byte-identical
+    across children and providers can serve it from their prompt-prefix cache.
+    """
+    per_scene_min, per_scene_max, per_scene_target, sentence_guidance = _scene_word_targets(child_age)
+    total_target = per_scene_target * page_length
 
+    if structured:
+        output_format = textwrap.dedent(f"""\
+            HARD OUTPUT FORMAT (MUST FOLLOW EXACTLY)
+            - Return JSON only: {{"title": "...", "scenes": [{{"text": "...", "illustration_prompt": "..."}}]}}
+            - "title": one short storybook title, without quotation marks.
+            - "scenes": exactly {page_length} entries, in story order.
+            - "text": the scene narrative only (no label like "Scene 1").
+            - "illustration_prompt": ONE illustration prompt for that scene, without parentheses.
+        """)
+    else:
+        output_format = textwrap.dedent(f"""\
+            HARD OUTPUT FORMAT (MUST FOLLOW EXACTLY)
+            - First line: TITLE: followed by one short storybook title (no quotation marks).
+            - Then output ONLY the scenes. No intro. No outro. No commentary.
+            - Produce exactly {page_length} scenes.
+            - For each scene, output:
+            1) Scene narrative text (no label like "Scene 1")
+            2) On the next line: ONE illustration prompt in parentheses
+            3) Then a line containing exactly: ---
+            - The last scene must also end with '---'.
+        """)
+
+    rules = textwrap.dedent(f"""\
         SCENE WRITING RULES (STRICT)
-        - The story text may mention "{child_name}" (main character). Illustration prompts MUST NOT include the child's name or any real person name.
+        - The story text may mention the child by the name given in INPUTS (main character). Illustration prompts MUST NOT include the child's name or any real person name.
         - Keep language warm, soothing, encouraging, and imaginative. No scary content. No moralizing lectures.
         - Overall arc: hook early → gentle problem → positive resolution by the end.
         - Interests must shape the world/plot naturally (not just mentioned).
@@ -290,43 +433,73 @@ def build_story_prompt(
         - Main character consistent across pages: round face, simple dot eyes, soft outlines, consistent clothing colors, same hairstyle, same gender
         - Do not depict any real or identifiable person. Fully fictional stylized cartoon characters only.
         - Do NOT include the child’s name or any real name in the illustration prompt.
+    """)
 
-        NOW GENERATE THE STORY IN THE REQUIRED FORMAT:
-    """.strip()
+    intro = (
+        "You are a children's storybook generator. Create a personalized, age-appropriate, "
+        "multi-scene illustrated storybook from the INPUTS given at the end."
+    )
+    return f"{intro}\n\n{output_format}\n{rules}".strip()
 
-    return prompt
 
-def build_story_prompt_lang(intake: dict) -> str:
-    lang = intake.get("language", "en")
-    child_name = intake.get("child_name")
-    child_age = intake.get("child_age")
-    child_interest = intake.get("child_interest")
-    story_objective = intake.get("story_objective")
-    your_name = intake.get("your_name")
-    
-    if lang == "en":
-        prompt = f"""
-            You are a children's storybook generator. Create a personalized, age-appropriate, multi-scene illustrated storybook based on the input parameters below.
-            
-            Child name: {intake['child_name']}
-            Child age: {intake['child_age']}
-            Child interests: {intake['child_interest']}
-            Story objective: {intake['story_objective']}
+def build_story_prompt(
+    child_name: str,
+    child_age: str,
+    child_interest: str,
+    story_objective: str,
+    your_name: str,
+    page_length: int,
+    structured: bool = False,
+) -> str:
+    """
+    page_length: expected 4, 8, or 12 (number of scenes/pages)
+    structured: ask for JSON (STORY_JSON_SCHEMA) instead of '---' scene blocks
 
-            For total scene count and word count, strictly follow these guidelines based on the child's age {intake['child_age']}:
-            - For child's age from 0 - 2 years old, total scene count should be exactly 4 pages with total word count as close to 100 words as possible. 
+    Layout: static rules first (_story_prompt_prefix), per-child inputs last,
+    so requests share a cacheable prompt prefix.
+    """
+
+    # Defensive normalization
+    if page_length not in (4, 8, 12):
+        # fall back safely
+        page_length = 4
+
+    # Built line by line: free-text inputs must not affect indentation handling
+    inputs = "\n".join([
+        "INPUTS",
+        f"- Child name (for story text only): {child_name}",
+        f"- Child age: {child_age}",
+        f"- Child interests: {child_interest}",
+        f"- Story objective: {story_objective}",
+        f"- Author name: {your_name}",
+        f"- Required page/scenes count: {page_length} scenes (exactly {page_length})",
+        "",
+        "NOW GENERATE THE STORY IN THE REQUIRED FORMAT:",
+    ])
+
+    return f"{_story_prompt_prefix(page_length, child_age, structured)}\n\n{inputs}"
+
+
+# Static instruction blocks of build_story_prompt_lang(), one per language.
+# Per-child inputs are appended after them so the prefix is cacheable.
+_STORY_PROMPT_LANG_PREFIX = {
+    "en": """
+            You are a children's storybook generator. Create a personalized, age-appropriate, multi-scene illustrated storybook based on the input parameters given at the end.
+
+            For total scene count and word count, strictly follow these guidelines based on the child's age:
+            - For child's age from 0 - 2 years old, total scene count should be exactly 4 pages with total word count as close to 100 words as possible.
             - For child's age from 2 - 4 years old, total scene count should be exactly 4 pages with total word count as close to 100 words as possible.
             - For child's age from 4 - 6 years old, total scene count should be exactly 4 pages with total word count as close to 100 words as possible.
             - For child's age above 6 years old, total scene count should be exactly 4 pages with total word count as close to 100 words as possible.
-            
+
             For each scene, follow these guidelines strictly:
-            - The scene text includes 2-5 sentences of narrative tailored to {intake['child_age']}-old children, featuring {child_name} as the main character, incorporating {intake['child_interest']} and aligned with the story objective of {intake['story_objective']}.
-            - Keep the scene text simple, warm, and imaginative, language appropriate and easy enough for {intake['child_age']}-year-olds.
-            - After the scene text, then include one short illustration prompt in parentheses on its own line immediately after the scene text. 
+            - The scene text includes 2-5 sentences of narrative tailored to children of the given age, featuring the child as the main character, incorporating the child's interests and aligned with the story objective.
+            - Keep the scene text simple, warm, and imaginative, language appropriate and easy enough for children of the given age.
+            - After the scene text, then include one short illustration prompt in parentheses on its own line immediately after the scene text.
             - Then immediately, separate each scene (including both the scene text and illustration prompt) with '---' on its own line.
-            - Do not include any language that is not relevant to the scene text and illustration prompt in the generated output. 
+            - Do not include any language that is not relevant to the scene text and illustration prompt in the generated output.
             - Do not include story title, nor any note at the beginning or end relating to word count and how the generated text meets the input requirements, or text like "Here is the personalized storybook for...".
-            
+
             For illustration prompts, follow these guidelines strictly:
             - Each illustration prompt should describe only what each scene appears visually. No text inside the images.
             - Include in each illustration prompt that it is for storybook illustration, full-bleed composition, wide scene, background extends to edges, no border, no frame, no white margins, soft pastel watercolor style.
@@ -337,54 +510,46 @@ def build_story_prompt_lang(intake: dict) -> str:
             - Do not depict any real or identifiable person, nor mention any children name in the prompt. Create fully fictional, stylized cartoon characters with no realistic human features.
 
             Follow these for the story guidelines:
-            - Scenes should begin with a captivating hook. 
-            - Include a gentle problem and a positive resolution. 
+            - Scenes should begin with a captivating hook.
+            - Include a gentle problem and a positive resolution.
             - Make sure the child interests shape the story world and plot.
-            
+
             Adhere to these writing style guidelines:
-            - Use clear language suitable for {intake['child_age']} children. Keep language simple, warm, and imaginative. 
+            - Use clear language suitable for children of the given age. Keep language simple, warm, and imaginative.
             - Keep tone warm, soothing, and encouraging.
-            - No scary or age-inappropriate content. 
+            - No scary or age-inappropriate content.
             - No typos and smooth flows.
 
-            Importantly, keep the scene / page count and word count exactly as specified above. Use simple words and short sentences suitable for {intake['child_age']} children.
-            Very importantly again, strictly follow the scene guidelines and illustration prompt guidelines mentioned above. 
-            
+            Importantly, keep the scene / page count and word count exactly as specified above. Use simple words and short sentences suitable for children of the given age.
+            Very importantly again, strictly follow the scene guidelines and illustration prompt guidelines mentioned above.
+
             Lastly, strictly adhere to the following instructions for scene formatting, for each scene:
             - Do not include any text other than the scene text and illustration prompt, such as title or introductory text for example "Here is the personalized storybook for...".
-            - Immediately after the scene text, include one short illustration prompt in parentheses on its own new line. 
+            - Immediately after the scene text, include one short illustration prompt in parentheses on its own new line.
             - Then immediately, separate each scene (including both the scene text and illustration prompt) with '---' on its own new line.
             - Do not include any language that is not relevant to the scene text and illustration prompt in the generated output, such as story title, or notes at the beginning or end related to word count and how the generated text meets the requirements.
             - Remember to separate each scene (including both the scene text and illustration prompt) with '---' on its own line.
             - Remember to include one short illustration prompt in parentheses on its own new line immediately after the scene text for each scene.
             - Remember to include in each illustration prompt that it is for storybook illustration, full-bleed composition, wide scene, background extends to edges, no border, no frame, no white margins, soft pastel watercolor style.
             - Remember that do not include any text other than the scene text and illustration prompt, such as "Here is the personalized storybook for..." in scene texts.
-            
-            Story starts now:
-        """
-    else:
-        prompt = f"""
-            你是一位儿童故事书生成器。请根据以下输入参数，创作一个个性化、适合年龄的多场景插图故事书。
-            
-            孩子名字：{intake['child_name']}
-            孩子年龄：{intake['child_age']}
-            孩子兴趣：{intake['child_interest']}
-            故事目标：{intake['story_objective']}
-            
-            针对总场景数和字数，请严格遵循以下指导方针，基于孩子的年龄 {intake['child_age']}：
-            - 对于0-2岁的孩子，总场景数应为4页，字数尽量接近100字。 
+    """.strip(),
+    "zh": """
+            你是一位儿童故事书生成器。请根据文末的输入参数，创作一个个性化、适合年龄的多场景插图故事书。
+
+            针对总场景数和字数，请严格遵循以下指导方针，基于孩子的年龄：
+            - 对于0-2岁的孩子，总场景数应为4页，字数尽量接近100字。
             - 对于2-4岁的孩子，总场景数应为4页，字数尽量接近100字。
             - 对于4-6岁的孩子，总场景数应为4页，字数尽量接近100字。
             - 对于6岁以上的孩子，总场景数应为4页，字数尽量接近100字。
-            
+
             对于每个场景，请严格遵循以下指导方针：
-            - 场景文本包括2-5个句子的叙述，适合 {intake['child_age']} 岁的孩子，以 {intake['child_name']} 为主角，融入 {intake['child_interest']} 并与故事目标 {intake['story_objective']} 保持一致。
-            - 保持场景文本简单、温暖且富有想象力，语言适合 {intake['child_age']} 岁的孩子理解。
-            - 在场景文本之后，在新行中立即包含一个括号内的简短插图提示。 
+            - 场景文本包括2-5个句子的叙述，适合该年龄的孩子，以孩子为主角，融入孩子的兴趣并与故事目标保持一致。
+            - 保持场景文本简单、温暖且富有想象力，语言适合该年龄的孩子理解。
+            - 在场景文本之后，在新行中立即包含一个括号内的简短插图提示。
             - 然后立即，用“---”分隔每个场景（包括场景文本和插图提示）。
-            - 请勿在生成的输出中包含与场景文本和插图提示无关的任何语言。 
+            - 请勿在生成的输出中包含与场景文本和插图提示无关的任何语言。
             - 请勿包含故事标题，或与字数及其如何满足输入要求相关的任何注释，或类似“这是为……生成的个性化故事书”的文本。
-            
+
             请遵守以下插图提示指导方针：
             - 插图提示应仅描述每个场景的视觉外观。插图提示中应包含以下内容：适合故事书插图、全幅构图、宽场景、背景延伸至边缘、无边框、无白色边距、柔和的水彩风格。
             - 插图中的虚构角色在所有场景中必须保持一致。主角在各页中外观相同：圆脸、简单的点状眼睛、柔和的轮廓、一致的服装颜色, 一致的发型, 一致的性别。
@@ -392,21 +557,21 @@ def build_story_prompt_lang(intake: dict) -> str:
             - 光线均衡中性，氛围平静舒缓。无金黄色、橙色或棕褐色调。
             - 形状圆润，友好，适合儿童。异想天开的，柔和的卡通风格。日光白平衡。
             - 请勿描绘任何真实或可识别的人物，也不要在提示中提及任何儿童姓名。请创建完全虚构的、风格化的卡通角色，不具有真实的人类特征。
-            
+
             请遵守以下故事指导方针：
             - 场景应以引人入胜的开头开始。
             - 包含一个温和的问题和积极的解决方案。
             - 确保孩子的兴趣塑造故事世界和情节。
-            
+
             请遵守以下写作风格指导方针：
-            - 使用适合{intake['child_age']}岁儿童的清晰语言。 语言应简单、温暖且富有想象力。
+            - 使用适合该年龄儿童的清晰语言。 语言应简单、温暖且富有想象力。
             - 保持语气温暖、舒缓和鼓励性。
             - 不包含任何可怕或不适合年龄的内容。
             - 无拼写错误，流畅自然。
-            
-            重要的是，请严格按照上述规定的场景/页数和字数要求进行创作。请使用适合{intake['child_age']}岁儿童的简单词汇和简短句子。
+
+            重要的是，请严格按照上述规定的场景/页数和字数要求进行创作。请使用适合该年龄儿童的简单词汇和简短句子。
             非常重要的是，请严格遵循上述提到的场景指导方针和插图提示指导方针。
-            
+
             请严格遵守以下场景格式说明：
             - 请勿包含除场景文本和插图提示之外的任何文本，例如标题或介绍性文本，例如“这是为……生成的个性化故事书”。
             - 在场景文本后，立即在新行中用括号括起一个简短的插图提示。
@@ -416,38 +581,49 @@ def build_story_prompt_lang(intake: dict) -> str:
             - 请在每个场景的场景文本后，立即在新行中用括号括起一个简短的插图提示。
             - 请在每个插图提示中包含以下内容：适合故事书插图、全幅构图、宽场景、背景延伸至边缘、无边框、无白色边距、柔和的水彩风格。
             - 请勿在场景文本中包含除场景文本和插图提示之外的任何文本，例如“这是为……生成的个性化故事书”。
-            
-            故事开始：
-        """
-    return prompt
+    """.strip(),
+}
 
-def build_story_prompt_replicate(intake: dict) -> str:
+def build_story_prompt_lang(intake: dict) -> str:
     lang = intake.get("language", "en")
-    child_name = intake.get("child_name")
-    child_age = intake.get("child_age")
-    child_interest = intake.get("child_interest")
-    story_objective = intake.get("story_objective")
-    your_name = intake.get("your_name")
-    
+
     if lang == "en":
-        prompt = f"""
-            Create a personalized, age-appropriate, multi-scene illustrated storybook based on the input parameters below.
-            
-            Child name: {child_name}
-            Child age: {child_age}
-            Child interests: {child_interest}
-            Story objective: {story_objective}
-            
-            For total scene count and word count, strictly follow these guidelines based on the child's age {child_age}:
-            - For child's age from 0 - 2 years old, total scene count should be exactly 3 pages/scenes with total word count as close to 75 words as possible. 
+        inputs = f"""
+            Child name: {intake['child_name']}
+            Child age: {intake['child_age']}
+            Child interests: {intake['child_interest']}
+            Story objective: {intake['story_objective']}
+
+            Story starts now:
+        """.strip()
+        prompt = f"{_STORY_PROMPT_LANG_PREFIX['en']}\n\n{inputs}"
+    else:
+        inputs = f"""
+            孩子名字：{intake['child_name']}
+            孩子年龄：{intake['child_age']}
+            孩子兴趣：{intake['child_interest']}
+            故事目标：{intake['story_objective']}
+
+            故事开始：
+        """.strip()
+        prompt = f"{_STORY_PROMPT_LANG_PREFIX['zh']}\n\n{inputs}"
+    return prompt
+
+# Static instruction blocks of build_story_prompt_replicate(), one per language.
+_STORY_PROMPT_REPLICATE_PREFIX = {
+    "en": """
+            Create a personalized, age-appropriate, multi-scene illustrated storybook based on the input parameters given at the end.
+
+            For total scene count and word count, strictly follow these guidelines based on the child's age:
+            - For child's age from 0 - 2 years old, total scene count should be exactly 3 pages/scenes with total word count as close to 75 words as possible.
             - For child's age from 2 - 4 years old, total scene count should be exactly 5 pages/scenes with total word count as close to 125 words as possible.
             - For child's age from 4 - 6 years old, total scene count should be exactly 6 pages/scenes with total word count as close to 150 words as possible.
             - For child's age above 6 years old, total scene count should be exactly 6 pages/scenes with total word count as close to 180 words as possible.
-            
+
             For each scene, follow these guidelines strictly:
-            - The scene text includes 2-5 sentences of narrative in one paragraph tailored to {child_age}-old children, featuring {child_name} as the main character, incorporating {child_interest} and aligned with the story objective of {story_objective}. Do not have more than one paragraph per scene text.
-            - Keep the scene text simple, warm, and imaginative, language appropriate and easy enough for {child_age}-year-olds.
-            - After the scene text, then include one short illustration prompt in parentheses on its own line immediately after the scene text. 
+            - The scene text includes 2-5 sentences of narrative in one paragraph tailored to children of the given age, featuring the child as the main character, incorporating the child's interests and aligned with the story objective. Do not have more than one paragraph per scene text.
+            - Keep the scene text simple, warm, and imaginative, language appropriate and easy enough for children of the given age.
+            - After the scene text, then include one short illustration prompt in parentheses on its own line immediately after the scene text.
             - Then immediately, separate each scene (including both the scene text and illustration prompt) with '---' on its own line.
             - Do not include any language that is not relevant to the scene text and illustration prompt in the generated output, such as the story title, or any note at the beginning or end relating to word count and how the generated text meets the input requirements, or text like "Here is the personalized storybook for...".
 
@@ -456,71 +632,228 @@ def build_story_prompt_replicate(intake: dict) -> str:
             - Second after the scene description, then include in each illustration prompt that it is: for storybook illustration, full-bleed composition, wide scene, background extends to edges, soft pastel watercolor style, main character has consistent appearance across pages.
             - Illustrations of the fictional characters must be consistent throughout the entire scenes. The main character has the same appearance across pages: round face, simple dot eyes, soft outlines, consistent clothing colors, same hairstyle, same gender.
             - Soft watercolor children-book illustration style. Gentle pastel color palette with soft blues, mint greens, lavender, and light peach. Balanced neutral lighting, calm and soothing mood. No golden yellow, orange, or sepia color cast.
-            - Do not depict any real or identifiable person, nor mention any children name in the prompt. 
+            - Do not depict any real or identifiable person, nor mention any children name in the prompt.
 
             Follow these for the story guidelines:
-            - Scenes should begin with a captivating hook. 
-            - Include a gentle problem and a positive resolution. 
+            - Scenes should begin with a captivating hook.
+            - Include a gentle problem and a positive resolution.
             - Make sure the child interests shape the story world and plot.
-            
+
             Adhere to these writing style guidelines:
-            - Use clear language suitable for {child_age} children. Keep language simple, warm, and imaginative. 
+            - Use clear language suitable for children of the given age. Keep language simple, warm, and imaginative.
             - Keep tone warm, soothing, and encouraging.
             - No scary or age-inappropriate content. No typos and smooth flows.
-            
-            Importantly, keep the scene / page count and word count exactly as specified above. Use simple words and short sentences suitable for {child_age} children.
-            Very importantly again, strictly follow the scene guidelines and illustration prompt guidelines mentioned above. After the scene text, then include one short illustration prompt in parentheses on its own new line immediately after the scene text. 
 
-            Story starts now:
-        """
-    else:
-        prompt = f"""
-            创建一个个性化、适合年龄的多场景插图故事书，基于以下输入参数。
-            
-            孩子名字：{child_name}
-            孩子年龄：{child_age}
-            孩子兴趣：{child_interest}
-            故事目标：{story_objective}
-            
-            针对总场景数和字数，请严格遵循以下指导方针，基于孩子的年龄 {child_age}：
-            - 对于0-2岁的孩子，总场景数应为3页/场景，字数尽量接近75字。 
+            Importantly, keep the scene / page count and word count exactly as specified above. Use simple words and short sentences suitable for children of the given age.
+            Very importantly again, strictly follow the scene guidelines and illustration prompt guidelines mentioned above. After the scene text, then include one short illustration prompt in parentheses on its own new line immediately after the scene text.
+    """.strip(),
+    "zh": """
+            创建一个个性化、适合年龄的多场景插图故事书，基于文末的输入参数。
+
+            针对总场景数和字数，请严格遵循以下指导方针，基于孩子的年龄：
+            - 对于0-2岁的孩子，总场景数应为3页/场景，字数尽量接近75字。
             - 对于2-4岁的孩子，总场景数应为5页/场景，字数尽量接近125字。
             - 对于4-6岁的孩子，总场景数应为6页/场景，字数尽量接近150字。
             - 对于6岁以上的孩子，总场景数应为6页/场景，字数尽量接近180字。
-            
+
             对于每个场景，请严格遵循以下指导方针：
-            - 场景文本包括2-5个句子的叙述在一个自然段，适合 {child_age} 岁的孩子，以 {child_name} 为主角，融入 {child_interest} 并与故事目标 {story_objective} 保持一致。
-            - 保持场景文本简单、温暖且富有想象力，语言适合 {child_age} 岁的孩子理解。
-            - 在场景文本之后，在新行中立即包含一个放在括号内的简短插图提示。一定要在新的一行。 
+            - 场景文本包括2-5个句子的叙述在一个自然段，适合该年龄的孩子，以孩子为主角，融入孩子的兴趣并与故事目标保持一致。
+            - 保持场景文本简单、温暖且富有想象力，语言适合该年龄的孩子理解。
+            - 在场景文本之后，在新行中立即包含一个放在括号内的简短插图提示。一定要在新的一行。
             - 然后立即，用“---”分隔每个场景（包括场景文本和插图提示）。
             - 请勿在生成的输出中包含与场景文本和插图提示无关的任何语言，例如故事标题，或与字数及其如何满足输入要求相关的任何注释，或类似“这是为……生成的个性化故事书”的文本。
-            
+
             请遵守以下插图提示指导方针：
             - 首先，插图提示应先开始描述每个场景的视觉外观。
             - 然后，插图提示在视觉外观描述后包含以下内容：适合故事书插图、全幅构图、宽场景、背景延伸至边缘、柔和的水彩风格，主角在各页中外观一致。
             - 插图中的虚构角色在所有场景中必须保持一致。 主角在各页中外观相同：圆脸、简单的点状眼睛、柔和的轮廓、一致的服装颜色, 一致的发型, 一致的性别。
             - 使用柔和的水彩儿童书插图风格。温和的柔色调调色板，包括柔和的蓝色、薄荷绿色、薰衣草色和浅桃色。光线均衡中性，氛围平静舒缓。无金黄色、橙色或棕褐色调。
             - 请勿描绘任何真实或可识别的人物，也不要在提示中提及任何儿童姓名。
-            
+
             请遵守以下故事指导方针：
             - 场景应以引人入胜的开头开始。
             - 包含一个温和的问题和积极的解决方案。
             - 确保孩子的兴趣塑造故事世界和情节。
-            
+
             请遵守以下写作风格指导方针：
-            - 使用适合{child_age}岁儿童的清晰语言。 语言应简单、温暖且富有想象力。
+            - 使用适合该年龄儿童的清晰语言。 语言应简单、温暖且富有想象力。
             - 保持语气温暖、舒缓和鼓励性。
             - 不包含任何可怕或不适合年龄的内容。无拼写错误，流畅自然。
-            
-            重要的是，请严格按照上述规定的场景/页数和字数要求进行创作。请使用适合{child_age}岁儿童的简单词汇和简短句子。
+
+            重要的是，请严格按照上述规定的场景/页数和字数要求进行创作。请使用适合该年龄儿童的简单词汇和简短句子。
             非常重要的是，请严格遵循上述提到的场景指导方针和插图提示指导方针。在场景文本之后，在新行中立即包含一个放在括号内的简短插图提示。一定要在新的一行。
-            
+    """.strip(),
+}
+
+def build_story_prompt_replicate(intake: dict) -> str:
+    lang = intake.get("language", "en")
+    child_name = intake.get("child_name")
+    child_age = intake.get("child_age")
+    child_interest = intake.get("child_interest")
+    story_objective = intake.get("story_objective")
+
+    if lang == "en":
+        inputs = f"""
+            Child name: {child_name}
+            Child age: {child_age}
+            Child interests: {child_interest}
+            Story objective: {story_objective}
+
+            Story starts now:
+        """.strip()
+        prompt = f"{_STORY_PROMPT_REPLICATE_PREFIX['en']}\n\n{inputs}"
+    else:
+        inputs = f"""
+            孩子名字：{child_name}
+            孩子年龄：{child_age}
+            孩子兴趣：{child_interest}
+            故事目标：{story_objective}
+
             故事开始：
-        """
-    
+        """.strip()
+        prompt = f"{_STORY_PROMPT_REPLICATE_PREFIX['zh']}\n\n{inputs}"
+
     return prompt
 
 
+STORY_SYSTEM_PROMPT = (
+    "You write children's picture-book scenes with strict formatting compliance. "
+    "Return ONLY the TITLE line and the required scene blocks exactly as specified. "
+    "Do not add headings, numbering, or extra commentary."
+)
+
+_TITLE_LINE_RE = re.compile(r"^\s*(?:TITLE|标题)\s*[:：]\s*(.*?)\s*$", re.IGNORECASE)
+
+
+def split_story_title(story_text: str) -> Tuple[str, str]:
+    """
+    Split the leading 'TITLE: ...' line that the story prompts ask for from the scenes.
+    Returns (title, scenes_text); title is "" when the model left it out.
+    """
+    first, sep, rest = (story_text or "").lstrip().partition("\n")
+    match = _TITLE_LINE_RE.match(first)
+    if not match:
+        return "", story_text or ""
+    return match.group(1).strip().strip('"“”'), rest
+
+# Process-wide prompt-token totals, to see how often the static prompt prefix is served from cache
+_llm_usage = {"calls": 0, "prompt_tokens": 0, "cached_tokens": 0, "completion_tokens": 0}
+_llm_usage_lock = threading.Lock()
+
+
+def record_llm_usage(call_name: str, usage) -> None:
+    """Log prompt / cached / completion tokens of one chat completion and add them to the totals."""
+    if usage is None:
+        return
+    prompt_tokens = getattr(usage, "prompt_tokens", 0) or 0
+    completion_tokens = getattr(usage, "completion_tokens", 0) or 0
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached_tokens = getattr(details, "cached_tokens", 0) or 0
+
+    with _llm_usage_lock:
+        _llm_usage["calls"] += 1
+        _llm_usage["prompt_tokens"] += prompt_tokens
+        _llm_usage["cached_tokens"] += cached_tokens
+        _llm_usage["completion_tokens"] += completion_tokens
+
+    hit_rate = cached_tokens / prompt_tokens if prompt_tokens else 0.0
+    logging.info(
+        f"LLM usage [{call_name}]: prompt={prompt_tokens} cached={cached_tokens} "
+        f"({hit_rate:.0%}) completion={completion_tokens}"
+    )
+
+
+def llm_usage_snapshot() -> dict:
+    """Token totals since process start, with the overall cached-prompt hit rate."""
+    with _llm_usage_lock:
+        snapshot = dict(_llm_usage)
+    snapshot["cache_hit_rate"] = (
+        snapshot["cached_tokens"] / snapshot["prompt_tokens"] if snapshot["prompt_tokens"] else 0.0
+    )
+    return snapshot
+
+
+def _usage_dict(usage) -> Optional[dict]:
+    if usage is None:
+        return None
+    details = getattr(usage, "prompt_tokens_details", None)
+    return {
+        "prompt_tokens": getattr(usage, "prompt_tokens", 0) or 0,
+        "cached_tokens": getattr(details, "cached_tokens", 0) or 0,
+        "completion_tokens": getattr(usage, "completion_tokens", 0) or 0,
+    }
+
+
+def _llm_cache():
+    return get_cache(LLM_CACHE_DIR, LLM_CACHE_MAX_BYTES, LLM_CACHE_TTL_SECONDS)
+
+
+def cached_llm_lookup(request: dict, call_name: str) -> Optional[str]:
+    """Cached response text for this exact request, or None (also when LLM_CACHE_ENABLED is off)."""
+    if not LLM_CACHE_ENABLED:
+        return None
+    entry = _llm_cache().get(cache_key(request))
+    if entry is None:
+        return None
+    logging.info(
+        f"LLM cache hit [{call_name}]: saved {entry.get('latency', 0):.1f}s, usage {entry.get('usage')}"
+    )
+    return entry["text"]
+
+
+def cached_llm_store(request: dict, text: str, latency: float, usage: Optional[dict]) -> None:
+    """Remember a response with its original latency and token usage."""
+    if not LLM_CACHE_ENABLED or not text:
+        return
+    try:
+        _llm_cache().put(cache_key(request), {"text": text, "latency": latency, "usage": usage})
+    except OSError as e:
+        logging.warning(f"Could not write LLM cache entry: {e}")
+
+
+def chat_completion_text(call_name: str, **params) -> str:
+    """
+    OpenAI chat completion under the quota, returning the message text.
+    With LLM_CACHE_ENABLED, identical requests (model, messages, sampling params)
+    are answered from the on-disk cache (utils/cache.py) at no provider cost.
+    """
+    request = {"provider": "openai", **params}
+    text = cached_llm_lookup(request, call_name)
+    if text is not None:
+        return text
+
+    start = time.time()
+    response = call_with_quota("openai", get_client("openai").chat.completions.create, client="openai", **params)
+    record_llm_usage(call_name, response.usage)
+    text = response.choices[0].message.content
+    cached_llm_store(request, text, time.time() - start, _usage_dict(response.usage))
+    return text
+
+
+def replicate_text(call_name: str, model: str, model_input: dict) -> str:
+    """
+    Replicate text model run under the quota, returning the joined output text.
+    Cached like chat_completion_text (Replicate reports no token usage).
+    """
+    request = {"provider": "replicate", "model": model, "input": model_input}
+    text = cached_llm_lookup(request, call_name)
+    if text is not None:
+        return text
+
+    start = time.time()
+    output = call_with_quota(
+        "replicate",
+        get_client("replicate").run,
+        model,
+        client="replicate",
+        input=model_input,
+    )
+    # Replicate returns streamed chunks (list[str]) for text models
+    text = ("".join(output) if isinstance(output, list) else str(output)).strip()
+    cached_llm_store(request, text, time.time() - start, None)
+    return text
+
+
 def generate_story_text(child_name, child_age, child_interest, story_objective, your_name, page_length: int):
     prompt = build_story_prompt(
         child_name=child_name,
@@ -531,24 +864,362 @@ def generate_story_text(child_name, child_age, child_interest, story_objective,
         page_length=page_length,
     )
 
-    response = openai_client.chat.completions.create(
+    content = chat_completion_text(
+        "story",
         model="gpt-5.1",
         messages=[
-            {
-                "role": "system",
-                "content": (
-                    "You write children's picture-book scenes with strict formatting compliance. "
-                    "Return ONLY the required scene blocks exactly as specified. "
-                    "Do not add titles, headings, numbering, or extra commentary."
-                ),
-            },
+            {"role": "system", "content": STORY_SYSTEM_PROMPT},
             {"role": "user", "content": prompt},
         ],
         max_completion_tokens=3000,
         temperature=0.7,
     )
     
-    return response.choices[0].message.content
+    return content
+
+# Streaming variant of generate_story_text: yields text deltas as the model writes
+def stream_story_text(child_name, child_age, child_interest, story_objective, your_name, page_length: int) -> Iterator[str]:
+    prompt = build_story_prompt(
+        child_name=child_name,
+        child_age=child_age,
+        child_interest=child_interest,
+        story_objective=story_objective,
+        your_name=your_name,
+        page_length=page_length,
+    )
+
+    params = dict(
+        model="gpt-5.1",
+        messages=[
+            {"role": "system", "content": STORY_SYSTEM_PROMPT},
+            {"role": "user", "content": prompt},
+        ],
+        max_completion_tokens=3000,
+        temperature=0.7,
+    )
+    # Same cache entry as the non-streaming call: a hit is yielded in one piece
+    request = {"provider": "openai", **params}
+    cached = cached_llm_lookup(request, "story_stream")
+    if cached is not None:
+        yield cached
+        return
+
+    start = time.time()
+    stream = call_with_quota(
+        "openai",
+        get_client("openai").chat.completions.create,
+        client="openai",
+        stream=True,
+        stream_options={"include_usage": True},
+        **params,
+    )
+
+    parts = []
+    usage = None
+    for event in stream:
+        if event.choices and event.choices[0].delta.content:
+            parts.append(event.choices[0].delta.content)
+            yield event.choices[0].delta.content
+        # The last chunk carries usage for the whole stream and no choices
+        if getattr(event, "usage", None):
+            usage = event.usage
+            record_llm_usage("story_stream", usage)
+
+    cached_llm_store(request, "".join(parts), time.time() - start, _usage_dict(usage))
+
+def format_story_blocks(scene_texts: List[str], prompts: List[str], title: str = "") -> str:
+    """Render scenes (and the title line) back into the story format that extract_scenes_and_prompts() reads."""
+    blocks = "\n".join(f"{text}\n({prompt})\n---" for text, prompt in zip(scene_texts, prompts))
+    return f"TITLE: {title}\n{blocks}" if title else blocks
+
+
+def generate_story_outline(child_name, child_age, child_interest, story_objective, page_length: int) -> dict:
+    """
+    Phase 1 of outline mode: one short call that fixes the arc and the main
+    character's look. Returns {"title": str, "character": str, "beats": [str] * page_length}.
+    """
+    prompt = f"""
+        Plan a personalized, age-appropriate children's picture book. Do not write the story yet.
+
+        INPUTS
+        - Child name (main character): {child_name}
+        - Child age: {child_age}
+        - Child interests: {child_interest}
+        - Story objective: {story_objective}
+        - Number of scenes: exactly {page_length}
+
+        Return JSON with exactly these keys:
+        - "title": one short storybook title, without quotation marks.
+        - "character": one sentence describing the main character's fixed visual appearance
+          (round face, simple dot eyes, hairstyle, clothing colors). No names, no real people.
+        - "beats": a list of exactly {page_length} strings, one short sentence per scene, following
+          hook early → gentle problem → positive resolution, with the interests shaping the world.
+    """.strip()
+
+    content = chat_completion_text(
+        "outline",
+        model="gpt-5.1",
+        messages=[
+            {"role": "system", "content": "You plan children's picture books. Reply with JSON only."},
+            {"role": "user", "content": prompt},
+        ],
+        response_format={"type": "json_object"},
+        max_completion_tokens=800,
+        temperature=0.7,
+    )
+    outline = json.loads(content)
+    beats = [str(b) for b in outline.get("beats") or []]
+    if len(beats) < page_length:
+        raise ValueError(f"Outline has {len(beats)} beats, expected {page_length}")
+    return {
+        "title": str(outline.get("title", "")).strip().strip('"'),
+        "character": str(outline.get("character", "")),
+        "beats": beats[:page_length],
+    }
+
+
+def expand_story_scene(outline: dict, idx: int, child_name, child_age) -> Tuple[str, str]:
+    """Phase 2 of outline mode: write one scene of the outline. Returns (scene_text, illustration_prompt)."""
+    per_scene_min, per_scene_max, _, sentence_guidance = _scene_word_targets(child_age)
+    beats = outline["beats"]
+    arc = "\n".join(f"{i + 1}. {b}" for i, b in enumerate(beats))
+
+    prompt = f"""
+        Write scene {idx + 1} of {len(beats)} of a children's picture book for a {child_age}-year-old.
+
+        STORY ARC
+        {arc}
+
+        MAIN CHARACTER LOOK (use in the illustration prompt): {outline["character"]}
+
+        RULES
+        - Scene text: {sentence_guidance}, {per_scene_min}–{per_scene_max} words, featuring {child_name}.
+          Warm, soothing, imaginative; no scary content; no title, label or commentary.
+        - Illustration prompt: describe only the visual scene of this page; include "storybook illustration",
+          "full-bleed composition", "wide scene", "background extends to edges", "no border", "no frame",
+          "no white margins", soft pastel watercolor style and the main character look above.
+          Never include the child's name or any real person.
+
+        Return JSON: {{"text": "...", "illustration_prompt": "..."}}
+    """.strip()
+
+    content = chat_completion_text(
+        "expand_scene",
+        model="gpt-5.1",
+        messages=[
+            {"role": "system", "content": "You write one children's picture-book scene at a time. Reply with JSON only."},
+            {"role": "user", "content": prompt},
+        ],
+        response_format={"type": "json_object"},
+        max_completion_tokens=400,
+        temperature=0.7,
+    )
+    scene = json.loads(content)
+    return str(scene.get("text", "")).strip(), str(scene.get("illustration_prompt", "")).strip()
+
+
+def generate_story_text_outlined(child_name, child_age, child_interest, story_objective, your_name, page_length: int) -> str:
+    """
+    Outline-then-expand story generation for long books: latency is roughly one
+    outline call plus one scene call, independent of page count.
+    Returns the same '---' formatted text as generate_story_text().
+    """
+    outline = generate_story_outline(child_name, child_age, child_interest, story_objective, page_length)
+
+    with ThreadPoolExecutor(max_workers=page_length) as pool:
+        scenes = list(pool.map(
+            lambda idx: expand_story_scene(outline, idx, child_name, child_age),
+            range(page_length),
+        ))
+
+    return format_story_blocks([t for t, _ in scenes], [p for _, p in scenes], title=outline["title"])
+
+
+# ------------------ Structured (JSON schema) story output ------------------
+_SCENE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "text": {"type": "string"},
+        "illustration_prompt": {"type": "string"},
+    },
+    "required": ["text", "illustration_prompt"],
+    "additionalProperties": False,
+}
+
+STORY_JSON_SCHEMA = {
+    "name": "storybook",
+    "strict": True,
+    "schema": {
+        "type": "object",
+        "properties": {
+            "title": {"type": "string"},
+            "scenes": {"type": "array", "items": _SCENE_SCHEMA},
+        },
+        "required": ["title", "scenes"],
+        "additionalProperties": False,
+    },
+}
+
+SCENE_REPAIR_JSON_SCHEMA = {
+    "name": "scene_repair",
+    "strict": True,
+    "schema": {
+        "type": "object",
+        "properties": {
+            "scenes": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "number": {"type": "integer"},
+                        "text": {"type": "string"},
+                        "illustration_prompt": {"type": "string"},
+                    },
+                    "required": ["number", "text", "illustration_prompt"],
+                    "additionalProperties": False,
+                },
+            },
+        },
+        "required": ["scenes"],
+        "additionalProperties": False,
+    },
+}
+
+
+def validate_story_scenes(scenes: list, page_length: int) -> List[int]:
+    """
+    Return the indices (0-based) of scene entries that are missing or unusable:
+    - no entry at that index
+    - empty scene text
+    - illustration prompt empty or outside 5–600 characters
+    """
+    invalid = []
+    for idx in range(page_length):
+        scene = scenes[idx] if idx < len(scenes) else None
+        if not isinstance(scene, dict):
+            invalid.append(idx)
+            continue
+        text = str(scene.get("text") or "").strip()
+        prompt = str(scene.get("illustration_prompt") or "").strip()
+        if not text or not 5 <= len(prompt) <= 600:
+            invalid.append(idx)
+    return invalid
+
+
+def repair_story_scenes(story: dict, invalid: List[int], child_name, child_age) -> List[dict]:
+    """
+    Re-request only the invalid scene entries of a structured story.
+    The valid scenes are sent as context; returns the repaired entries in the order of `invalid`
+    (an entry the model skipped comes back empty and stays invalid).
+    """
+    per_scene_min, per_scene_max, _, sentence_guidance = _scene_word_targets(child_age)
+    scenes = story["scenes"]
+    story_so_far = "\n".join(
+        f"{i + 1}. {scenes[i].get('text', '') if i < len(scenes) and isinstance(scenes[i], dict) else '[MISSING]'}"
+        for i in range(max(len(scenes), max(invalid) + 1))
+    )
+    numbers = ", ".join(str(i + 1) for i in invalid)
+
+    titled = f' titled "{story["title"]}"' if story.get("title") else ""
+    prompt = f"""
+        A children's picture book for a {child_age}-year-old{titled} has these scenes:
+
+        {story_so_far}
+
+        Rewrite ONLY scene(s) {numbers} so they fit the story around them.
+
+        RULES
+        - Scene text: {sentence_guidance}, {per_scene_min}–{per_scene_max} words, featuring {child_name}.
+        - Illustration prompt: 5–600 characters, describe only the visual scene; include "storybook illustration",
+          "full-bleed composition", "no border", "no frame", "no white margins", soft pastel watercolor style.
+          Never include the child's name or any real person.
+
+        Return JSON with one entry per requested scene number.
+    """.strip()
+
+    response = call_with_quota(
+        "openai",
+        get_client("openai").chat.completions.create,
+        client="openai",
+        model="gpt-5.1",
+        messages=[
+            {"role": "system", "content": "You repair individual scenes of a children's picture book. Reply with JSON only."},
+            {"role": "user", "content": prompt},
+        ],
+        response_format={"type": "json_schema", "json_schema": SCENE_REPAIR_JSON_SCHEMA},
+        max_completion_tokens=300 * len(invalid),
+        temperature=0.7,
+    )
+    record_llm_usage("repair_scenes", response.usage)
+
+    by_number = {
+        entry.get("number"): {"text": entry.get("text", ""), "illustration_prompt": entry.get("illustration_prompt", "")}
+        for entry in json.loads(response.choices[0].message.content).get("scenes", [])
+    }
+    return [by_number.get(i + 1, {"text": "", "illustration_prompt": ""}) for i in invalid]
+
+
+def generate_story_structured(child_name, child_age, child_interest, story_objective, your_name, page_length: int) -> dict:
+    """
+    Story generation with a JSON schema instead of '---' parsing.
+    Returns {"title": str, "scenes": [{"text", "illustration_prompt"}] * page_length}.
+
+    Invalid scene entries (validate_story_scenes) are re-requested on their own, up to
+    STORY_REPAIR_ATTEMPTS times; whatever is still invalid afterwards is returned as is
+    and falls back to normalize_prompt() downstream.
+    """
+    prompt = build_story_prompt(
+        child_name=child_name,
+        child_age=child_age,
+        child_interest=child_interest,
+        story_objective=story_objective,
+        your_name=your_name,
+        page_length=page_length,
+        structured=True,
+    )
+
+    content = chat_completion_text(
+        "story_structured",
+        model="gpt-5.1",
+        messages=[
+            {"role": "system", "content": "You write children's picture-book scenes. Reply with JSON matching the schema only."},
+            {"role": "user", "content": prompt},
+        ],
+        response_format={"type": "json_schema", "json_schema": STORY_JSON_SCHEMA},
+        max_completion_tokens=3000,
+        temperature=0.7,
+    )
+
+    story = json.loads(content)
+    scenes = list(story.get("scenes") or [])[:page_length]
+    scenes.extend({} for _ in range(page_length - len(scenes)))
+    story = {"title": str(story.get("title") or "").strip().strip('"'), "scenes": scenes}
+
+    for attempt in range(STORY_REPAIR_ATTEMPTS):
+        invalid = validate_story_scenes(story["scenes"], page_length)
+        if not invalid:
+            break
+        logging.info(f"Structured story: repairing scene(s) {invalid} (attempt {attempt + 1}).")
+        try:
+            repaired = repair_story_scenes(story, invalid, child_name, child_age)
+        except Exception as e:
+            logging.warning(f"Scene repair failed: {e}")
+            break
+        for idx, scene in zip(invalid, repaired):
+            story["scenes"][idx] = scene
+
+    still_invalid = validate_story_scenes(story["scenes"], page_length)
+    if still_invalid:
+        logging.warning(f"Structured story: scene(s) {still_invalid} still invalid after repair.")
+
+    story["scenes"] = [
+        {
+            "text": str(scene.get("text") or "").strip(),
+            "illustration_prompt": str(scene.get("illustration_prompt") or "").strip(),
+        }
+        for scene in story["scenes"]
+    ]
+    return story
 
 # OpenAI text generation with multiple languages
 def generate_story_text_lang(intake: dict) -> str:
@@ -562,7 +1233,8 @@ def generate_story_text_lang(intake: dict) -> str:
     T = get_language(lang)
     prompt = build_story_prompt_lang(intake)
 
-    response = openai_client.chat.completions.create(
+    content = chat_completion_text(
+        "story_lang",
         model="gpt-5.1",
         messages=[
             {"role": "system", "content": T["prompts"]["system"]},
@@ -571,8 +1243,7 @@ def generate_story_text_lang(intake: dict) -> str:
         max_completion_tokens=3000,
         temperature=0.7,
     )
-    text = response.choices[0].message.content
-    return text
+    return content
 
 
 # Generate text using Replicate model REPLICATE_TEXT_MODEL_ID
@@ -587,23 +1258,15 @@ def generate_story_text_replicate(child_name, child_age, child_interest, story_o
     )
     
     try:
-        output = replicate.run(
+        return replicate_text(
+            "story_replicate",
             REPLICATE_TEXT_MODEL_ID,
-            input={
+            {
                 "prompt": f"<s>[INST]<<SYS>>{system_prompt}<</SYS>>{user_prompt}[/INST]",
                 "max_tokens": 3000,
                 "temperature": 0.7,
             },
         )
-
-        # replicate returns a generator of text chunks → join them
-        if isinstance(output, list):
-            return "".join(output).strip()
-        elif isinstance(output, str):
-            return output.strip()
-        else:
-            return str(output)
-
     except Exception as e:
         return f"ERROR generating story: {e}"
 
@@ -622,22 +1285,12 @@ def generate_story_text_replicate_gpt5nano(intake: dict) -> str:
         {user_prompt}
     """
 
-    output = replicate.run(
+    return replicate_text(
+        "story_replicate",
         "openai/gpt-5-nano",
-        input={
-            "prompt": full_prompt,
-            "max_completion_tokens": 3000,
-        },
+        {"prompt": full_prompt, "max_completion_tokens": 3000},
     )
 
-    # Replicate returns streamed chunks (list[str]) for text models
-    if isinstance(output, list):
-        text = "".join(output)
-    else:
-        text = str(output)
-
-    return text.strip()
-
 
 
 
@@ -655,7 +1308,7 @@ def generate_story_text_openrouter(child_name, child_age, child_interest, story_
     url = "https://openrouter.ai/api/v1/chat/completions"
 
     headers = {
-        "Authorization": "Bearer {OPENROUTER_API_KEY}",
+        "Authorization": f"Bearer {OPENROUTER_API_KEY}",
         "Content-Type": "application/json",
         "HTTP-Referer": "https://storygenerator-madeforeveryone.streamlit.app/",
         "X-Title": "Personalized Children Storybook Generator",
@@ -671,43 +1324,54 @@ def generate_story_text_openrouter(child_name, child_age, child_interest, story_
         "max_tokens": 800
     }
 
-    response = requests.post(url, headers=headers, json=payload, timeout=60)
+    request = {"provider": "openrouter", **payload}
+    story_text = cached_llm_lookup(request, "story_openrouter")
+    if story_text is not None:
+        return story_text
+
+    start = time.time()
+    response = get_http_session().post(url, headers=headers, json=payload, timeout=http_timeout())
     response.raise_for_status()
     data = response.json()
     story_text = data["choices"][0]["message"]["content"]
+    cached_llm_store(request, story_text, time.time() - start, data.get("usage"))
     
     return story_text
 
 def generate_story_title(text: str) -> str:
-    response = openai_client.chat.completions.create(
+    content = chat_completion_text(
+        "title",
         model="gpt-5.1",
         messages=[
             {"role": "system", "content": "You generate short, creative and catchy titles for children's storybook."},
-            {"role": "user", "content": f"Please generate one short storybook title, remember only one title, for this story:\n\n{text}"}
+            {"role": "user", "content": generate_story_title_prompt(text, "en")}
         ],
         max_completion_tokens=50,
         temperature=0.7,
     )
-    title = response.choices[0].message.content.strip()
+    title = content.strip()
     return title
 
+# Static title instructions per language; the story text always comes last,
+# after the fixed part, so the prompt prefix is identical across books
+_TITLE_PROMPT_PREFIX = {
+    "en": "Please generate one short storybook title, remember only one title, for this story:",
+    "zh": "请为以下故事生成一个简短的故事书标题，记住只需要一个标题：",
+}
+
+
 # Function for title generation with language support
 def generate_story_title_prompt(text: str, language: str) -> str:
-    
-    if language == "en":
-        prompt = f"Please generate one short storybook title, remember only one title, for this story:\n\n{text}"
-    elif language == "zh":
-        prompt = f"请为以下故事生成一个简短的故事书标题，记住只需要一个标题：\n\n{text}"
-    else:
-        prompt = f"Please generate one short storybook title, remember only one title, for this story:\n\n{text}"
-    return prompt
+    prefix = _TITLE_PROMPT_PREFIX.get(language, _TITLE_PROMPT_PREFIX["en"])
+    return f"{prefix}\n\n{text}"
 
 # OpenAI title generation with multiple languages - WIP 060126
 def generate_story_title_lang(text: str, language: str) -> str:
     T = get_language(language)
     title_prompt = generate_story_title_prompt(text, language)
     
-    response = openai_client.chat.completions.create(
+    content = chat_completion_text(
+        "title",
         model="gpt-5.1",
         messages=[
             {"role": "system", "content": T["prompts"]["system_title"]},
@@ -716,15 +1380,16 @@ def generate_story_title_lang(text: str, language: str) -> str:
         max_completion_tokens=50,
         temperature=0.7,
     )
-    title = response.choices[0].message.content.strip()
+    title = content.strip()
     return title
 
 
 def generate_story_title_replicate(text: str) -> str:
-    # Add slow-down between predictions
-    time.sleep(15)  # <-- Automatic pause BEFORE calling Replicate
-    
-    title_user_prompt = f"Please generate one short catchy storybook title, remember only one title, for this story:\n\n{text}. Only return the title itself and nothing else. Strip the title of any quotation marks."
+    title_user_prompt = (
+        "Please generate one short catchy storybook title, remember only one title. "
+        "Only return the title itself and nothing else. Strip the title of any quotation marks. "
+        f"The story:\n\n{text}"
+    )
     
     title_system_prompt = (
         "You are a children's storybook writer. Your job is to generate short, "
@@ -732,30 +1397,20 @@ def generate_story_title_replicate(text: str) -> str:
     )
     
     try:
-        title_output = replicate.run(
+        return replicate_text(
+            "title_replicate",
             REPLICATE_TEXT_MODEL_ID,
-            input={
+            {
                 "prompt": f"<s>[INST]<<SYS>>{title_system_prompt}<</SYS>>{title_user_prompt}[/INST]",
                 "max_tokens": 30,
                 "temperature": 0.7,
             },
         )
-
-        # replicate returns a generator of text chunks → join them
-        if isinstance(title_output, list):
-            return "".join(title_output).strip()
-        elif isinstance(title_output, str):
-            return title_output.strip()
-        else:
-            return str(title_output)
-
     except Exception as e:
         return f"ERROR generating story: {e}"
 
 # Generate story title using GPT-5-nano via Replicate
 def generate_story_title_replicate_gpt5nano(text: str, lang: str) -> str:
-    time.sleep(15) 
-    
     T = get_language(lang)
     user_prompt = generate_story_title_prompt(text, lang)
     system_prompt = T["prompts"]["system_title"]
@@ -768,21 +1423,61 @@ def generate_story_title_replicate_gpt5nano(text: str, lang: str) -> str:
         {user_prompt}
     """
 
-    output = replicate.run(
+    return replicate_text(
+        "title_replicate",
         "openai/gpt-5-nano",
-        input={
-            "prompt": full_prompt,
-            "max_completion_tokens": 30,
-        },
+        {"prompt": full_prompt, "max_completion_tokens": 30},
     )
 
-    # Replicate returns streamed chunks (list[str]) for text models
-    if isinstance(output, list):
-        text = "".join(output)
-    else:
-        text = str(output)
+def _parse_scene_block(s: str) -> Tuple[str, str]:
+    """Split one '---'-delimited block into (scene_text, illustration_prompt)."""
+    # Prefer the last non-empty line as the prompt if it looks like "(...)"
+    lines = [ln.strip() for ln in s.splitlines() if ln.strip()]
+    prompt = ""
+    scene_body = s.strip()
+
+    if lines:
+        last = lines[-1]
+        # If last line is a single parenthetical block, treat it as prompt
+        if last.startswith("(") and last.endswith(")") and len(last) >= 2:
+            prompt = last[1:-1].strip()
+            scene_body = "\n".join(lines[:-1]).strip()
+        else:
+            # Fallback: your original logic (last parentheses block)
+            if "(" in s and ")" in s:
+                before, after = s.rsplit("(", 1)
+                if ")" in after:
+                    prompt_candidate = after.rsplit(")", 1)[0].strip()
+                    # Heuristic: only accept if it's reasonably prompt-like and not huge
+                    if 5 <= len(prompt_candidate) <= 600:
+                        prompt = prompt_candidate
+                        scene_body = before.strip()
+
+    return scene_body, prompt
+
+
+def iter_scenes_from_stream(chunks: Iterable[str]) -> Iterator[Tuple[str, str]]:
+    """
+    Incremental counterpart of extract_scenes_and_prompts():
+    yields (scene_text, illustration_prompt) as soon as each '---' delimiter arrives.
+    """
+    buffer = ""
+    title_checked = False
+    for chunk in chunks:
+        buffer += chunk
+        # Drop the leading 'TITLE: ...' line once it is complete
+        if not title_checked and "\n" in buffer.lstrip():
+            _, buffer = split_story_title(buffer)
+            title_checked = True
+        while "---" in buffer:
+            block, buffer = buffer.split("---", 1)
+            if block.strip():
+                yield _parse_scene_block(block.strip())
+
+    # Last scene without a trailing delimiter
+    if buffer.strip():
+        yield _parse_scene_block(buffer.strip())
 
-    return text.strip()
 
 def extract_scenes_and_prompts(
     story_text: str,
@@ -799,6 +1494,9 @@ def extract_scenes_and_prompts(
     if not story_text:
         return ([], [])
 
+    # The title line fused into the story call is not a scene
+    _, story_text = split_story_title(story_text)
+
     # Normalize: tolerate variants like " --- " or extra whitespace
     # Split on '---' anywhere, then strip empty blocks.
     raw_scenes = [s.strip() for s in story_text.split('---') if s.strip()]
@@ -807,28 +1505,7 @@ def extract_scenes_and_prompts(
     prompts: List[str] = []
 
     for s in raw_scenes:
-        # Prefer the last non-empty line as the prompt if it looks like "(...)"
-        lines = [ln.strip() for ln in s.splitlines() if ln.strip()]
-        prompt = ""
-        scene_body = s.strip()
-
-        if lines:
-            last = lines[-1]
-            # If last line is a single parenthetical block, treat it as prompt
-            if last.startswith("(") and last.endswith(")") and len(last) >= 2:
-                prompt = last[1:-1].strip()
-                scene_body = "\n".join(lines[:-1]).strip()
-            else:
-                # Fallback: your original logic (last parentheses block)
-                if "(" in s and ")" in s:
-                    before, after = s.rsplit("(", 1)
-                    if ")" in after:
-                        prompt_candidate = after.rsplit(")", 1)[0].strip()
-                        # Heuristic: only accept if it's reasonably prompt-like and not huge
-                        if 5 <= len(prompt_candidate) <= 600:
-                            prompt = prompt_candidate
-                            scene_body = before.strip()
-
+        scene_body, prompt = _parse_scene_block(s)
         scene_texts.append(scene_body)
         prompts.append(prompt)
 
@@ -845,6 +1522,121 @@ def extract_scenes_and_prompts(
 
     return scene_texts, prompts
 
+
+# ------------------ Story quality gate ------------------
+def _count_words(text: str) -> int:
+    """Word count that also works for CJK text (each Han character counts as one word)."""
+    return len(re.findall(r"[一-鿿]|[A-Za-z0-9'’]+", text or ""))
+
+
+# Names that are also everyday words ("a rose garden", "starry sky"); a prompt using
+# them is not evidence of a leaked name, so they are not checked
+_COMMON_WORD_NAMES = {
+    "sky", "rose", "star", "river", "lily", "daisy", "ivy", "iris", "violet", "poppy", "jasmine",
+    "willow", "hazel", "olive", "sage", "ruby", "pearl", "amber", "jade", "coral", "honey",
+    "sunny", "joy", "hope", "grace", "faith", "dawn", "rain", "storm", "summer", "autumn",
+    "april", "may", "june", "robin", "wren", "jay", "bear", "fox", "ocean", "sandy", "rocky",
+    "mom", "mum", "mommy", "mummy", "dad", "daddy", "grandma", "grandpa", "nana", "papa",
+}
+
+
+def _mentions_name(prompt: str, name: str) -> bool:
+    """Whole-word, case-sensitive match of the capitalized name ('Mia', not 'mia' inside text)."""
+    name = (name or "").strip()
+    if not name or name.lower() in _COMMON_WORD_NAMES:
+        return False
+    if not name.isascii():
+        # CJK text has no word boundaries between characters
+        return name in (prompt or "")
+    name = name[:1].upper() + name[1:]
+    return re.search(rf"(?<!\w){re.escape(name)}(?!\w)", prompt or "") is not None
+
+
+def check_story_scene(
+    scene_text: str,
+    prompt: str,
+    child_age,
+    names: Iterable[str] = (),
+) -> List[str]:
+    """
+    Local, free checks of one extracted scene. Returns a list of problems (empty = ok):
+    - empty scene text
+    - word count outside the build_story_prompt targets (± STORY_GATE_WORD_TOLERANCE)
+    - missing illustration prompt
+    - a real name (child / author) leaking into the illustration prompt
+    """
+    per_scene_min, per_scene_max, _, _ = _scene_word_targets(child_age)
+    problems = []
+
+    words = _count_words(scene_text)
+    if not (scene_text or "").strip():
+        problems.append("empty text")
+    elif words < per_scene_min * (1 - STORY_GATE_WORD_TOLERANCE):
+        problems.append(f"too short ({words} words)")
+    elif words > per_scene_max * (1 + STORY_GATE_WORD_TOLERANCE):
+        problems.append(f"too long ({words} words)")
+
+    if not (prompt or "").strip():
+        problems.append("missing illustration prompt")
+    elif any(_mentions_name(prompt, name) for name in names):
+        problems.append("name in illustration prompt")
+
+    return problems
+
+
+def gate_story_scenes(
+    scene_texts: List[str],
+    prompts: List[str],
+    child_name,
+    child_age,
+    page_length: int,
+    your_name: str = "",
+) -> Tuple[List[str], List[str]]:
+    """
+    Quality gate between scene extraction and the image/audio stages.
+
+    Scenes failing check_story_scene() are regenerated on their own (repair_story_scenes),
+    up to STORY_GATE_ATTEMPTS rounds. Afterwards, remaining issues are logged and the
+    scenes are accepted as they are; only an empty scene fails the job.
+    """
+    names = [n for n in (child_name, your_name) if n]
+    scene_texts = list(scene_texts) + [""] * (page_length - len(scene_texts))
+    prompts = list(prompts) + [""] * (page_length - len(prompts))
+
+    for attempt in range(STORY_GATE_ATTEMPTS + 1):
+        problems = {
+            idx: found
+            for idx in range(page_length)
+            if (found := check_story_scene(scene_texts[idx], prompts[idx], child_age, names))
+        }
+        if not problems:
+            return scene_texts, prompts
+        if attempt == STORY_GATE_ATTEMPTS:
+            break
+
+        logging.info(f"Story quality gate: regenerating scene(s) {problems} (round {attempt + 1}).")
+        story = {
+            "title": "",
+            "scenes": [{"text": t, "illustration_prompt": p} for t, p in zip(scene_texts, prompts)],
+        }
+        try:
+            repaired = repair_story_scenes(story, sorted(problems), child_name, child_age)
+        except Exception as e:
+            logging.warning(f"Story quality gate: regeneration failed: {e}")
+            break
+        for idx, scene in zip(sorted(problems), repaired):
+            text = str(scene.get("text") or "").strip()
+            prompt = str(scene.get("illustration_prompt") or "").strip()
+            # Keep the old text/prompt when the replacement is empty
+            scene_texts[idx] = text or scene_texts[idx]
+            prompts[idx] = prompt or prompts[idx]
+
+    logging.warning(f"Story quality gate: accepting scene(s) with remaining issues {problems}.")
+    empty = [idx for idx in range(page_length) if not scene_texts[idx].strip()]
+    if empty:
+        raise ValueError(f"Story failed the quality gate: scene(s) {empty} are empty")
+    return scene_texts, prompts
+
 # Normalize image prompts
 def normalize_prompt(p: str) -> str:
     p = (p or "").strip()
@@ -878,7 +1670,7 @@ def normalize_prompt(p: str) -> str:
 
 # ------------------ Audio generation & storage ------------------
 def generate_audio_from_text(story_chunk: str) -> str:
-    audio_resp = openai_client.audio.speech.create(
+    audio_resp = get_client("openai").audio.speech.create(
         model="tts-1",
         input=story_chunk,
         voice="fable",  # or any of the preset voices you choose
@@ -910,39 +1702,39 @@ def sanitize_text_for_tts(text: str) -> str:
     return text.strip()
 
 
-def generate_audio_from_text_replicate(story_chunk: str, lang: str) -> str:
-    import requests
-    
-    # Add slow-down between predictions
-    time.sleep(15)  # <-- Automatic pause BEFORE calling Replicate
-    
-    if lang == "en":
-        audio_resp = replicate.run(
-            REPLICATE_AUDIO_MODEL_ID,
-            input={
+def _tts_request(story_chunk: str, lang: str) -> Tuple[str, dict]:
+    """(model id, prediction input) of the TTS voice used for this language."""
+    if lang == "zh":
+        return (
+            "lucataco/xtts-v2:684bc3855b37866c0c65add2ff39c78f3dea3f4ff103a436465326e0f438d55e",
+            {
                 "text": story_chunk,
-                "speaker": "af_bella"
-            }
+                "speaker": "https://replicate.delivery/pbxt/Jt79w0xsT64R1JsiJ0LQRL8UcWspg5J4RFrU6YwEKpOT1ukS/male.wav",
+                "language": "zh",
+            },
         )
-    elif lang == "zh":
-        input = {
+    # en and anything else
+    return (
+        REPLICATE_AUDIO_MODEL_ID,
+        {
             "text": story_chunk,
-            "speaker": "https://replicate.delivery/pbxt/Jt79w0xsT64R1JsiJ0LQRL8UcWspg5J4RFrU6YwEKpOT1ukS/male.wav",
-            "language": "zh",
-            }
+            "speaker": "af_bella",   # optional: "default", "af_heart", "bf_hts", etc.
+        },
+    )
 
-        audio_resp = replicate.run(
-            "lucataco/xtts-v2:684bc3855b37866c0c65add2ff39c78f3dea3f4ff103a436465326e0f438d55e",
-            input=input
-        )
-    else:
-        audio_resp = replicate.run(
-            REPLICATE_AUDIO_MODEL_ID,
-            input={
-                "text": story_chunk,
-                "speaker": "af_bella"   # optional: "default", "af_heart", "bf_hts", etc.
-            }
-        )
+
+def synthesize_audio_replicate(story_chunk: str, lang: str) -> str:
+    """Run the TTS prediction and return the provider URL of the generated audio."""
+    model_id, tts_input = _tts_request(story_chunk, lang)
+    # Replicate quota is enforced by call_with_quota (utils/quota.py)
+    audio_resp = call_with_quota(
+        "replicate",
+        get_client("replicate").run,
+        model_id,
+        client="replicate",
+        limiter="replicate_tts",
+        input=tts_input,
+    )
     
     ################################################
     # The model returns a URL to the generated audio
@@ -964,34 +1756,24 @@ def generate_audio_from_text_replicate(story_chunk: str, lang: str) -> str:
 
     else:
         raise ValueError(f"Unrecognized audio output type: {type(audio_resp)}")
-    
-    # Download audio file as binary bytes
-    response = requests.get(audio_url)
-    response.raise_for_status()   # defensive: alert if download fails
-    audio_bytes = response.content
+
+    return audio_url
+
+
+def generate_audio_from_text_replicate(story_chunk: str, lang: str) -> bytes:
+    audio_url = synthesize_audio_replicate(story_chunk, lang)
+
+    # Download audio file as binary bytes (pooled, timed out, size-capped)
+    audio_bytes = download_bytes(audio_url)
        
     return audio_bytes
 
 def get_r2_client():
-    """Create boto3 client for Cloudflare R2 using Streamlit secrets."""
-    account_id = st.secrets["r2"]["account_id"]
-    access_key = st.secrets["r2"]["access_key"]
-    secret_key = st.secrets["r2"]["secret_key"]
-
-    session = boto3.session.Session()
-    client = session.client(
-        "s3",
-        endpoint_url=f"https://{account_id}.r2.cloudflarestorage.com",
-        aws_access_key_id=access_key,
-        aws_secret_access_key=secret_key,
-    )
-    print("R2 client created.")
-    print(f"R2 Account ID: {account_id}")
-
-    return client
+    """Shared boto3 client for Cloudflare R2 (built once per process)."""
+    return get_client("r2")
 
 
-def upload_audio_to_r2(audio_bytes: bytes, filename: str = None) -> str:
+def upload_audio_to_r2(audio_bytes: bytes, filename: str = None, content_type: str = "audio/mpeg") -> str:
     """
     Uploads audio bytes to Cloudflare R2 and returns a public URL.
     """
@@ -1009,7 +1791,8 @@ def upload_audio_to_r2(audio_bytes: bytes, filename: str = None) -> str:
         Bucket=bucket_name,
         Key=filename,
         Body=audio_bytes,
-        ContentType="audio/mpeg"
+        ContentType=content_type,
+        CacheControl=R2_AUDIO_CACHE_CONTROL,
     )
 
     # Public, direct access URL
@@ -1017,6 +1800,410 @@ def upload_audio_to_r2(audio_bytes: bytes, filename: str = None) -> str:
 
     return public_url
 
+
+def _upload_r2_part(client, bucket_name: str, key: str, upload_id: str, part_number: int, body: bytes) -> dict:
+    resp = client.upload_part(
+        Bucket=bucket_name,
+        Key=key,
+        UploadId=upload_id,
+        PartNumber=part_number,
+        Body=body,
+        ContentLength=len(body),
+        ContentMD5=base64.b64encode(hashlib.md5(body).digest()).decode(),
+    )
+    return {"PartNumber": part_number, "ETag": resp["ETag"]}
+
+
+def stream_audio_to_r2(source_url: str, filename: str = None, content_type: str = "audio/mpeg") -> str:
+    """
+    Pipe a provider audio URL straight into R2 and return the public URL.
+
+    - The download is read in R2_PART_BYTES parts; while one part uploads, the next downloads
+    - Audio smaller than one part goes up as a single put_object
+    - Every request carries Content-Length and Content-MD5; the object gets Cache-Control
+      and a sha256 metadata entry of the whole body
+    """
+    bucket_name = st.secrets["r2"]["bucket_name"]
+    public_base_url = st.secrets["r2"]["public_base_url"]
+
+    if filename is None:
+        filename = f"{uuid.uuid4()}.mp3"
+
+    client = get_r2_client()
+    sha256 = hashlib.sha256()
+    chunks = iter_download(source_url)
+    buf = bytearray()
+
+    def read_part() -> bytes:
+        # Parts are exactly R2_PART_BYTES (only the last is shorter); a chunk that
+        # crosses the boundary leaves its tail in buf for the next part
+        for chunk in chunks:
+            buf.extend(chunk)
+            if len(buf) >= R2_PART_BYTES:
+                break
+        part = bytes(buf[:R2_PART_BYTES])
+        del buf[:R2_PART_BYTES]
+        return part
+
+    first = read_part()
+    sha256.update(first)
+    if len(first) < R2_PART_BYTES:
+        client.put_object(
+            Bucket=bucket_name,
+            Key=filename,
+            Body=first,
+            ContentType=content_type,
+            ContentLength=len(first),
+            ContentMD5=base64.b64encode(hashlib.md5(first).digest()).decode(),
+            CacheControl=R2_AUDIO_CACHE_CONTROL,
+            Metadata={"sha256": sha256.hexdigest()},
+        )
+        return f"{public_base_url}/{filename}"
+
+    # R2 takes the metadata at creation time, so the whole-body sha256 is
+    # not known yet; each part is still verified with its own Content-MD5.
+    upload_id = client.create_multipart_upload(
+        Bucket=bucket_name,
+        Key=filename,
+        ContentType=content_type,
+        CacheControl=R2_AUDIO_CACHE_CONTROL,
+    )["UploadId"]
+
+    parts = []
+    try:
+        with ThreadPoolExecutor(max_workers=1) as uploader:
+            body, part_number = first, 1
+            pending = uploader.submit(_upload_r2_part, client, bucket_name, filename, upload_id, part_number, body)
+            while True:
+                body = read_part()  # downloads while the previous part uploads
+                parts.append(pending.result())
+                if not body:
+                    break
+                sha256.update(body)
+                part_number += 1
+                pending = uploader.submit(_upload_r2_part, client, bucket_name, filename, upload_id, part_number, body)
+
+        client.complete_multipart_upload(
+            Bucket=bucket_name,
+            Key=filename,
+            UploadId=upload_id,
+            MultipartUpload={"Parts": parts},
+        )
+    except Exception:
+        client.abort_multipart_upload(Bucket=bucket_name, Key=filename, UploadId=upload_id)
+        raise
+
+    logging.info(f"Streamed {part_number} parts to R2 as {filename} (sha256 {sha256.hexdigest()})")
+    return f"{public_base_url}/{filename}"
+
+def _audio_cache():
+    return get_cache(AUDIO_CACHE_DIR, AUDIO_CACHE_MAX_BYTES, AUDIO_CACHE_TTL_SECONDS)
+
+
+def narration_key(story_text: str, lang: str, variant: str = "whole") -> str:
+    """
+    Content address of a narration: hash of (sanitized text, lang, model id, speaker).
+    variant tells a single-prediction narration ("whole") from a stitched per-scene one ("scenes").
+    """
+    text = sanitize_text_for_tts(story_text)
+    model_id, tts_input = _tts_request(text, lang)
+    return cache_key("narration", text, lang, model_id, tts_input.get("speaker"), variant)
+
+
+def _r2_object_exists(key: str) -> bool:
+    """True if the object is in R2. Only a 404 means absent; other errors (auth, network) propagate."""
+    try:
+        get_r2_client().head_object(Bucket=st.secrets["r2"]["bucket_name"], Key=key)
+        return True
+    except ClientError as e:
+        error = e.response.get("Error", {})
+        status = e.response.get("ResponseMetadata", {}).get("HTTPStatusCode")
+        if status == 404 or error.get("Code") in ("404", "NoSuchKey", "NotFound"):
+            return False
+        raise
+
+
+# Whitespace after sentence-final punctuation, with a closing quote kept on its sentence.
+# CJK text has no spaces between sentences, so it breaks right after 。！？ (and a closing quote).
+_SENTENCE_BREAK_RE = re.compile(
+    r"(?:(?<=[.!?])|(?<=[.!?][\"”’')]))\s+"
+    r"|(?:(?<=[。！？])(?![”’」』）])|(?<=[。！？][”’」』）]))\s*"
+)
+
+
+def split_tts_chunks(scene_texts: List[str], max_chars: int = TTS_MAX_CHARS) -> List[Tuple[int, str]]:
+    """
+    (scene index, text) chunks for per-scene synthesis. A scene longer than max_chars
+    is split at sentence boundaries; a single over-long sentence is kept whole.
+    """
+    chunks = []
+    for idx, scene in enumerate(scene_texts):
+        text = sanitize_text_for_tts(scene)
+        if not text:
+            continue
+        current = ""
+        for sentence in _SENTENCE_BREAK_RE.split(text):
+            if not sentence:
+                continue
+            if current and len(current) + len(sentence) + 1 > max_chars:
+                chunks.append((idx, current))
+                current = ""
+            # CJK sentences are joined without a space
+            sep = " " if current[-1:].isascii() else ""
+            current = f"{current}{sep}{sentence}" if current else sentence
+        if current:
+            chunks.append((idx, current))
+    return chunks
+
+
+def synthesize_segment(text: str, lang: str, retries: int = TTS_SEGMENT_RETRIES) -> bytes:
+    """One TTS prediction plus download; a failed segment is retried on its own."""
+    for attempt in range(retries + 1):
+        try:
+            return download_bytes(synthesize_audio_replicate(story_chunk=text, lang=lang))
+        except Exception as e:
+            if attempt == retries:
+                raise
+            wait = 2 ** attempt
+            logging.warning(f"TTS segment failed ({e}); retrying in {wait}s.")
+            time.sleep(wait)
+
+
+def _match_loudness(segment: AudioSegment) -> AudioSegment:
+    """Gain-match to TTS_TARGET_DBFS without clipping peaks."""
+    if segment.dBFS == float("-inf"):
+        return segment
+    gain = TTS_TARGET_DBFS - segment.dBFS
+    # Keep 1 dB of headroom below full scale
+    gain = min(gain, -1.0 - segment.max_dBFS)
+    return segment.apply_gain(gain)
+
+
+def encode_narration(narration: AudioSegment, profile: Optional[str] = AUDIO_PROFILE) -> bytes:
+    """Export audio with an AUDIO_PROFILES profile (mono, speech bitrate); plain MP3 when profile is empty."""
+    buf = io.BytesIO()
+    if not profile:
+        narration.export(buf, format="mp3")
+        return buf.getvalue()
+
+    spec = AUDIO_PROFILES[profile]
+    narration = narration.set_channels(spec["channels"]).set_frame_rate(spec["frame_rate"])
+    narration.export(buf, format=spec["format"], codec=spec["codec"], bitrate=spec["bitrate"])
+    return buf.getvalue()
+
+
+def transcode_narration(audio_bytes: bytes, profile: str = AUDIO_PROFILE) -> bytes:
+    """
+    Re-encode provider audio (WAV, high-bitrate MP3, ...) with a speech profile and
+    loudness normalization before upload. Logs the size before and after.
+    """
+    narration = _match_loudness(AudioSegment.from_file(io.BytesIO(audio_bytes)))
+    encoded = encode_narration(narration, profile)
+    logging.info(
+        f"Transcoded narration to {profile}: {len(audio_bytes) / 1024:.0f} KiB -> "
+        f"{len(encoded) / 1024:.0f} KiB ({len(encoded) / max(1, len(audio_bytes)):.0%})"
+    )
+    return encoded
+
+
+def _stitch_segments(segments: List[Tuple[int, bytes]], pause_ms: int = TTS_SCENE_PAUSE_MS) -> AudioSegment:
+    """
+    Concatenate (scene index, audio bytes) segments: each is gain-matched to
+    TTS_TARGET_DBFS, with pause_ms of silence between scenes.
+    """
+    narration = AudioSegment.empty()
+    previous_scene = None
+    for scene_idx, audio_bytes in segments:
+        segment = _match_loudness(AudioSegment.from_file(io.BytesIO(audio_bytes)))
+        if previous_scene is not None and scene_idx != previous_scene:
+            narration += AudioSegment.silent(duration=pause_ms, frame_rate=segment.frame_rate)
+        narration += segment
+        previous_scene = scene_idx
+    return narration
+
+
+def stitch_narration(
+    segments: List[Tuple[int, bytes]],
+    pause_ms: int = TTS_SCENE_PAUSE_MS,
+    profile: Optional[str] = AUDIO_PROFILE,
+) -> bytes:
+    """Stitch (scene index, audio bytes) segments into one file, encoded with encode_narration()."""
+    encoded = encode_narration(_stitch_segments(segments, pause_ms), profile)
+    logging.info(
+        f"Stitched {len(segments)} narration segments: {sum(len(b) for _, b in segments) / 1024:.0f} KiB -> "
+        f"{len(encoded) / 1024:.0f} KiB ({profile or 'mp3'})"
+    )
+    return encoded
+
+
+def synthesize_scenes_parallel(scene_texts: List[str], lang: str) -> bytes:
+    """
+    Per-scene narration: every chunk from split_tts_chunks() is synthesized concurrently
+    (bounded by TTS_CONCURRENCY and the replicate_tts limiter) and stitched locally,
+    so latency approaches that of the longest scene.
+    """
+    chunks = split_tts_chunks(scene_texts)
+    if not chunks:
+        raise ValueError("No narration text to synthesize")
+
+    workers = max(1, min(TTS_CONCURRENCY, len(chunks)))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        audio = list(pool.map(lambda chunk: synthesize_segment(chunk[1], lang), chunks))
+
+    return stitch_narration([(idx, data) for (idx, _), data in zip(chunks, audio)])
+
+
+def narrate_story_to_r2(scene_texts: List[str], lang: str) -> str:
+    """
+    Synthesize the narration and store it in R2 under a content-addressed key
+    (audio/<narration_key>.mp3); returns the public URL.
+
+    Identical text/lang/voice is synthesized once: a hit in the local audio cache,
+    or an object already at that key in R2, skips both TTS and upload.
+    With TTS_PER_SCENE, scenes are synthesized in parallel and stitched locally.
+    With AUDIO_PROFILE, the audio is transcoded before upload instead of streamed.
+    """
+    story_text = "\n\n".join(scene_texts)
+    text = sanitize_text_for_tts(story_text)
+    variant = "scenes" if TTS_PER_SCENE else "whole"
+    if AUDIO_PROFILE:
+        variant = f"{variant}/{AUDIO_PROFILE}"
+    spec = AUDIO_PROFILES.get(AUDIO_PROFILE, AUDIO_PROFILES["mp3"])
+    key = narration_key(text, lang, variant)
+    r2_key = f"audio/{key}.{spec['ext']}"
+    public_base_url = st.secrets["r2"]["public_base_url"]
+
+    if AUDIO_CACHE_ENABLED:
+        cached = _audio_cache().get(key)
+        if cached:
+            logging.info(f"Audio cache hit: {cached['r2_key']}")
+            return f"{public_base_url}/{cached['r2_key']}"
+        if _r2_object_exists(r2_key):
+            logging.info(f"Narration already in R2: {r2_key}")
+            _audio_cache().put(key, {"r2_key": r2_key})
+            return f"{public_base_url}/{r2_key}"
+
+    if TTS_PER_SCENE:
+        url = upload_audio_to_r2(
+            synthesize_scenes_parallel(scene_texts, lang), filename=r2_key, content_type=spec["content_type"],
+        )
+    elif AUDIO_PROFILE:
+        # Transcoding needs the whole file, so the streaming upload is skipped
+        audio_bytes = transcode_narration(download_bytes(synthesize_audio_replicate(story_chunk=text, lang=lang)))
+        url = upload_audio_to_r2(audio_bytes, filename=r2_key, content_type=spec["content_type"])
+    else:
+        # Provider audio is piped straight into R2 without buffering the whole file
+        url = stream_audio_to_r2(synthesize_audio_replicate(story_chunk=text, lang=lang), filename=r2_key)
+    if AUDIO_CACHE_ENABLED:
+        _audio_cache().put(key, {"r2_key": r2_key})
+    return url
+
+def build_narration_playlist(pages: List[dict]) -> str:
+    """HLS VOD playlist (RFC 8216) of the per-page narration segments."""
+    target = max((math.ceil(page["duration_seconds"]) for page in pages), default=1)
+    lines = [
+        "#EXTM3U",
+        "#EXT-X-VERSION:3",
+        f"#EXT-X-TARGETDURATION:{max(1, target)}",
+        "#EXT-X-MEDIA-SEQUENCE:0",
+        "#EXT-X-PLAYLIST-TYPE:VOD",
+    ]
+    for page in pages:
+        lines.append(f"#EXTINF:{page['duration_seconds']:.3f},Page {page['page']}")
+        lines.append(page["url"])
+    lines.append("#EXT-X-ENDLIST")
+    return "\n".join(lines) + "\n"
+
+
+def narration_page_urls(playlist_url: str, page_count: int) -> List[str]:
+    """
+    Per-page segment URLs of a segmented narration, read from the manifest.json
+    next to its playlist. Index i is page i + 1; pages without narration are "".
+    """
+    public_base_url = st.secrets["r2"]["public_base_url"]
+    prefix = playlist_url[len(public_base_url):].lstrip("/").rsplit("/", 1)[0]
+    obj = get_r2_client().get_object(Bucket=st.secrets["r2"]["bucket_name"], Key=f"{prefix}/manifest.json")
+    manifest = json.loads(obj["Body"].read())
+
+    urls = [""] * page_count
+    for page in manifest["pages"]:
+        if 1 <= page["page"] <= page_count:
+            urls[page["page"] - 1] = page["url"]
+    return urls
+
+
+def narrate_segments_to_r2(scene_texts: List[str], lang: str) -> str:
+    """
+    Segmented narration for progressive playback: one audio file per page under
+    audio/<narration_key>/page_NN.<ext>, plus manifest.json and an HLS playlist.m3u8.
+    Returns the playlist URL; playback can start after the first segment, and
+    the manifest maps every page number to its own segment (narration_page_urls).
+    Segments are always MP3, as HLS requires (SEGMENT_AUDIO_PROFILE).
+
+    Pages are synthesized concurrently and each is uploaded as soon as it is ready.
+    The playlist is uploaded last, so its presence in R2 marks a complete narration.
+    """
+    text = sanitize_text_for_tts("\n\n".join(scene_texts))
+    spec = AUDIO_PROFILES.get(SEGMENT_AUDIO_PROFILE, AUDIO_PROFILES["mp3"])
+    key = narration_key(text, lang, f"hls/{SEGMENT_AUDIO_PROFILE or 'mp3'}")
+    prefix = f"audio/{key}"
+    playlist_key = f"{prefix}/playlist.m3u8"
+    public_base_url = st.secrets["r2"]["public_base_url"]
+
+    if AUDIO_CACHE_ENABLED:
+        cached = _audio_cache().get(key)
+        if cached:
+            logging.info(f"Audio cache hit: {cached['r2_key']}")
+            return f"{public_base_url}/{cached['r2_key']}"
+        if _r2_object_exists(playlist_key):
+            logging.info(f"Segmented narration already in R2: {prefix}")
+            _audio_cache().put(key, {"r2_key": playlist_key})
+            return f"{public_base_url}/{playlist_key}"
+
+    chunks = split_tts_chunks(scene_texts)
+    if not chunks:
+        raise ValueError("No narration text to synthesize")
+    by_page: dict = {}
+    for idx, chunk in chunks:
+        by_page.setdefault(idx, []).append(chunk)
+
+    def narrate_page(idx: int) -> dict:
+        segments = [(idx, synthesize_segment(chunk, lang)) for chunk in by_page[idx]]
+        page_audio = _stitch_segments(segments)
+        url = upload_audio_to_r2(
+            encode_narration(page_audio, SEGMENT_AUDIO_PROFILE),
+            filename=f"{prefix}/page_{idx + 1:02d}.{spec['ext']}",
+            content_type=spec["content_type"],
+        )
+        return {"page": idx + 1, "url": url, "duration_seconds": round(len(page_audio) / 1000.0, 2)}
+
+    workers = max(1, min(TTS_CONCURRENCY, len(by_page)))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pages = list(pool.map(narrate_page, sorted(by_page)))
+
+    manifest = {
+        "version": 1,
+        "lang": lang,
+        "content_type": spec["content_type"],
+        "total_seconds": round(sum(p["duration_seconds"] for p in pages), 2),
+        "pages": pages,
+    }
+    upload_audio_to_r2(
+        json.dumps(manifest, ensure_ascii=False).encode("utf-8"),
+        filename=f"{prefix}/manifest.json",
+        content_type="application/json",
+    )
+    url = upload_audio_to_r2(
+        build_narration_playlist(pages).encode("utf-8"),
+        filename=playlist_key,
+        content_type="application/vnd.apple.mpegurl",
+    )
+    logging.info(f"Uploaded {len(pages)} narration segments with manifest under {prefix}")
+
+    if AUDIO_CACHE_ENABLED:
+        _audio_cache().put(key, {"r2_key": playlist_key})
+    return url
+
 # Audio link generation
 def build_audio_link(
     story_audio_url: str | None,
@@ -1053,6 +2240,30 @@ def _pil_to_b64(img: PILImage.Image) -> str:
     return base64.b64encode(buf.getvalue()).decode()
 
 
+def _image_cache():
+    return get_cache(IMAGE_CACHE_DIR, IMAGE_CACHE_MAX_BYTES, IMAGE_CACHE_TTL_SECONDS)
+
+
+def make_thumbnail_b64(img_b64: str, max_side: int = 256) -> str:
+    """Downscaled JPEG preview (base64) of a base64 image, for progress previews."""
+    img = PILImage.open(io.BytesIO(base64.b64decode(img_b64))).convert("RGB")
+    img.thumbnail((max_side, max_side))
+    buf = io.BytesIO()
+    img.save(buf, "JPEG", quality=70)
+    return base64.b64encode(buf.getvalue()).decode()
+
+
+def scene_image_event(index: int, total: int, img_b64: str) -> dict:
+    """Progress event for a finished illustration; the thumbnail is None if the preview fails."""
+    try:
+        thumbnail = make_thumbnail_b64(img_b64)
+    except Exception as e:
+        # A preview must never fail the stage that produced the image
+        logging.warning(f"Thumbnail for scene {index} failed: {e}")
+        thumbnail = None
+    return {"type": "scene_image", "index": index, "total": total, "thumbnail": thumbnail}
+
+
 def _strengthen_prompt(prompt: str, strength: float) -> str:
     if strength <= 1.0:
         return prompt
@@ -1070,120 +2281,48 @@ def _strengthen_prompt(prompt: str, strength: float) -> str:
 
 
 # -------------------------------------------------------------
-# LOCAL SDXL-TURBO PIPELINE
+# LOCAL SDXL-TURBO (persistent worker pool, utils/local_images.py)
 # -------------------------------------------------------------
-def _load_local_pipe():
-    global _local_pipe
-    if _local_pipe is not None:
-        return _local_pipe
-
-    from diffusers import AutoPipelineForText2Image
-    import torch
-
-    device = "cuda" if torch.cuda.is_available() else "cpu"
-    dtype = torch.float16 if device == "cuda" else torch.float32
-
-    logging.info(f"Loading SDXL-Turbo locally ({LOCAL_MODEL_ID})…")
-    pipe = AutoPipelineForText2Image.from_pretrained(
-        LOCAL_MODEL_ID,
-        use_safetensors=True,
-    )
-
-    try:
-        pipe = pipe.to(device, dtype=dtype)
-    except:
-        pipe = pipe.to(device)
-
-    _local_pipe = pipe
-    return pipe
-
-
-# -------------------------------------------------------------
-# LOCAL GENERATION (with timeout wrapper)
-# -------------------------------------------------------------
-def _local_generate_worker(prompts, width, height, steps, strength, out_q):
-    """Executed inside subprocess. Produces list of PIL images."""
-    try:
-        pipe = _load_local_pipe()
-        prompts_prepped = [_strengthen_prompt(p, strength) for p in prompts]
-
-        try:
-            result = pipe(
-                prompts_prepped,
-                width=width,
-                height=height,
-                num_inference_steps=steps,
-                guidance_scale=0.0,
-            )
-            imgs = result.images
-        except TypeError:
-            # fallback sequential
-            imgs = []
-            for pp in prompts_prepped:
-                r = pipe(pp, width=width, height=height,
-                         num_inference_steps=steps, guidance_scale=0.0)
-                imgs.append(r.images[0])
-
-        out_q.put(imgs)
-    except Exception as e:
-        out_q.put(e)
+def start_local_image_pool() -> None:
+    """Start the local SDXL workers ahead of the first book (worker.py calls this in local mode)."""
+    if IMAGE_PROVIDER == "local":
+        get_local_pool(LOCAL_MODEL_ID)
 
 
 def _generate_local_with_timeout(prompts, width, height, steps, strength):
     """
-    Spawns a subprocess to allow safe timeout+kill.
+    Runs the batch on a warm worker of the local SDXL pool.
+    Returns None when the worker missed HARD_TIMEOUT_SECONDS (it is restarted).
     """
-    q = Queue()
-    p = Process(
-        target=_local_generate_worker,
-        args=(prompts, width, height, steps, strength, q),
+    prompts_prepped = [_strengthen_prompt(p, strength) for p in prompts]
+    return get_local_pool(LOCAL_MODEL_ID).generate(
+        prompts_prepped, width, height, steps, timeout=HARD_TIMEOUT_SECONDS,
     )
 
-    p.start()
-    p.join(HARD_TIMEOUT_SECONDS)
-
-    if p.is_alive():
-        logging.error("Local SDXL process stuck → FORCE TERMINATING.")
-        p.terminate()
-        p.join()
-        return None  # main code will fallback
-
-    result = q.get()
-    if isinstance(result, Exception):
-        raise result
-    return result  # list of PIL images
-
 
 # -------------------------------------------------------------
 # REPLICATE PROVIDER
 # -------------------------------------------------------------
 def _get_replicate_client():
-    global _replicate_client
-    if _replicate_client:
-        return _replicate_client
-
-    import replicate
-    if not REPLICATE_API_TOKEN:
-        raise RuntimeError("REPLICATE_API_TOKEN missing")
-    _replicate_client = replicate
-    _replicate_client.Client(api_token=REPLICATE_API_TOKEN)
-    return _replicate_client
+    return get_client("replicate")
 
 
 def _generate_replicate(prompt, width, height, strength):
-    import requests
-
     client = _get_replicate_client()
     # pp = _strengthen_prompt(prompt, strength)
     pp = prompt
 
-    output = client.run(
+    output = call_with_quota(
+        "replicate",
+        client.run,
         REPLICATE_MODEL_ID,
+        client="replicate",
+        limiter="replicate_images",
         input={"prompt": pp, "width": width, "height": height},
     )
 
     url = output[0] if isinstance(output, list) else output
-    img = PILImage.open(io.BytesIO(requests.get(url).content)).convert("RGB")
+    img = PILImage.open(io.BytesIO(download_bytes(url))).convert("RGB")
     return img
 
 # -------------------------------------------------------------
@@ -1193,7 +2332,11 @@ def _generate_openai(prompt: str, width, height, strength=DEFAULT_PROMPT_STRENGT
     """Return base64 PNG string from OpenAI image generation."""
     prompt = _strengthen_prompt(prompt, strength=DEFAULT_PROMPT_STRENGTH)
     size = f"{width}x{height}"
-    resp = openai_client.images.generate(
+    resp = call_with_quota(
+        "openai_images",
+        get_client("openai").images.generate,
+        client="openai",
+        limiter="openai_images",
         model="gpt-image-1-mini",
         prompt=prompt,
         size=size,
@@ -1258,11 +2401,9 @@ def generate_images_for_prompts(
         for p in prompts:
             try:
                 print(f"Generating image for prompt after image model: {p}")
-                time.sleep(15)  # to avoid rate limits
                 img = _generate_replicate(p, width, height, prompt_strength)
                 print(f"Checkpoint 1 - Generated image successfully.")
                 out.append(_pil_to_b64(img))
-                time.sleep(15)  # to avoid rate limits
                 
             except:
                 out.append(_BLANK_PNG_B64)
@@ -1277,7 +2418,6 @@ def generate_images_for_prompts(
         for p in prompts:
             try:
                 print(f"Generating image for prompt: {p}")
-                time.sleep(15)  # to avoid rate limits
                 img = _generate_openai(p, width, height, strength=DEFAULT_PROMPT_STRENGTH)
                 print(f"Checkpoint openai - Generated image successfully.")
                 out.append(img)
@@ -1319,16 +2459,32 @@ def generate_image_for_prompt(prompt: str, size: str = "storybook") -> str:
     return result[0]
 
 # Image generation with OpenAI Image API
-def generate_image_for_prompt_openai(prompt: str, size="1536x1024", retries=3) -> str:
+def generate_image_for_prompt_openai(prompt: str, size="1536x1024", retries=3, use_cache: bool = True) -> str:
+    """
+    use_cache: look up / store the result in the image cache (IMAGE_CACHE_ENABLED).
+    Covers pass False so books with the same interest don't share one cover.
+    """
     if not prompt:
         print("No prompt provided, returning blank image.")
         return _BLANK_PNG_B64
 
     prompt = _strengthen_prompt(prompt, strength=DEFAULT_PROMPT_STRENGTH)
 
+    # Content-addressed: the same final prompt at the same model/size/quality is rendered once
+    key = cache_key("openai", "gpt-image-1-mini", size, "low", prompt)
+    use_cache = use_cache and IMAGE_CACHE_ENABLED
+    cached = _image_cache().get(key) if use_cache else None
+    if cached:
+        logging.info(f"Image cache hit ({size}).")
+        return cached
+
     for attempt in range(retries):
         try:
-            resp = openai_client.images.generate(
+            resp = call_with_quota(
+                "openai_images",
+                get_client("openai").images.generate,
+                client="openai",
+                limiter="openai_images",
                 model="gpt-image-1-mini", # Latest GPT-image-1.5
                 prompt=prompt,
                 size=size,
@@ -1337,6 +2493,11 @@ def generate_image_for_prompt_openai(prompt: str, size="1536x1024", retries=3) -
             )
             print(f"Generated image successfully.")
             result = resp.data[0].b64_json   
+            if use_cache and result:
+                try:
+                    _image_cache().put(key, result)
+                except OSError as e:
+                    logging.warning(f"Could not write image cache entry: {e}")
             return result
         
         except APIConnectionError as e:
@@ -1347,6 +2508,65 @@ def generate_image_for_prompt_openai(prompt: str, size="1536x1024", retries=3) -
     print("OpenAI image generation failed after retries.")
     return _BLANK_PNG_B64
 
+def build_cover_prompt(interest: str) -> str:
+    return (
+        f"Do not include any text in the image. "
+        f"Design a children's storybook cover illustration related to the topic of '{interest}'. "
+        f"Do not include any text or human-like characters in the image."
+    )
+
+
+def render_pool_cover(category: str) -> Optional[str]:
+    """Render one cover for utils/cover_pool.py; None when generation failed."""
+    img = generate_image_for_prompt_openai(build_cover_prompt(category), use_cache=False)
+    return None if img == _BLANK_PNG_B64 else img
+
+# One scene image, falling back to the normalized prompt if the raw prompt fails (or is missing)
+def generate_scene_image_openai(prompt: str) -> str:
+    if not (prompt or "").strip():
+        return generate_image_for_prompt_openai(normalize_prompt(prompt))
+    try:
+        return generate_image_for_prompt_openai(prompt)
+    except Exception:
+        return generate_image_for_prompt_openai(normalize_prompt(prompt))
+
+# Scene images with OpenAI Image API, fanned out over a bounded thread pool
+def generate_scene_images_openai(
+    prompts: List[str],
+    max_workers: int = IMAGE_CONCURRENCY,
+    on_image: Optional[Callable[[int, str], None]] = None,
+) -> List[str]:
+    """
+    Return one base64 image per prompt, in scene order.
+    Each scene falls back to its normalized prompt if the raw prompt fails.
+    Scenes whose prompts are identical after normalize_prompt() are rendered once.
+    on_image(index, b64) is called from the worker thread as each scene finishes.
+    """
+    if not prompts:
+        return []
+
+    # normalized prompt -> indices of the scenes that share it
+    groups: dict = {}
+    for idx, p in enumerate(prompts):
+        groups.setdefault(normalize_prompt(p), []).append(idx)
+    if len(groups) < len(prompts):
+        logging.info(f"Rendering {len(groups)} unique illustrations for {len(prompts)} scenes.")
+
+    def _generate_scene(indices: List[int]) -> str:
+        img = generate_scene_image_openai(prompts[indices[0]])
+        if on_image:
+            for idx in indices:
+                on_image(idx, img)
+        return img
+
+    images: List[Optional[str]] = [None] * len(prompts)
+    workers = max(1, min(max_workers, len(groups)))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for indices, img in zip(groups.values(), pool.map(_generate_scene, groups.values())):
+            for idx in indices:
+                images[idx] = img
+    return images
+
 
 
 
@@ -1403,10 +2623,13 @@ def create_storybook_pdf_bytes(
     images_b64: List[str],
     story_audio_url: str,
     page_size=PAGE_SIZE,
+    page_audio_urls: Optional[List[str]] = None,
 ) -> bytes:
     """
     Final corrected full-spread generator.
     Important: SpreadFlowable.wrap uses the availWidth/availHeight ReportLab passes.
+    page_audio_urls: per-page narration segments (narration_page_urls); each page with
+    one gets a QR code + link in its bottom-right corner.
     """
 
     buffer = io.BytesIO()
@@ -1507,11 +2730,18 @@ def create_storybook_pdf_bytes(
          - places scene text centered at bottom (or centered full-page if center_text=True)
         """
 
-        def __init__(self, img_b64: Optional[str] = None, text: Optional[str] = None, center_text: bool = False):
+        def __init__(
+            self,
+            img_b64: Optional[str] = None,
+            text: Optional[str] = None,
+            center_text: bool = False,
+            audio_url: Optional[str] = None,
+        ):
             super().__init__()
             self.img_b64 = img_b64
             self.text = text
             self.center_text = center_text
+            self.audio_url = audio_url
             # will be set in wrap()
             self.width = None
             self.height = None
@@ -1553,6 +2783,18 @@ def create_storybook_pdf_bytes(
                 print("Failed to draw image in box.")
                 return 0, 0, 0, 0
 
+        def _draw_audio_qr(self, c, url: str, size: float = 0.8 * inch):
+            """QR code for this page's narration segment, clickable too, in the bottom-right corner."""
+            try:
+                buf = io.BytesIO()
+                qrcode.make(url, border=1).save(buf, format="PNG")
+                buf.seek(0)
+                x = self.width - size
+                c.drawImage(ImageReader(buf), x, 0, width=size, height=size)
+                c.linkURL(url, (x, 0, x + size, size), relative=1)
+            except Exception as e:
+                logging.error(f"Page audio QR draw failed: {e}")
+
         def draw(self):
             c = self.canv
 
@@ -1560,6 +2802,12 @@ def create_storybook_pdf_bytes(
             avail_w = self.width
             avail_h = self.height
 
+            # Text is centered, so keeping it clear of the QR corner means narrowing it on both sides
+            qr_size = 0.8 * inch
+            max_text_w = avail_w * 0.9
+            if self.audio_url:
+                max_text_w = min(max_text_w, avail_w - 2 * (qr_size + 12))
+
             # Reserve part of the flowable for image vs text:
             # image_area_h uses most of the height; leave room for bottom text
             image_area_h = avail_h * 0.78  # 78% top for image (tunable)
@@ -1579,13 +2827,11 @@ def create_storybook_pdf_bytes(
                     alignment=1,  # center
                 )
                 para = Paragraph(self.text.replace("\n", "<br/>"), style)
-                max_w = avail_w * 0.9
                 max_h = avail_h * 0.9
-                tw, th = para.wrap(max_w, max_h)
+                tw, th = para.wrap(max_text_w, max_h)
                 x = (avail_w - tw) / 2.0
                 y = (avail_h - th) / 2.0
                 para.drawOn(c, x, y)
-                return
 
             # ---- Scene bottom text (non-centered) ----
             if self.text and not self.center_text:
@@ -1597,7 +2843,6 @@ def create_storybook_pdf_bytes(
                     alignment=1,  # center horizontally
                 )
                 para = Paragraph(self.text.replace("\n", "<br/>"), style)
-                max_text_w = avail_w * 0.9
                 max_text_h = text_area_h * 0.95
                 tw, th = para.wrap(max_text_w, max_text_h)
 
@@ -1615,6 +2860,10 @@ def create_storybook_pdf_bytes(
 
                 para.drawOn(c, x, y)
 
+            # ---- Narration QR last, so no background is painted over it ----
+            if self.audio_url:
+                self._draw_audio_qr(c, self.audio_url, size=qr_size)
+
     # -----------------------------------------------------------------
     # Build the flow: cover -> scenes 
     # -----------------------------------------------------------------
@@ -1640,7 +2889,8 @@ def create_storybook_pdf_bytes(
     for i in range(n_pairs):
         img_b64 = images_b64[i] if i < len(images_b64) else None
         txt = scenes[i] if i < len(scenes) else None
-        story.append(SpreadFlowable(img_b64=img_b64, text=txt, center_text=False))
+        audio = page_audio_urls[i] if page_audio_urls and i < len(page_audio_urls) else None
+        story.append(SpreadFlowable(img_b64=img_b64, text=txt, center_text=False, audio_url=audio))
         story.append(PageBreak())
 
     # Build PDF (use your onPage callbacks as before)
@@ -1670,7 +2920,7 @@ def send_email_with_attachment(send_to: str, subject: str, body: str, attachment
     )
     message.attachment = attachedFile
 
-    sg = SendGridAPIClient(SENDGRID_API_KEY)
+    sg = get_client("sendgrid")
     response = sg.send(message)
     return response
 
@@ -1683,6 +2933,347 @@ def send_email_with_attachment_test(send_to: str, subject: str, body: str, from_
         html_content=body,
     )
 
-    sg = SendGridAPIClient(SENDGRID_API_KEY)
+    sg = get_client("sendgrid")
     response = sg.send(message)
     return response
+
+
+# ------------------ Storybook pipeline (stage graph) ------------------
+def _critical_path(stages: dict, timings: dict) -> List[str]:
+    """Walk back from the last stage to finish, following whichever input finished last."""
+    if not timings:
+        return []
+    node = max(timings, key=lambda n: timings[n]["end"])
+    path = [node]
+    while stages[node][1]:
+        node = max(stages[node][1], key=lambda d: timings[d]["end"])
+        path.append(node)
+    return list(reversed(path))
+
+
+def run_stage_graph(
+    stages: dict,
+    max_workers: Optional[int] = None,
+    on_event: Optional[Callable[[dict], None]] = None,
+) -> Tuple[dict, dict]:
+    """
+    Run stages declared as {name: (fn, [input names])} as a dependency graph.
+
+    - Each stage starts as soon as all of its inputs have finished
+    - fn receives its inputs' results as keyword arguments named after the input stages
+    - on_event receives {"type": "stage_started"/"stage_finished", "stage": name, ...}
+    - Returns (results, report); report holds per-stage timings and the critical path
+    """
+    for name, (_, inputs) in stages.items():
+        missing = [d for d in inputs if d not in stages]
+        if missing:
+            raise ValueError(f"Stage '{name}' depends on unknown stage(s): {missing}")
+
+    results: dict = {}
+    timings: dict = {}
+    pending = dict(stages)
+    running: dict = {}
+    t0 = time.time()
+
+    with ThreadPoolExecutor(max_workers=max_workers or len(stages) or 1) as pool:
+        while pending or running:
+            ready = [n for n, (_, inputs) in pending.items() if all(d in results for d in inputs)]
+            for name in ready:
+                fn, inputs = pending.pop(name)
+                timings[name] = {"start": time.time() - t0}
+                running[pool.submit(fn, **{d: results[d] for d in inputs})] = name
+                if on_event:
+                    on_event({"type": "stage_started", "stage": name})
+
+            if not running:
+                raise ValueError(f"Stage graph has a cycle among: {sorted(pending)}")
+
+            done, _ = wait_futures(running, return_when=FIRST_COMPLETED)
+            for fut in done:
+                name = running.pop(fut)
+                results[name] = fut.result()  # re-raise stage failures in the caller
+                timings[name]["end"] = time.time() - t0
+                timings[name]["seconds"] = timings[name]["end"] - timings[name]["start"]
+                if on_event:
+                    on_event({"type": "stage_finished", "stage": name, "seconds": timings[name]["seconds"]})
+
+    report = {
+        "timings": timings,
+        "critical_path": _critical_path(stages, timings),
+        "total_seconds": time.time() - t0,
+        "limits": limiter_snapshot(),
+        "llm_usage": llm_usage_snapshot(),
+    }
+    return results, report
+
+
+def _with_checkpoint(name: str, fn: Callable, checkpoint) -> Callable:
+    """Load a stage's output from the checkpoint if present, otherwise run and persist it."""
+    def run(**inputs):
+        if checkpoint.has(name):
+            logging.info(f"Stage {name}: restored from checkpoint.")
+            return checkpoint.get(name)
+        value = fn(**inputs)
+        # A blank fallback image is not a result worth keeping; retry it next time
+        if value != _BLANK_PNG_B64:
+            checkpoint.put(name, value)
+        return value
+    return run
+
+
+def build_storybook_stages(
+    intake: dict,
+    checkpoint=None,
+    on_event: Optional[Callable[[dict], None]] = None,
+) -> dict:
+    """
+    Declare the storybook job as a stage graph for run_stage_graph().
+    Stage outputs:
+      story_text -> str, or (scene_texts, prompts, title) with STORY_STRUCTURED_OUTPUT,
+      story_title -> str, scenes -> (scene_texts, prompts),
+      audio_url -> str, audio_pages -> [url per page] (AUDIO_SEGMENTED, else []),
+      cover -> b64, scene_images -> [b64], pdf -> bytes
+
+    With a checkpoint (utils.checkpoints.JobCheckpoint), every stage except the
+    PDF is persisted, and scene images are persisted one by one, so a retried
+    job resumes from the first missing artifact.
+
+    on_event receives {"type": "scene_image", "index", "total", "thumbnail"}
+    as each scene illustration becomes available.
+
+    With STORY_STREAMING, the story is streamed and each scene's illustration
+    starts as soon as its '---' delimiter arrives. With STORY_OUTLINE_MODE, books of
+    STORY_OUTLINE_MIN_PAGES or more use an outline call plus parallel scene calls.
+    With STORY_STRUCTURED_OUTPUT, the story and title come back as schema-checked
+    JSON and only invalid scenes are re-requested. The scenes stage runs the local
+    quality gate (gate_story_scenes), so images and audio only see gated scenes.
+    With AUDIO_SEGMENTED, audio_url is the playlist of per-page narration segments.
+    """
+    child_name = intake["child_name"]
+    child_age = intake["child_age"]
+    child_interest = intake["child_interest"]
+    story_objective = intake["story_objective"]
+    your_name = intake["your_name"]
+    page_length = intake.get("page_length", 4)
+    lang = intake.get("language", "en")
+
+    # Streaming mode: scene index -> (prompt, Future) of illustrations started
+    # while the story is still being written
+    streamed: dict = {}
+
+    def finish_scene_image(idx, img, total):
+        if checkpoint is not None and img != _BLANK_PNG_B64:
+            checkpoint.put(f"scene_image_{idx:02d}", img)
+        if on_event and img != _BLANK_PNG_B64:
+            on_event(scene_image_event(idx, total, img))
+
+    def story_text():
+        if STORY_OUTLINE_MODE and page_length >= STORY_OUTLINE_MIN_PAGES:
+            try:
+                return generate_story_text_outlined(
+                    child_name, child_age, child_interest, story_objective, your_name,
+                    page_length=page_length,
+                )
+            except Exception as e:
+                logging.warning(f"Outline mode failed ({e}); falling back to a single story call.")
+                return generate_story_text(
+                    child_name, child_age, child_interest, story_objective, your_name,
+                    page_length=page_length,
+                )
+
+        if STORY_STRUCTURED_OUTPUT:
+            story = generate_story_structured(
+                child_name, child_age, child_interest, story_objective, your_name,
+                page_length=page_length,
+            )
+            # Already split into scenes; passed on as is rather than re-parsed from text
+            return (
+                [scene["text"] for scene in story["scenes"]],
+                [scene["illustration_prompt"] for scene in story["scenes"]],
+                story["title"],
+            )
+
+        if not STORY_STREAMING:
+            return generate_story_text(
+                child_name, child_age, child_interest, story_objective, your_name,
+                page_length=page_length,
+            )
+
+        chunks = []
+
+        def tee():
+            for chunk in stream_story_text(
+                child_name, child_age, child_interest, story_objective, your_name,
+                page_length=page_length,
+            ):
+                chunks.append(chunk)
+                yield chunk
+
+        # Early renders are only checkpointed once scene_images has matched them
+        # to the gated prompts (see scene_images)
+        pool = ThreadPoolExecutor(max_workers=IMAGE_CONCURRENCY)
+        try:
+            for idx, (text, prompt) in enumerate(iter_scenes_from_stream(tee())):
+                if idx >= page_length:
+                    continue
+                # Scenes failing the quality gate are regenerated later; don't illustrate them now
+                if check_story_scene(text, prompt, child_age, [n for n in (child_name, your_name) if n]):
+                    continue
+                if checkpoint is not None and checkpoint.has(f"scene_image_{idx:02d}"):
+                    continue
+                streamed[idx] = (prompt, pool.submit(generate_scene_image_openai, prompt))
+        except Exception:
+            # The story is re-requested on retry; renders for this draft are wasted work
+            pool.shutdown(wait=False, cancel_futures=True)
+            streamed.clear()
+            raise
+        # Illustrations keep rendering; scene_images collects them
+        pool.shutdown(wait=False)
+        return "".join(chunks)
+
+    def story_title(story_text):
+        # The story call returns the title (first line, or the JSON field); a separate call is only the fallback
+        if isinstance(story_text, (list, tuple)):
+            title, scenes_text = story_text[2], "\n\n".join(story_text[0])
+        else:
+            title, scenes_text = split_story_title(story_text)
+        if title:
+            return title
+        logging.info("Story came back without a title; requesting one separately.")
+        return generate_story_title(text=scenes_text).strip()
+
+    def scenes(story_text):
+        if isinstance(story_text, (list, tuple)):
+            scene_texts, prompts = list(story_text[0]), list(story_text[1])
+        else:
+            scene_texts, prompts = extract_scenes_and_prompts(story_text, expected_scenes=page_length)
+        # Nothing downstream (images, audio) starts until the quality gate passes
+        return gate_story_scenes(scene_texts, prompts, child_name, child_age, page_length, your_name)
+
+    def audio_url(scenes):
+        # Content-addressed: retries and regenerated books reuse the narration, and
+        # books sharing a title can no longer overwrite each other's audio
+        if AUDIO_SEGMENTED:
+            return narrate_segments_to_r2(scenes[0], lang)
+        return narrate_story_to_r2(scenes[0], lang)
+
+    def cover():
+        # A pre-rendered cover for the interest's category is instant; render one otherwise
+        pooled = claim_cover(child_interest)
+        if pooled:
+            return pooled
+        return generate_image_for_prompt_openai(build_cover_prompt(child_interest), use_cache=False)
+
+    def scene_images(scenes):
+        prompts = scenes[1]
+        total = len(prompts)
+
+        # Scenes restored from the checkpoint are done already
+        images = [
+            checkpoint.get(f"scene_image_{i:02d}") if checkpoint is not None else None
+            for i in range(total)
+        ]
+        for i, img in enumerate(images):
+            if img is not None and on_event:
+                on_event(scene_image_event(i, total, img))
+
+        # Scenes already started from the story stream (same prompt) are awaited, not re-rendered
+        missing = [i for i, img in enumerate(images) if img is None]
+        early = {i: streamed[i][1] for i in missing if i in streamed and streamed[i][0] == prompts[i]}
+        todo = [i for i in missing if i not in early]
+
+        # Early renders that no longer match their scene (the quality gate rewrote the
+        # prompt) are dropped, and cancelled if they have not started yet
+        for i, (_, fut) in streamed.items():
+            if i not in early:
+                fut.cancel()
+                logging.info(f"Discarding early illustration for scene {i}; it no longer matches the scene.")
+
+        def on_early_done(i, fut):
+            if not fut.cancelled() and fut.exception() is None:
+                finish_scene_image(i, fut.result(), total)
+
+        for i, fut in early.items():
+            fut.add_done_callback(lambda f, i=i: on_early_done(i, f))
+
+        rendered = generate_scene_images_openai(
+            [prompts[i] for i in todo],
+            on_image=lambda pos, img: finish_scene_image(todo[pos], img, total),
+        )
+        for i, img in zip(todo, rendered):
+            images[i] = img
+        for i, fut in early.items():
+            images[i] = fut.result()
+        return images
+
+    def audio_pages(audio_url, scenes):
+        # Per-page segment links for the PDF; only segmented narration has them
+        if not AUDIO_SEGMENTED:
+            return []
+        return narration_page_urls(audio_url, len(scenes[0]))
+
+    def pdf(story_title, cover, scenes, scene_images, audio_url, audio_pages):
+        return create_storybook_pdf_bytes(
+            title=story_title,
+            author=your_name,
+            cover_image_b64=cover,
+            scenes=scenes[0],
+            images_b64=scene_images,
+            story_audio_url=audio_url,
+            page_audio_urls=audio_pages,
+        )
+
+    stages = {
+        "story_text": (story_text, []),
+        "story_title": (story_title, ["story_text"]),
+        "scenes": (scenes, ["story_text"]),
+        "audio_url": (audio_url, ["scenes"]),
+        "audio_pages": (audio_pages, ["audio_url", "scenes"]),
+        "cover": (cover, []),
+        "scene_images": (scene_images, ["scenes"]),
+        "pdf": (pdf, ["story_title", "cover", "scenes", "scene_images", "audio_url", "audio_pages"]),
+    }
+
+    if checkpoint is not None:
+        for name in ("story_text", "story_title", "scenes", "audio_url", "audio_pages", "cover"):
+            fn, inputs = stages[name]
+            stages[name] = (_with_checkpoint(name, fn, checkpoint), inputs)
+
+    return stages
+
+
+def safe_pdf_filename(title: str) -> str:
+    """Download name for a book: the title without path separators or control characters."""
+    name = re.sub(r"[\\/:*?\"<>|\x00-\x1f]+", "", title or "").strip().strip(".")
+    name = re.sub(r"\s+", "_", name)[:100]
+    return f"{name or 'storybook'}.pdf"
+
+
+def run_storybook_pipeline(
+    intake: dict,
+    checkpoint=None,
+    on_event: Optional[Callable[[dict], None]] = None,
+) -> dict:
+    """
+    Generate a full storybook for one intake and return the PDF plus metadata.
+    on_event receives stage and scene progress events (see run_stage_graph/build_storybook_stages).
+    """
+    stages = build_storybook_stages(intake, checkpoint=checkpoint, on_event=on_event)
+    results, report = run_stage_graph(stages, on_event=on_event)
+
+    for name, t in report["timings"].items():
+        logging.info(f"Stage {name}: {t['start']:.1f}s -> {t['end']:.1f}s ({t['seconds']:.1f}s)")
+    logging.info(
+        f"Critical path ({report['total_seconds']:.1f}s): {' -> '.join(report['critical_path'])}"
+    )
+    logging.info(f"Provider concurrency limits: {report['limits']}")
+    logging.info(f"LLM token usage (cached prompt prefix): {report['llm_usage']}")
+
+    title = results["story_title"]
+    return {
+        "title": title,
+        "pdf_bytes": results["pdf"],
+        "pdf_filename": safe_pdf_filename(title),
+        "audio_url": results["audio_url"],
+        "report": report,
+    }
@@ -0,0 +1,189 @@
+"""
+Per-provider request quotas shared by every session in the process.
+
+Each provider ("openai", "openai_images", "replicate") has a token bucket.
+A call only waits when its bucket is empty, or when the provider has answered
+429 and asked us (via Retry-After) to back off; that pause then applies to
+every caller of the same provider, not just the one that was throttled.
+Connection and timeout failures reset the shared SDK client (utils/clients.py)
+so the next call starts from a fresh one with new connections.
+"""
+import os
+import time
+import logging
+import threading
+from email.utils import parsedate_to_datetime
+from typing import Optional, Callable, Any
+
+import httpx
+import requests
+
+from utils.clients import reset_client
+from utils.limiter import get_limiter
+
+# requests per minute, burst size
+PROVIDER_LIMITS = {
+    "openai": (
+        float(os.getenv("OPENAI_RPM", "500")),
+        int(os.getenv("OPENAI_BURST", "20")),
+    ),
+    "openai_images": (
+        float(os.getenv("OPENAI_IMAGE_RPM", "50")),
+        int(os.getenv("OPENAI_IMAGE_BURST", "10")),
+    ),
+    "replicate": (
+        float(os.getenv("REPLICATE_RPM", "60")),
+        int(os.getenv("REPLICATE_BURST", "5")),
+    ),
+}
+DEFAULT_LIMIT = (60.0, 5)
+
+RATE_LIMIT_RETRIES = int(os.getenv("RATE_LIMIT_RETRIES", "4"))
+
+
+class TokenBucket:
+    """Thread-safe token bucket with an optional provider-imposed pause."""
+
+    def __init__(self, rate_per_minute: float, burst: int):
+        self.rate = rate_per_minute / 60.0  # tokens per second
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self) -> float:
+        """Take one token, sleeping only as long as needed. Returns seconds waited."""
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if now < self.blocked_until:
+                    delay = self.blocked_until - now
+                elif self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                else:
+                    delay = (1 - self.tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+    def block_for(self, seconds: float) -> None:
+        """Pause all callers for `seconds` (e.g. after a 429 with Retry-After)."""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self.blocked_until = max(self.blocked_until, now + seconds)
+            # Resume with a single request after the pause rather than a full burst
+            self.tokens = min(self.tokens, 1.0)
+
+
+_buckets: dict = {}
+_buckets_lock = threading.Lock()
+
+
+def get_bucket(provider: str) -> TokenBucket:
+    with _buckets_lock:
+        bucket = _buckets.get(provider)
+        if bucket is None:
+            rpm, burst = PROVIDER_LIMITS.get(provider, DEFAULT_LIMIT)
+            bucket = _buckets[provider] = TokenBucket(rpm, burst)
+        return bucket
+
+
+def _parse_retry_after(value: Optional[str]) -> Optional[float]:
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def rate_limit_delay(exc: Exception) -> Optional[float]:
+    """
+    If exc is a 429 from any provider SDK (openai, replicate, requests, httpx),
+    return the Retry-After delay in seconds (0.0 when none was sent).
+    Returns None for anything that is not a rate-limit error.
+    """
+    response = getattr(exc, "response", None)
+    status = (
+        getattr(exc, "status_code", None)
+        or getattr(exc, "status", None)
+        or getattr(response, "status_code", None)
+    )
+    if status != 429:
+        return None
+
+    headers = getattr(response, "headers", None) or {}
+    delay = _parse_retry_after(headers.get("retry-after") or headers.get("Retry-After"))
+    return delay if delay is not None else 0.0
+
+
+# SDK exception classes (openai, replicate) that mean the connection is broken. Auth
+# errors (401/403) are not among them: a rebuilt client has the same bad credentials.
+_TRANSPORT_ERROR_NAMES = {"APIConnectionError", "APITimeoutError"}
+
+
+def is_transport_error(exc: Exception) -> bool:
+    """True for connection and timeout failures from any provider SDK."""
+    if isinstance(exc, (httpx.TransportError, requests.ConnectionError, requests.Timeout, ConnectionError, TimeoutError)):
+        return True
+    return any(cls.__name__ in _TRANSPORT_ERROR_NAMES for cls in type(exc).__mro__)
+
+
+def call_with_quota(
+    provider: str,
+    fn: Callable,
+    *args,
+    retries: int = RATE_LIMIT_RETRIES,
+    limiter: Optional[str] = None,
+    client: Optional[str] = None,
+    **kwargs,
+) -> Any:
+    """
+    Call fn(*args, **kwargs) under the provider's quota.
+    429 responses pause the provider's bucket for Retry-After (or exponential
+    backoff when absent) and the call is retried; other errors propagate.
+
+    limiter names an AdaptiveLimiter (utils/limiter.py) that caps in-flight
+    calls; it is fed each call's latency and every 429.
+
+    client names the registered client fn belongs to; it is reset when the
+    call fails with a transport error (see is_transport_error).
+    """
+    bucket = get_bucket(provider)
+    lim = get_limiter(limiter) if limiter else None
+    for attempt in range(retries + 1):
+        if lim:
+            lim.acquire()
+        waited = bucket.acquire()
+        if waited > 0.5:
+            logging.info(f"Quota wait for {provider}: {waited:.1f}s")
+        start = time.monotonic()
+        try:
+            result = fn(*args, **kwargs)
+        except Exception as e:
+            delay = rate_limit_delay(e)
+            if lim:
+                lim.release(overloaded=delay is not None)
+            if client and delay is None and is_transport_error(e):
+                reset_client(client)
+            if delay is None or attempt == retries:
+                raise
+            delay = delay or 2 ** attempt
+            logging.warning(f"{provider} rate limited (429); backing off {delay:.1f}s")
+            bucket.block_for(delay)
+        else:
+            if lim:
+                lim.release(latency=time.monotonic() - start)
+            return result
@@ -0,0 +1,125 @@
+"""
+Shared, pooled HTTP transport for provider calls.
+
+One keep-alive requests.Session serves every plain HTTP call (provider file
+downloads, OpenRouter), and the OpenAI and Replicate SDK clients each get an
+httpx connection pool of their own. All have connect/read timeouts and bounded
+connection pools. Downloads are streamed with a size cap, and
+prewarm_connections() opens TLS connections to the provider hosts ahead of use
+so the first stage does not pay for them.
+"""
+import os
+import logging
+import threading
+from typing import Iterator, Optional
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "120"))
+OPENAI_READ_TIMEOUT = float(os.getenv("OPENAI_READ_TIMEOUT", "600"))   # long completions and image renders
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "32"))
+MAX_DOWNLOAD_BYTES = int(os.getenv("MAX_DOWNLOAD_BYTES", str(50 * 1024 * 1024)))  # 50 MB
+DOWNLOAD_CHUNK_BYTES = 64 * 1024
+
+PREWARM_URLS = [
+    "https://api.openai.com/v1/",
+    "https://api.replicate.com/v1/",
+    "https://replicate.delivery/",
+    "https://openrouter.ai/api/v1/",
+]
+
+_session: Optional[requests.Session] = None
+_lock = threading.Lock()
+
+
+def http_timeout() -> tuple:
+    """(connect, read) timeout tuple for requests."""
+    return (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT)
+
+
+def get_http_session() -> requests.Session:
+    """Process-wide keep-alive session with a bounded connection pool."""
+    global _session
+    with _lock:
+        if _session is None:
+            retry = Retry(
+                total=3,
+                backoff_factor=0.5,
+                status_forcelist=(502, 503, 504),
+                allowed_methods=("GET", "HEAD"),
+            )
+            adapter = HTTPAdapter(pool_connections=8, pool_maxsize=HTTP_POOL_SIZE, max_retries=retry)
+            session = requests.Session()
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _session = session
+        return _session
+
+
+def new_httpx_transport() -> httpx.HTTPTransport:
+    """
+    A bounded httpx connection pool. Each SDK client gets its own, so a client
+    that is reset (utils/clients.py) can close its pool without touching the others.
+    """
+    return httpx.HTTPTransport(
+        limits=httpx.Limits(
+            max_connections=HTTP_POOL_SIZE,
+            max_keepalive_connections=HTTP_POOL_SIZE,
+        ),
+    )
+
+
+def new_httpx_client(read_timeout: float = HTTP_READ_TIMEOUT) -> httpx.Client:
+    """httpx client on its own connection pool, for SDKs that accept one (OpenAI)."""
+    return httpx.Client(
+        timeout=httpx.Timeout(read_timeout, connect=HTTP_CONNECT_TIMEOUT),
+        transport=new_httpx_transport(),
+    )
+
+
+def iter_download(
+    url: str,
+    max_bytes: int = MAX_DOWNLOAD_BYTES,
+    chunk_size: int = DOWNLOAD_CHUNK_BYTES,
+) -> Iterator[bytes]:
+    """Stream a URL in chunks, refusing bodies larger than max_bytes."""
+    with get_http_session().get(url, stream=True, timeout=http_timeout()) as resp:
+        resp.raise_for_status()
+        declared = int(resp.headers.get("Content-Length") or 0)
+        if declared > max_bytes:
+            raise ValueError(f"Download of {declared} bytes exceeds limit of {max_bytes}: {url}")
+
+        received = 0
+        for chunk in resp.iter_content(chunk_size=chunk_size):
+            received += len(chunk)
+            if received > max_bytes:
+                raise ValueError(f"Download exceeded limit of {max_bytes} bytes: {url}")
+            yield chunk
+
+
+def download_bytes(url: str, max_bytes: int = MAX_DOWNLOAD_BYTES) -> bytes:
+    """Download a (size-capped) URL into memory."""
+    return b"".join(iter_download(url, max_bytes=max_bytes))
+
+
+def _warm(url: str, httpx_client: Optional[httpx.Client] = None) -> None:
+    try:
+        if httpx_client is not None:
+            httpx_client.head(url)
+        else:
+            get_http_session().head(url, timeout=http_timeout())
+    except Exception as e:
+        logging.info(f"Connection pre-warm for {url} failed: {e}")
+
+
+def prewarm_connections(urls: Optional[list] = None, httpx_client: Optional[httpx.Client] = None) -> None:
+    """
+    Open pooled TLS connections to provider hosts in the background: in the
+    shared requests session, or in httpx_client's pool when one is given.
+    """
+    for url in urls or PREWARM_URLS:
+        threading.Thread(target=_warm, args=(url, httpx_client), daemon=True).start()
@@ -0,0 +1,236 @@
+# --- Background storybook worker ---
+"""
+Claims storybook jobs from the SQLite queue (utils/jobs.py) and runs the
+generation pipeline outside of any Streamlit script run.
+
+Usage:
+python worker.py                  # one worker process
+python worker.py --processes 3    # three worker processes on this box
+
+With IMAGE_PROVIDER=local only one process is allowed: each would load its own
+SDXL pool onto the GPU. Scale the local pool with LOCAL_WORKERS instead.
+
+Run from the repository root so fonts under assets/ resolve, next to
+`streamlit run Home.py`, and set EMBEDDED_WORKER=0 for the Streamlit app.
+
+Hosts that only run the Streamlit app (Streamlit Community Cloud) cannot
+start this script. With EMBEDDED_WORKER=1 (the default) the Download page
+starts one worker loop in a background thread of the Streamlit server
+instead (start_embedded_worker).
+"""
+import os
+import time
+import uuid
+import socket
+import logging
+import argparse
+import threading
+import traceback
+from multiprocessing import Process
+from typing import Optional
+
+from utils import jobs
+from utils.checkpoints import JobCheckpoint
+
+WORKER_POLL_SECONDS = float(os.getenv("WORKER_POLL_SECONDS", "2"))
+CLIENT_HEALTH_SECONDS = float(os.getenv("CLIENT_HEALTH_SECONDS", "300"))
+COVER_REFILL_SECONDS = float(os.getenv("COVER_REFILL_SECONDS", "60"))   # pause between cover-pool refills
+EMBEDDED_WORKER = os.getenv("EMBEDDED_WORKER", "1") == "1"   # run a worker thread inside the Streamlit server
+
+
+class LeaseLost(Exception):
+    """The job's lease expired or was taken over; this worker must stop working on it."""
+
+
+def _keep_lease(job_id: str, worker_id: str, stop: threading.Event, lost: threading.Event) -> None:
+    """Heartbeat: renew the lease while the pipeline is running; sets `lost` when it is gone."""
+    while not stop.wait(jobs.JOB_LEASE_SECONDS / 3):
+        try:
+            renewed = jobs.renew_lease(job_id, worker_id)
+        except Exception as e:
+            # e.g. "database is locked": try again on the next beat, the lease has slack for it
+            logging.warning(f"Could not renew lease on job {job_id}: {e}")
+            continue
+        if not renewed:
+            logging.warning(f"Lost lease on job {job_id}; stopping it on this worker.")
+            lost.set()
+            return
+
+
+def _record_event(job_id: str, event: dict, lost: threading.Event) -> None:
+    # Stage boundaries are where a job that lost its lease stops
+    if lost.is_set():
+        raise LeaseLost(job_id)
+    # Progress reporting must never fail the job
+    try:
+        jobs.add_job_event(job_id, event)
+    except Exception as e:
+        logging.warning(f"Could not record progress for job {job_id}: {e}")
+
+
+def process_job(job: dict, worker_id: str) -> None:
+    # Imported here so each worker process loads clients/fonts once, after fork
+    from utils.processor import run_storybook_pipeline
+
+    job_id = job["id"]
+    stop = threading.Event()
+    lost = threading.Event()
+    heartbeat = threading.Thread(target=_keep_lease, args=(job_id, worker_id, stop, lost), daemon=True)
+    heartbeat.start()
+
+    try:
+        # Stage outputs survive failures, so a retried job resumes where it stopped
+        checkpoint = JobCheckpoint(os.path.join(jobs.job_dir(job_id), "checkpoints"))
+        result = run_storybook_pipeline(
+            job["intake"],
+            checkpoint=checkpoint,
+            on_event=lambda event: _record_event(job_id, event, lost),
+        )
+        if lost.is_set():
+            raise LeaseLost(job_id)
+
+        # Fixed on-disk name; the title-derived name is only offered to the browser
+        pdf_path = os.path.join(jobs.job_dir(job_id), "book.pdf")
+        with open(pdf_path, "wb") as f:
+            f.write(result["pdf_bytes"])
+
+        jobs.complete_job(job_id, worker_id, {
+            "title": result["title"],
+            "pdf_path": pdf_path,
+            "pdf_filename": result["pdf_filename"],
+            "audio_url": result["audio_url"],
+            "critical_path": result["report"]["critical_path"],
+            "total_seconds": result["report"]["total_seconds"],
+        })
+        # Stage outputs are only needed to resume a failed attempt
+        checkpoint.clear()
+        logging.info(f"[{worker_id}] Job {job_id} done.")
+
+    except LeaseLost:
+        # Another worker owns the job now; it must not see our result or failure
+        logging.warning(f"[{worker_id}] Job {job_id} abandoned after losing its lease.")
+
+    except Exception as e:
+        logging.error(f"[{worker_id}] Job {job_id} failed: {e}\n{traceback.format_exc()}")
+        jobs.fail_job(job_id, worker_id, str(e))
+
+    finally:
+        stop.set()
+
+
+def _refill_covers(worker_id: str) -> None:
+    """
+    Background thread of the one worker that keeps the cover pool topped up.
+    Off-peak work: one cover at a time, only inside COVER_REFILL_HOURS and
+    while no book is queued or running.
+    """
+    from utils.processor import render_pool_cover
+    from utils.cover_pool import in_refill_window, refill_cover_pool
+
+    while True:
+        time.sleep(COVER_REFILL_SECONDS)
+        if not in_refill_window():
+            continue
+        try:
+            if jobs.count_jobs(jobs.QUEUED) or jobs.count_jobs(jobs.RUNNING):
+                continue
+            refill_cover_pool(render_pool_cover, max_new=1)
+        except Exception as e:
+            logging.warning(f"[{worker_id}] Cover pool refill failed: {e}")
+
+
+def run_worker(worker_id: str = None, refill_covers: bool = False) -> None:
+    """
+    Claim and process jobs forever. refill_covers makes this the worker that
+    refills the cover pool (utils/cover_pool.py); give it to one worker per host.
+    """
+    worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+
+    # Load the pipeline (and pre-warm provider connections) before the first job arrives
+    from utils.processor import start_local_image_pool
+    from utils.clients import check_clients
+    from utils.cover_pool import COVER_POOL_ENABLED
+    # Local image mode: the SDXL workers load their model now, not during the first book
+    start_local_image_pool()
+    if refill_covers and COVER_POOL_ENABLED:
+        threading.Thread(target=_refill_covers, args=(worker_id,), name="cover-refill", daemon=True).start()
+    logging.info(f"Worker {worker_id} started.")
+    last_health_check = 0.0
+
+    while True:
+        job = jobs.claim_job(worker_id)
+        if job is None:
+            # Probe shared clients while idle; broken ones are rebuilt on next use
+            if time.time() - last_health_check > CLIENT_HEALTH_SECONDS:
+                logging.info(f"[{worker_id}] Client health: {check_clients()}")
+                last_health_check = time.time()
+            time.sleep(WORKER_POLL_SECONDS)
+            continue
+
+        logging.info(f"[{worker_id}] Claimed job {job['id']} (attempt {job['attempts']}).")
+        process_job(job, worker_id)
+
+
+def start_embedded_worker() -> Optional[threading.Thread]:
+    """
+    Run one worker loop in a daemon thread of the calling process (the Streamlit
+    server), for deployments without separate worker.py processes. Call once per
+    process; returns None when EMBEDDED_WORKER is off.
+    """
+    if not EMBEDDED_WORKER:
+        return None
+    worker_id = f"{socket.gethostname()}-{os.getpid()}-embedded"
+    thread = threading.Thread(
+        target=run_worker, args=(worker_id,), kwargs={"refill_covers": True},
+        name="embedded-worker", daemon=True,
+    )
+    thread.start()
+    return thread
+
+
+def _image_provider() -> str:
+    # Same lookup as utils/processor.py, without loading the pipeline in the parent process
+    provider = os.getenv("IMAGE_PROVIDER")
+    if provider:
+        return provider
+    import streamlit as st
+    try:
+        return st.secrets.get("IMAGE_PROVIDER", "")
+    except Exception:
+        # No secrets file
+        return ""
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Storybook generation worker")
+    parser.add_argument("--processes", type=int, default=1, help="number of worker processes")
+    args = parser.parse_args()
+
+    if args.processes > 1 and _image_provider() == "local":
+        parser.error(
+            "--processes > 1 cannot be used with IMAGE_PROVIDER=local: every process would load "
+            "its own SDXL pool onto the GPU. Run one process and set LOCAL_WORKERS instead."
+        )
+
+    if args.processes <= 1:
+        run_worker(refill_covers=True)
+        return
+
+    # Only the first process refills the cover pool
+    procs = [
+        Process(target=run_worker, kwargs={"refill_covers": i == 0}, daemon=False)
+        for i in range(args.processes)
+    ]
+    for p in procs:
+        p.start()
+    try:
+        for p in procs:
+            p.join()
+    except KeyboardInterrupt:
+        for p in procs:
+            p.terminate()
+
+
+if __name__ == "__main__":
+    main()